@@ -1,19 +1,290 @@
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import time
+
 import torch
 from audiocraft.models import MusicGen
 from audiocraft.modules.conditioners import ClassifierFreeGuidanceDropout
-import torchaudio
 
-model = MusicGen.get_pretrained("facebook/musicgen-medium") #โหลดโมเดลmusicgen
+from audio_writer import FORMATS, AudioWriter, StreamingAudioWriter, write_audio
+from checkpoint_format import load_weights
+from condition_cache import InferenceConditionCache
+from generation import generate_cached, sampling_params
+from generation_cache import GenerationCache, weights_id
+from instrumentation import DISABLED, Instrumentation
+from longform import render_long
+from lora import load_adapter, merge_adapter
+from streaming import generate_streaming
+from token_artifact import save_tokens
+
+FLOAT_FIELDS = ('duration', 'top_p', 'temperature', 'cfg_coef')
+INT_FIELDS = ('seed', 'top_k')
+
+
+def load_model(weights, cpu_int8=False, adapter=None, condition_cache_mb=64):
+    if cpu_int8:
+        if adapter:
+            raise SystemExit("--adapter cannot be merged into int8 weights")
+        # LM แบบ int8 บน CPU; quantize ครั้งแรกแล้วใช้ cache ใน quantized_cache/
+        from cpu_inference import configure_threads, load_cpu_model
+        configure_threads()
+        model = load_cpu_model("facebook/musicgen-medium", weights)
+    else:
+        model = MusicGen.get_pretrained("facebook/musicgen-medium") #โหลดโมเดลmusicgen
+        if weights:
+            model.lm.load_state_dict(load_weights(weights)) #โหลดโมเดลที่ finetune ไว้ (.pt หรือ .safetensors)
+        if adapter:
+            merge_adapter(dict(model.lm.state_dict()), load_adapter(adapter)) #merge LoRA adapter ลงใน LM ที่โหลดแล้ว
+        model.lm.eval()
+    if condition_cache_mb > 0:
+        # prompt ที่ซ้ำกันใน batch file ไม่ต้องผ่าน T5 ซ้ำ
+        InferenceConditionCache(int(condition_cache_mb * 1024 ** 2)).install(model.lm.condition_provider)
+    return model
+
+
+def _parse_value(name, value):
+    if value is None or value == '':
+        return None
+    if name in FLOAT_FIELDS:
+        return float(value)
+    if name in INT_FIELDS:
+        return int(value)
+    if name == 'use_sampling' and isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return value
+
+
+def read_requests(path, default_duration):
+    # รองรับทั้ง JSONL (หนึ่ง request ต่อบรรทัด) และ CSV ที่มี header
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    requests = []
+    for row in rows:
+        request = {name: _parse_value(name, value) for name, value in row.items()}
+        request['prompt'] = request.get('prompt') or request.get('description')
+        if not request['prompt']:
+            raise ValueError(f"request without prompt: {row}")
+        if request.get('duration') is None:
+            request['duration'] = default_duration
+        requests.append(request)
+    return requests
+
+
+def _slug(text):
+    return re.sub(r'[^0-9A-Za-z]+', '_', text).strip('_')[:40] or 'prompt'
+
+
+def tokens_path(output):
+    return f"{os.path.splitext(output)[0]}.npz"
+
+
+def plan_batches(requests, output_dir, max_batch_seconds, audio_format='wav'):
+    # request ที่เหมือนกันทุกอย่างจะถูก generate ครั้งเดียว แล้วเขียนไปทุกไฟล์ที่ขอ
+    unique = {}
+    for i, request in enumerate(requests):
+        params = sampling_params(request)
+        key = (request['prompt'], request['duration'], request.get('seed'), tuple(sorted(params.items())))
+        output = request.get('output') or os.path.join(output_dir, f"{i:04d}_{_slug(request['prompt'])}.{audio_format}")
+        unique.setdefault(key, []).append(output)
+
+    # จัดกลุ่มตาม duration, seed และ sampling params ซึ่งต้องเหมือนกันใน generate call เดียว
+    groups = {}
+    for key, outputs in unique.items():
+        prompt, duration, seed, params = key
+        groups.setdefault((duration, seed, params), []).append((prompt, outputs))
+
+    batches = []
+    for (duration, seed, params), items in groups.items():
+        batch_size = max(1, int(max_batch_seconds // duration))
+        for start in range(0, len(items), batch_size):
+            batches.append({
+                'duration': duration,
+                'seed': seed,
+                'params': dict(params),
+                'items': items[start:start + batch_size],
+            })
+    return batches
+
+
+def render_long_tokens(model, prompt, duration, output, keep_tokens=False, seed=None, **kwargs):
+    # token ของแต่ละ window ต่อกันเป็น codes ของทั้งเพลง
+    windows = []
+    render_long(model, prompt, duration, output, seed=seed, on_tokens=windows.append if keep_tokens else None,
+                **kwargs)
+    if keep_tokens:
+        save_tokens(tokens_path(output), torch.cat(windows, dim=-1)[0], model_name=model.name,
+                    sample_rate=model.sample_rate, frame_rate=model.frame_rate, description=prompt, seed=seed)
+
+
+def render_long_batch(model, batch, keep_tokens=False, **long_args):
+    # เพลงที่ยาวกว่า window ของโมเดลสร้างทีละเพลงและเขียนลงไฟล์ระหว่างทาง
+    for prompt, outputs in batch['items']:
+        directory = os.path.dirname(outputs[0])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        render_long_tokens(model, prompt, batch['duration'], outputs[0], keep_tokens, seed=batch['seed'],
+                           **long_args, **batch['params'])
+        for output in outputs[1:]:
+            shutil.copyfile(outputs[0], output)
+            if keep_tokens:
+                shutil.copyfile(tokens_path(outputs[0]), tokens_path(output))
+
+
+def run_batch_file(model, path, output_dir, default_duration, max_batch_seconds, writer_threads,
+                   cache=None, weights=None, long_args=None, instrumentation=DISABLED, audio_format='wav',
+                   keep_tokens=False):
+    requests = read_requests(path, default_duration)
+    batches = plan_batches(requests, output_dir, max_batch_seconds, audio_format)
+    print(f"📋 {len(requests)} requests -> {sum(len(b['items']) for b in batches)} unique, {len(batches)} batches")
+
+    total_audio, total_time = 0.0, 0.0
+    with AudioWriter(max_workers=writer_threads) as writer:
+        for n, batch in enumerate(batches, 1):
+            prompts = [prompt for prompt, _ in batch['items']]
+            start = time.perf_counter()
+            with instrumentation.run("batch", batch=n, prompts=len(prompts), duration=batch['duration']) as run, \
+                    run.attach(model):
+                if batch['duration'] > model.max_duration:
+                    render_long_batch(model, batch, keep_tokens, **(long_args or {}))
+                    elapsed = time.perf_counter() - start
+                else:
+                    result = generate_cached(model, prompts, batch['duration'], batch['seed'], cache, weights,
+                                             return_tokens=keep_tokens, **batch['params'])
+                    waveforms, tokens = result if keep_tokens else (result, [None] * len(result))
+                    elapsed = time.perf_counter() - start
+
+                    # เขียน/encode ไฟล์ใน thread ของ AudioWriter จึงวัดได้แค่เวลาส่งงาน
+                    with run.stage("save"):
+                        for waveform, codes, (prompt, outputs) in zip(waveforms, tokens, batch['items']):
+                            for output in outputs:
+                                writer.submit(output, waveform, model.sample_rate)
+                                if codes is not None:
+                                    writer.submit_tokens(tokens_path(output), codes, model_name=model.name,
+                                                         sample_rate=model.sample_rate, frame_rate=model.frame_rate,
+                                                         description=prompt, seed=batch['seed'])
+
+            audio_seconds = len(prompts) * batch['duration']
+            total_audio += audio_seconds
+            total_time += elapsed
+            print(f"batch {n}/{len(batches)}: {len(prompts)} x {batch['duration']:g}s "
+                  f"in {elapsed:.1f}s -> {audio_seconds / elapsed:.2f} audio s/s")
+    print(f"✅ {total_audio:g}s of audio in {total_time:.1f}s ({total_audio / max(total_time, 1e-9):.2f} audio s/s)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate Thai music with the fine-tuned MusicGen")
+    parser.add_argument("--weights", default="saved_models/finetuned_musicgen_lm3.pt",
+                        help="fine-tuned LM weights (.pt or .safetensors), empty string for the base model")
+    parser.add_argument("--prompt", default="Thai song with saw u")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--output", default="generated_music4.wav")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--batch", default=None, help="JSONL/CSV file of prompts, durations and seeds")
+    parser.add_argument("--output-dir", default="generated")
+    parser.add_argument("--max-batch-seconds", type=float, default=120,
+                        help="memory budget: total seconds of audio per generate call")
+    parser.add_argument("--writer-threads", type=int, default=2)
+    parser.add_argument("--format", choices=FORMATS, default=None,
+                        help="audio format of batch outputs (default wav; single mode follows --output's extension)")
+    parser.add_argument("--save-tokens", action="store_true",
+                        help="also keep the EnCodec codes as a small .npz next to each output "
+                             "(re-decode with token_artifact.py)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse audio of earlier seeded generations stored here")
+    parser.add_argument("--cache-max-gb", type=float, default=2.0)
+    parser.add_argument("--adapter", default=None,
+                        help="LoRA adapter (.safetensors from train.py --lora-rank) merged on top of --weights")
+    parser.add_argument("--condition-cache-mb", type=float, default=64,
+                        help="memory for encoded prompts reused across generations (0 disables)")
+    parser.add_argument("--cpu-int8", action="store_true",
+                        help="run on CPU with a dynamically quantized int8 LM")
+    parser.add_argument("--metrics-file", default=None,
+                        help="append per-stage timings (conditioning, LM, decode, save) to this JSONL file")
+    parser.add_argument("--profile-dir", default=None, help="write a torch profiler trace per generation here")
+    parser.add_argument("--stream", action="store_true",
+                        help="write --output chunk by chunk while the LM is still sampling")
+    parser.add_argument("--chunk-seconds", type=float, default=2.0)
+    parser.add_argument("--window-seconds", type=float, default=30.0,
+                        help="long-form: tokens generated per window for durations beyond the model limit")
+    parser.add_argument("--overlap-seconds", type=float, default=10.0,
+                        help="long-form: tail of the previous window used as the continuation prompt")
+    parser.add_argument("--crossfade-seconds", type=float, default=1.0)
+    return parser.parse_args()
+
 
+if __name__ == "__main__":
+    args = parse_args()
+    model = load_model(args.weights, args.cpu_int8, args.adapter, args.condition_cache_mb)
+    cache = None
+    if args.cache_dir:
+        cache = GenerationCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1024 ** 3))
+    weights = weights_id(args.weights)
+    if args.adapter:
+        weights += f"+lora:{weights_id(args.adapter)}"
+    if args.cpu_int8:
+        # ผลของ int8 ต่างจาก fp32 แม้ seed เดียวกัน จึงแยก cache key
+        weights += ":int8"
+    instrumentation = DISABLED
+    if args.metrics_file or args.profile_dir:
+        instrumentation = Instrumentation(metrics_path=args.metrics_file, profile_dir=args.profile_dir,
+                                          on_record=lambda run: print(f"📊 {run.summary()}"))
+    long_args = {'window_seconds': args.window_seconds, 'overlap_seconds': args.overlap_seconds,
+                 'crossfade_seconds': args.crossfade_seconds}
 
-model.lm.load_state_dict(torch.load("saved_models/finetuned_musicgen_lm3.pt")) #โหลดโมเดลที่ finetune ไว้
-model.lm.eval() 
+    output = args.output
+    if args.format:
+        output = f"{os.path.splitext(output)[0]}.{args.format}"
 
+    if args.duration > model.max_duration and not args.batch:
+        start = time.perf_counter()
+        render_long_tokens(model, args.prompt, args.duration, output, args.save_tokens, seed=args.seed,
+                           on_progress=lambda p: print(f"{p * 100:5.1f}% ({time.perf_counter() - start:.0f}s)",
+                                                       end='\r'),
+                           **long_args)
+        print(f"\n✅ เสียงถูกสร้างและบันทึกไว้ที่: {output}")
+    elif args.stream and not args.batch:
+        start = time.perf_counter()
+        with StreamingAudioWriter(output, model.sample_rate, model.audio_channels) as writer:
+            def on_chunk(chunk):
+                writer.write(chunk[0])
+                print(f"🔊 {writer.frames / model.sample_rate:.1f}s written after {time.perf_counter() - start:.1f}s")
+            _, codes = generate_streaming(model, [args.prompt], args.duration, on_chunk,
+                                          chunk_seconds=args.chunk_seconds, seed=args.seed, return_tokens=True)
+        if args.save_tokens:
+            save_tokens(tokens_path(output), codes[0], model_name=model.name, sample_rate=model.sample_rate,
+                        frame_rate=model.frame_rate, description=args.prompt, seed=args.seed)
+        print(f"✅ เสียงถูกสร้างและบันทึกไว้ที่: {output}")
+    elif args.batch:
+        run_batch_file(model, args.batch, args.output_dir, args.duration, args.max_batch_seconds,
+                       args.writer_threads, cache, weights, long_args, instrumentation, args.format or 'wav',
+                       args.save_tokens)
+    else:
+        descriptions = [args.prompt] #prompt
 
-descriptions = ["Thai song with saw u"] #prompt
+        with instrumentation.run("single", duration=args.duration) as run:
+            with run.attach(model):
+                # ความยาวเสียง (วินาที)
+                result = generate_cached(model, descriptions, args.duration, args.seed, cache, weights,
+                                         return_tokens=args.save_tokens)
+            waveforms = result[0] if args.save_tokens else result
 
-model.set_generation_params(duration=10)  # ความยาวเสียง (วินาที)
-waveforms = model.generate(descriptions)
+            with run.stage("save"):
+                write_audio(output, waveforms[0], model.sample_rate)
+                if args.save_tokens:
+                    save_tokens(tokens_path(output), result[1][0], model_name=model.name,
+                                sample_rate=model.sample_rate, frame_rate=model.frame_rate,
+                                description=args.prompt, seed=args.seed)
+        print(f"✅ เสียงถูกสร้างและบันทึกไว้ที่: {output}")
 
-torchaudio.save("generated_music4.wav", waveforms[0].cpu(), sample_rate=32000)
-print("✅ เสียงถูกสร้างและบันทึกไว้ที่: generated_music4.wav")
+    if cache is not None:
+        cache.flush()
+        print(f"♻️ cache: {cache.stats()}")
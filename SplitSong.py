@@ -1,24 +1,133 @@
   # SplitSong.py
-import torchaudio
+import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+import torchaudio
+from torchaudio.io import StreamReader
+
+SAMPLE_RATE = 32000
+SEGMENT_DURATION = 15
+CHUNK_DURATION = 1
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac')
+
+
+def find_songs(input_dir):
+    songs = []
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                songs.append(os.path.join(root, name))
+    return sorted(songs)
+
+
+def stream_mono(input_path, sample_rate=SAMPLE_RATE, chunk_duration=CHUNK_DURATION):
+    # ffmpeg ถอดรหัสและ resample ทีละ chunk ขนาดคงที่ ไม่ต้องโหลดทั้งเพลงเข้าหน่วยความจำ
+    reader = StreamReader(input_path)
+    reader.add_basic_audio_stream(
+        frames_per_chunk=int(sample_rate * chunk_duration),
+        sample_rate=sample_rate,
+    )
+    for (chunk,) in reader.stream():
+        if chunk is None or chunk.shape[0] == 0:
+            continue
+        # chunk มีรูปร่าง [frames, channels]
+        yield chunk.mean(dim=1, keepdim=True).t()
+
+
+def iter_segments(input_path, sample_rate=SAMPLE_RATE, segment_duration=SEGMENT_DURATION):
+    samples_per_segment = sample_rate * segment_duration
+    pending = []
+    pending_len = 0
+    for chunk in stream_mono(input_path, sample_rate):
+        pending.append(chunk)
+        pending_len += chunk.shape[1]
+        if pending_len < samples_per_segment:
+            continue
+        buffer = torch.cat(pending, dim=1)
+        n_full = buffer.shape[1] // samples_per_segment
+        for i in range(n_full):
+            yield buffer[:, i * samples_per_segment:(i + 1) * samples_per_segment]
+        rest = buffer[:, n_full * samples_per_segment:].clone()
+        pending = [rest]
+        pending_len = rest.shape[1]
+    # ท่อนสุดท้ายที่สั้นกว่า segment จะถูกข้ามเหมือนเดิม
+
+
+def description_for(input_path, input_dir, default=None):
+    if default:
+        return default
+    parent = os.path.dirname(os.path.relpath(input_path, input_dir))
+    if parent:
+        return os.path.basename(parent)
+    return os.path.splitext(os.path.basename(input_path))[0]
+
+
+def split_song(input_path, input_dir, output_dir, description=None,
+               sample_rate=SAMPLE_RATE, segment_duration=SEGMENT_DURATION):
+    rel_dir = os.path.dirname(os.path.relpath(input_path, input_dir))
+    clip_dir = os.path.join(output_dir, rel_dir)
+    os.makedirs(clip_dir, exist_ok=True)
+
+    basename = os.path.splitext(os.path.basename(input_path))[0].replace(' ', '_')
+    description = description_for(input_path, input_dir, description)
+    entries = []
+    for i, clip in enumerate(iter_segments(input_path, sample_rate, segment_duration)):
+        filename = f"{basename}_{i}.wav"
+        torchaudio.save(os.path.join(clip_dir, filename), clip, sample_rate)
+        entries.append({
+            "audio": os.path.join(rel_dir, filename).replace(os.sep, '/'),
+            "description": description,
+        })
+    return entries
+
+
+def _init_worker():
+    # แต่ละ process ใช้ 1 thread เพื่อไม่ให้แย่ง core กันเอง
+    torch.set_num_threads(1)
+
+
+def split_songs(input_dir, output_dir, description=None, workers=None,
+                sample_rate=SAMPLE_RATE, segment_duration=SEGMENT_DURATION):
+    songs = find_songs(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(split_song, song, input_dir, output_dir, description, sample_rate, segment_duration): song
+            for song in songs
+        }
+        for future in as_completed(futures):
+            song = futures[future]
+            try:
+                results[song] = future.result()
+                print(f"✅ {os.path.relpath(song, input_dir)}: {len(results[song])} clips")
+            except Exception as e:
+                print(f"❌ {os.path.relpath(song, input_dir)}: {e}")
+
+    # เรียง manifest ตามลำดับไฟล์ เพื่อให้ผลลัพธ์เหมือนเดิมทุกครั้ง
+    manifest = [entry for song in songs for entry in results.get(song, [])]
+    with open(os.path.join(output_dir, "data.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Split a folder of songs into fixed-length training clips")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--description", default=None,
+                        help="description for every clip (default: name of the song's folder)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sample-rate", type=int, default=SAMPLE_RATE)
+    parser.add_argument("--segment-duration", type=int, default=SEGMENT_DURATION)
+    return parser.parse_args()
+
 
-input_path = ""
-output_dir = ""
-os.makedirs(output_dir, exist_ok=True)
-
-waveform, sr = torchaudio.load(input_path)
-waveform = torchaudio.transforms.Resample(sr, 32000)(waveform)
-if waveform.shape[0] > 1:
-    waveform = waveform.mean(dim=0, keepdim=True)
-
-segment_duration = 15
-samples_per_segment = 32000 * segment_duration
-total_samples = waveform.shape[1]
-
-basename = "song_clipO"
-for i in range(0, total_samples, samples_per_segment):
-    clip = waveform[:, i:i + samples_per_segment]
-    if clip.shape[1] < samples_per_segment:
-        continue
-    out_path = os.path.join(output_dir, f"{basename}_{i // samples_per_segment}.wav")
-    torchaudio.save(out_path, clip, 32000)
+if __name__ == "__main__":
+    args = parse_args()
+    manifest = split_songs(args.input_dir, args.output_dir, args.description, args.workers,
+                           args.sample_rate, args.segment_duration)
+    print(f"✅ {len(manifest)} clips, manifest: {os.path.join(args.output_dir, 'data.json')}")
@@ -0,0 +1,96 @@
+import collections
+import threading
+
+import pygame
+import torch
+
+from resampling import StreamResampler, resample
+
+
+def mixer_settings():
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+    mixer_rate, mixer_format, mixer_channels = pygame.mixer.get_init()
+    if mixer_format != -16:
+        raise RuntimeError(f"pygame mixer must use 16-bit signed samples, got format {mixer_format}")
+    return mixer_rate, mixer_channels
+
+
+def to_sound(waveform, sample_rate):
+    # tensor [C, N] -> pygame Sound ที่ rate และจำนวน channel ของ mixer
+    mixer_rate, mixer_channels = mixer_settings()
+    audio = waveform.detach().cpu().float()
+    if audio.dim() == 3:
+        audio = audio[0]
+    audio = resample(audio, sample_rate, mixer_rate)
+    if audio.shape[0] != mixer_channels:
+        audio = audio.mean(dim=0, keepdim=True).expand(mixer_channels, -1)
+    pcm = (audio.clamp(-1, 1).t().contiguous() * 32767).round().to(torch.int16)
+    return pygame.mixer.Sound(buffer=pcm.numpy().tobytes())
+
+
+class ChunkPlayer:
+    # เล่นเสียงต่อกันทีละ chunk ระหว่างที่ยัง generate อยู่ ผ่าน pygame Channel.queue
+    # Channel รอคิวได้ครั้งละหนึ่ง Sound จึงเก็บ chunk ที่เหลือไว้ แล้วให้ pump() เติมคิวเป็นระยะ
+    def __init__(self, sample_rate):
+        self.mixer_rate, _ = mixer_settings()
+        self.sample_rate = sample_rate
+        # resample ต่อเนื่องข้าม chunk ไม่ให้มี click ตรงรอยต่อ
+        self.resampler = StreamResampler(sample_rate, self.mixer_rate)
+        self.channel = pygame.mixer.find_channel(True)
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self.started = False
+
+    def feed(self, chunk):
+        # เรียกจาก thread ที่ generate ได้ การแปลงเป็น Sound ทำที่นี่ ไม่ต้องรอ GUI
+        audio = chunk.detach().cpu().float()
+        if audio.dim() == 3:
+            audio = audio[0]
+        self._append(self.resampler(audio))
+
+    def finish(self):
+        # เสียงส่วนท้ายที่ resampler ยังถือไว้
+        tail = self.resampler.flush()
+        if tail is not None:
+            self._append(tail)
+
+    def _append(self, audio):
+        if audio.shape[-1] == 0:
+            return
+        sound = to_sound(audio, self.mixer_rate)
+        with self._lock:
+            self._pending.append(sound)
+
+    def pump(self):
+        # เรียกจาก GUI ทุก ~100 ms; คืน True ถ้ายังมีเสียงที่รอเล่นหรือกำลังเล่น
+        with self._lock:
+            if self._pending and not self.channel.get_busy():
+                self.channel.play(self._pending.popleft())
+                self.started = True
+            if self._pending and self.channel.get_queue() is None:
+                self.channel.queue(self._pending.popleft())
+            return bool(self._pending) or self.channel.get_busy()
+
+    def stop(self):
+        with self._lock:
+            self._pending.clear()
+            self.channel.stop()
+
+
+class BufferPlayer:
+    # เล่น waveform ที่อยู่ในหน่วยความจำโดยตรง ไม่ต้องเขียนไฟล์แล้วให้ pygame อ่านกลับ
+    def __init__(self):
+        self.channel = None
+
+    def play(self, waveform, sample_rate):
+        self.stop()
+        self.channel = to_sound(waveform, sample_rate).play()
+
+    def busy(self):
+        return self.channel is not None and self.channel.get_busy()
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+            self.channel = None
@@ -0,0 +1,153 @@
+import io
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import torchaudio
+
+FORMATS = ('wav', 'flac', 'opus')
+# libopus รับเฉพาะ 8/12/16/24/48 kHz จึง resample เป็น 48 kHz ตอน encode
+OPUS_SAMPLE_RATE = 48000
+OPUS_BIT_RATE = 96000
+
+
+def audio_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'ogg':
+        return 'opus'
+    return extension if extension in FORMATS else 'wav'
+
+
+def write_audio(path, waveform, sample_rate, bit_rate=OPUS_BIT_RATE):
+    # รูปแบบไฟล์ตามนามสกุล: .wav (float เหมือนเดิม), .flac (lossless ~ครึ่งหนึ่งของ PCM16), .opus/.ogg (lossy เล็กมาก)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    waveform = waveform.detach().cpu()
+    fmt = audio_format(path)
+    if fmt == 'flac':
+        torchaudio.save(path, waveform.clamp(-1, 1), sample_rate=sample_rate, format='flac', bits_per_sample=16)
+    elif fmt == 'opus':
+        from torchaudio.io import CodecConfig, StreamWriter
+        writer = StreamWriter(path, format='ogg')
+        writer.add_audio_stream(sample_rate, waveform.shape[0], format='flt', encoder='libopus',
+                                encoder_sample_rate=OPUS_SAMPLE_RATE, codec_config=CodecConfig(bit_rate=bit_rate))
+        with writer.open():
+            writer.write_audio_chunk(0, waveform.clamp(-1, 1).t().contiguous())
+    else:
+        torchaudio.save(path, waveform, sample_rate=sample_rate)
+    return path
+
+
+class AudioWriter:
+    # เขียนและ encode ไฟล์เสียง (wav/flac/opus ตามนามสกุล) ใน thread แยก เพื่อไม่ให้โมเดลต้องรอ disk
+    def __init__(self, max_workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio-writer")
+        self.futures = []
+
+    def submit(self, path, waveform, sample_rate):
+        waveform = waveform.detach().cpu()
+        return self._track(self.pool.submit(self._write, path, waveform, sample_rate))
+
+    def submit_tokens(self, path, codes, **metadata):
+        from token_artifact import save_tokens
+        return self._track(self.pool.submit(save_tokens, path, codes.detach().cpu(), **metadata))
+
+    def _track(self, future):
+        # ไม่เก็บงานที่เสร็จเรียบร้อยแล้วไว้ (GUI ใช้ writer ตัวเดียวตลอด) ส่วนงานที่ error เก็บไว้ให้ wait() แจ้ง
+        self.futures = [f for f in self.futures if not f.done() or f.exception() is not None]
+        self.futures.append(future)
+        return future
+
+    @staticmethod
+    def _write(path, waveform, sample_rate):
+        return write_audio(path, waveform, sample_rate)
+
+    def wait(self):
+        futures, self.futures = self.futures, []
+        return [future.result() for future in futures]
+
+    def close(self):
+        try:
+            return self.wait()
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pcm16(waveform):
+    # [C, N] float -> bytes ของ PCM 16-bit แบบ interleaved
+    audio = waveform.detach().cpu().clamp(-1, 1)
+    if audio.dim() == 1:
+        audio = audio.unsqueeze(0)
+    return audio.shape[0], (audio.t().contiguous() * 32767).round().short().numpy().tobytes()
+
+
+def wav_bytes(waveform, sample_rate):
+    # PCM 16-bit WAV ในหน่วยความจำ ใช้ส่งกลับผ่าน HTTP โดยไม่ต้องเขียนไฟล์
+    channels, pcm = pcm16(waveform)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class StreamingWavWriter:
+    # เขียนต่อท้ายไฟล์ WAV ทีละ chunk; โมดูล wave แก้ header ทุกครั้งที่เขียน ไฟล์จึงเปิดอ่านได้ตลอด
+    def __init__(self, path, sample_rate, channels=1):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.frames = 0
+        self._file = open(path, 'wb')
+        self._wav = wave.open(self._file, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+
+    def write(self, waveform):
+        channels, pcm = pcm16(waveform)
+        if channels != self._wav.getnchannels():
+            raise ValueError(f"expected {self._wav.getnchannels()} channels, got {channels}")
+        self._wav.writeframes(pcm)
+        self._file.flush()
+        self.frames += len(pcm) // (2 * channels)
+
+    def close(self):
+        self._wav.close()
+        self._file.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StreamingAudioWriter(StreamingWavWriter):
+    # flac/opus encode ทีละ chunk ไม่ได้ จึงเขียน WAV ชั่วคราวไปก่อนแล้ว encode ทั้งไฟล์ตอนปิด
+    # ถ้าเกิด error กลางทาง ไฟล์ .part.wav จะถูกทิ้งไว้ ไม่มีไฟล์ครึ่งๆ ที่ชื่อจริง
+    def __init__(self, path, sample_rate, channels=1):
+        self.target = path
+        super().__init__(path if audio_format(path) == 'wav' else f"{path}.part.wav", sample_rate, channels)
+
+    def close(self, encode=True):
+        super().close()
+        if self.path != self.target and encode:
+            waveform, sample_rate = torchaudio.load(self.path)
+            write_audio(self.target, waveform, sample_rate)
+            os.remove(self.path)
+        return self.target
+
+    def __exit__(self, exc_type, *exc):
+        self.close(encode=exc_type is None)
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import torch
+import torchaudio
+from torch.utils.data import DataLoader
+
+# ทุก benchmark รันบน CPU กับโมเดล 'debug' ของ audiocraft (ไม่ต้องโหลดอะไรจาก network)
+# ตัวเลขทุกตัวใน results ยิ่งมากยิ่งดี compare จึงตัดสิน regression ได้แบบเดียวกันทุกค่า
+BENCH_MODEL = "debug"
+SUITES = ("generation", "training", "loader", "split")
+
+
+def _median_rate(fn, amount, repeats):
+    # เรียกหนึ่งครั้งเป็น warm-up แล้วใช้ค่ามัธยฐานของ amount/วินาที
+    fn()
+    rates = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        rates.append(amount / (time.perf_counter() - start))
+    return statistics.median(rates)
+
+
+def load_bench_model():
+    from audiocraft.models import MusicGen
+    return MusicGen.get_pretrained(BENCH_MODEL, device='cpu')
+
+
+def write_synthetic_songs(root, count, seconds, sample_rate):
+    # เสียง sine + noise ที่สร้างจาก seed คงที่ ให้ทุกครั้งได้ข้อมูลเดียวกัน
+    generator = torch.Generator().manual_seed(0)
+    os.makedirs(root, exist_ok=True)
+    paths = []
+    t = torch.arange(int(seconds * sample_rate)) / sample_rate
+    for i in range(count):
+        tone = torch.sin(2 * math.pi * (220 + 55 * i) * t)
+        noise = 0.05 * torch.randn(2, t.shape[0], generator=generator)
+        path = os.path.join(root, f"song_{i:03d}.wav")
+        torchaudio.save(path, (0.5 * tone + noise).clamp(-1, 1), sample_rate)
+        paths.append(path)
+    return paths
+
+
+def write_synthetic_dataset(workdir, clips, seconds):
+    audio_dir = os.path.join(workdir, "clips")
+    paths = write_synthetic_songs(audio_dir, clips, seconds, 44100)
+    metadata = os.path.join(workdir, "clips.json")
+    with open(metadata, 'w') as f:
+        json.dump([{"audio": os.path.basename(p), "description": "benchmark"} for p in paths], f)
+    return metadata, audio_dir
+
+
+def bench_generation(model, durations, batch_sizes, repeats):
+    from generation import generate_batch
+    results = {}
+    for duration in durations:
+        for batch_size in batch_sizes:
+            prompts = [f"benchmark prompt {i}" for i in range(batch_size)]
+            rate = _median_rate(lambda: generate_batch(model, prompts, duration, seed=0),
+                                duration * batch_size, repeats)
+            results[f"generation/d={duration:g}/b={batch_size}"] = {'audio_seconds_per_second': rate}
+    return results
+
+
+def bench_training(model, batch_sizes, duration, steps):
+    from train import MusicGenFinetuning
+    module = MusicGenFinetuning(model=model)
+    optimizer = torch.optim.AdamW(module.model.lm.parameters(), lr=1e-5)
+    results = {}
+    for batch_size in batch_sizes:
+        inputs = torch.randn(batch_size, 1, int(duration * model.sample_rate),
+                             generator=torch.Generator().manual_seed(0)).clamp(-1, 1)
+        batch = (inputs, [f"benchmark prompt {i}" for i in range(batch_size)])
+
+        def step():
+            loss = module.training_step(batch)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        with warnings.catch_warnings():
+            # self.log นอก Trainer จะเตือนทุก step
+            warnings.simplefilter("ignore")
+            rate = _median_rate(lambda: [step() for _ in range(steps)], steps * batch_size, 3)
+        results[f"training/b={batch_size}/d={duration:g}"] = {'samples_per_second': rate}
+    return results
+
+
+def bench_loader(workdir, worker_counts, clips, segment_duration, sample_rate, batch_size):
+    from train import DescriptiveAudioDataset, custom_collate
+    metadata, audio_dir = write_synthetic_dataset(workdir, clips, segment_duration)
+    dataset = DescriptiveAudioDataset(metadata, audio_dir, segment_duration, sample_rate)
+    results = {}
+    for num_workers in worker_counts:
+        def epoch():
+            loader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate,
+                                num_workers=num_workers)
+            for _ in loader:
+                pass
+        results[f"loader/workers={num_workers}"] = {'samples_per_second': _median_rate(epoch, len(dataset), 3)}
+    return results
+
+
+def bench_split(workdir, worker_counts, songs, song_seconds):
+    from SplitSong import split_songs
+    input_dir = os.path.join(workdir, "songs")
+    write_synthetic_songs(input_dir, songs, song_seconds, 44100)
+    results = {}
+    for workers in worker_counts:
+        output_dir = os.path.join(workdir, f"split-{workers}")
+
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                split_songs(input_dir, output_dir, "benchmark", workers=workers)
+        rate = _median_rate(run, songs * song_seconds, 2)
+        results[f"split/workers={workers}"] = {'audio_seconds_per_second': rate}
+    return results
+
+
+def scaling(args):
+    # รัน train.py --cpu-processes N จริงทีละค่า N (แต่ละ rank ได้ core / N thread) กับโมเดล debug
+    # จึงวัดทั้ง DDP, all-reduce ผ่าน gloo และการแบ่ง dataset ตาม rank แบบเดียวกับตอนเทรน
+    train_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+    counts = [int(n) for n in args.processes.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        clips = args.batch_size * max(counts) * (args.steps + 2)
+        metadata, audio_dir = write_synthetic_dataset(workdir, clips, args.segment_duration)
+        for processes in counts:
+            output = os.path.join(workdir, f"throughput-{processes}.json")
+            subprocess.run([
+                sys.executable, train_script, "--model", BENCH_MODEL, "--metadata", metadata,
+                "--audio-dir", audio_dir, "--segment-duration", str(args.segment_duration),
+                "--sample-rate", "32000", "--batch-size", str(args.batch_size), "--num-workers", "0",
+                "--cpu-processes", str(processes), "--max-steps", str(args.steps + 2), "--max-epochs", "1",
+                "--checkpoint-every", "0", "--throughput-file", output,
+            ] + (["--precision", args.precision] if args.precision else []), cwd=workdir, check=True)
+            with open(output) as f:
+                results[processes] = json.load(f)
+            print(f"processes={processes}: {results[processes]['samples_per_second']:.2f} samples/s")
+
+    base = results[counts[0]]['samples_per_second'] / counts[0]
+    report = {'environment': environment(), 'runs': []}
+    for processes in counts:
+        rate = results[processes]['samples_per_second']
+        report['runs'].append({**results[processes], 'processes': processes,
+                               'speedup': rate / results[counts[0]]['samples_per_second'],
+                               'efficiency': rate / (base * processes)})
+    return report
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit or None,
+        'recorded_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'threads': torch.get_num_threads(),
+    }
+
+
+def run(args):
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    suites = args.suites.split(',') if args.suites else SUITES
+    quick = args.quick
+    results = {}
+    model = load_bench_model() if {'generation', 'training'} & set(suites) else None
+    with tempfile.TemporaryDirectory() as workdir:
+        if 'generation' in suites:
+            results.update(bench_generation(model, [2] if quick else [2, 5, 10], [1, 4] if quick else [1, 2, 4, 8],
+                                            repeats=1 if quick else 3))
+        if 'training' in suites:
+            # training_step ต้องใช้โมเดลที่ยังไม่ถูกแก้ไข จึงโหลดใหม่แยกจาก generation
+            results.update(bench_training(load_bench_model(), [2] if quick else [1, 4, 8], 2 if quick else 5,
+                                          steps=2 if quick else 5))
+        if 'loader' in suites:
+            results.update(bench_loader(workdir, [0, 2] if quick else [0, 1, 2, 4], 8 if quick else 32,
+                                        5, 32000, 4))
+        if 'split' in suites:
+            results.update(bench_split(workdir, [1, 2] if quick else [1, 2, 4], 2 if quick else 8,
+                                       20 if quick else 60))
+    return {'environment': environment(), 'quick': quick, 'results': results}
+
+
+def compare(baseline, current, tolerance):
+    # คืนจำนวน metric ที่ช้าลงเกิน tolerance
+    regressions = 0
+    print(f"{'benchmark':40s} {'metric':26s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        base_metrics = baseline['results'].get(name, {})
+        new_metrics = current['results'].get(name, {})
+        for metric in sorted(set(base_metrics) | set(new_metrics)):
+            old, new = base_metrics.get(metric), new_metrics.get(metric)
+            if old is None or new is None:
+                print(f"{name:40s} {metric:26s} {old or '-':>12} {new or '-':>12} {'n/a':>8s}")
+                continue
+            change = new / old - 1
+            flag = ""
+            if change < -tolerance:
+                regressions += 1
+                flag = "  ❌ regression"
+            elif change > tolerance:
+                flag = "  ✅"
+            print(f"{name:40s} {metric:26s} {old:12.3f} {new:12.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CPU benchmarks for generation, training and data preparation")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help="run the benchmarks and write JSON results")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--suites", default=None, help=f"comma separated subset of {','.join(SUITES)}")
+    run_parser.add_argument("--threads", type=int, default=4,
+                            help="torch threads, fixed so runs on the same machine are comparable")
+    run_parser.add_argument("--quick", action="store_true", help="fewer sizes and repeats, for a smoke test")
+    scaling_parser = sub.add_parser('scaling', help="CPU data-parallel training samples/s against process count")
+    scaling_parser.add_argument("--output", default="scaling.json")
+    scaling_parser.add_argument("--processes", default="1,2,4")
+    scaling_parser.add_argument("--steps", type=int, default=10, help="measured steps per run, after 2 warm-up steps")
+    scaling_parser.add_argument("--batch-size", type=int, default=2, help="per process")
+    scaling_parser.add_argument("--segment-duration", type=int, default=2)
+    scaling_parser.add_argument("--precision", default=None, help="e.g. bf16-mixed (default 32-true)")
+    compare_parser = sub.add_parser('compare', help="compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10,
+                                help="relative slowdown allowed before a metric counts as a regression")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'run':
+        report = run(args)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        for name, metrics in report['results'].items():
+            print(f"{name:40s} " + ", ".join(f"{k} {v:.2f}" for k, v in metrics.items()))
+        print(f"✅ results written to {args.output}")
+    elif args.command == 'scaling':
+        report = scaling(args)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"{'processes':>10s} {'samples/s':>10s} {'speedup':>8s} {'efficiency':>10s}")
+        for entry in report['runs']:
+            print(f"{entry['processes']:10d} {entry['samples_per_second']:10.2f} {entry['speedup']:8.2f} "
+                  f"{entry['efficiency']:10.1%}")
+        print(f"✅ scaling report written to {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print(f"❌ {regressions} metric(s) slower than baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print("✅ no regressions")
@@ -0,0 +1,127 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import torchaudio
+
+SAMPLE_BYTES = 1 << 16
+MIN_DURATION = 5.0
+
+
+def fingerprint(path, size):
+    # hash ของขนาดไฟล์กับ 64 KB ต้น/กลาง/ท้าย อ่านแค่ ~200 KB ต่อไฟล์ ใช้หาไฟล์ที่อาจซ้ำ
+    # ไฟล์ที่ fingerprint ชนกันจะถูก hash ทั้งไฟล์อีกครั้งเพื่อยืนยัน
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - SAMPLE_BYTES // 2), max(0, size - SAMPLE_BYTES)}):
+            f.seek(offset)
+            h.update(f.read(SAMPLE_BYTES))
+    return h.hexdigest()
+
+
+def full_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def probe(path):
+    # อ่านเฉพาะ header ของไฟล์ ไม่ decode เสียง
+    try:
+        size = os.path.getsize(path)
+        info = torchaudio.info(path)
+        frames = info.num_frames
+        if frames <= 0:
+            # บาง format (เช่น mp3 ที่ไม่มี header บอกความยาว) ต้อง decode ถึงจะรู้จำนวน frame
+            frames = torchaudio.load(path)[0].shape[1]
+        return {
+            'sample_rate': info.sample_rate,
+            'channels': info.num_channels,
+            'frames': frames,
+            'duration': frames / info.sample_rate if info.sample_rate else 0.0,
+            'fingerprint': fingerprint(path, size),
+        }
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+
+def build_manifest(metadata_path, audio_dir, min_duration=MIN_DURATION, sample_rate=None, workers=None,
+                   chunksize=256):
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    paths = [os.path.join(audio_dir, item['audio']) for item in metadata]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        infos = list(pool.map(probe, paths, chunksize=chunksize))
+
+        # ยืนยันเฉพาะกลุ่มที่ fingerprint ชนกันด้วย hash ทั้งไฟล์
+        groups = defaultdict(list)
+        for i, info in enumerate(infos):
+            if 'fingerprint' in info:
+                groups[info['fingerprint']].append(i)
+        candidates = [i for members in groups.values() if len(members) > 1 for i in members]
+        for i, digest in zip(candidates, pool.map(full_hash, [paths[i] for i in candidates], chunksize=16)):
+            infos[i]['fingerprint'] = digest
+
+    manifest, rejected = [], []
+    first_by_hash = {}
+    for item, path, info in zip(metadata, paths, infos):
+        if 'error' in info:
+            reason = 'unreadable' if os.path.exists(path) else 'missing'
+            rejected.append({**item, 'reason': reason, 'error': info['error']})
+            continue
+        if info['duration'] < min_duration:
+            rejected.append({**item, 'reason': 'too_short', 'duration': info['duration']})
+            continue
+        if sample_rate is not None and info['sample_rate'] != sample_rate:
+            rejected.append({**item, 'reason': 'sample_rate', 'sample_rate': info['sample_rate']})
+            continue
+        digest = info.pop('fingerprint')
+        if digest in first_by_hash:
+            rejected.append({**item, 'reason': 'duplicate', 'duplicate_of': first_by_hash[digest]})
+            continue
+        first_by_hash[digest] = item['audio']
+        manifest.append({**item, **info, 'hash': digest})
+    return manifest, rejected
+
+
+def write_json(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validate training clips from their headers and write an "
+                                                 "enriched, deduplicated manifest")
+    parser.add_argument("metadata", help="data.json with 'audio' and 'description' per clip")
+    parser.add_argument("audio_dir")
+    parser.add_argument("--output", default=None, help="default: <metadata>.manifest.json")
+    parser.add_argument("--rejected", default=None, help="default: <metadata>.rejected.json")
+    parser.add_argument("--min-duration", type=float, default=MIN_DURATION)
+    parser.add_argument("--sample-rate", type=int, default=None,
+                        help="reject clips that are not at this sample rate")
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stem = os.path.splitext(args.metadata)[0]
+    output = args.output or f"{stem}.manifest.json"
+    rejected_path = args.rejected or f"{stem}.rejected.json"
+    manifest, rejected = build_manifest(args.metadata, args.audio_dir, args.min_duration, args.sample_rate,
+                                        args.workers)
+    write_json(manifest, output)
+    write_json(rejected, rejected_path)
+    hours = sum(item['duration'] for item in manifest) / 3600
+    print(f"✅ {len(manifest)} clips ({hours:.2f} h) -> {output}")
+    if rejected:
+        reasons = Counter(item['reason'] for item in rejected)
+        print(f"⚠️ {len(rejected)} rejected ({', '.join(f'{k} {v}' for k, v in reasons.items())}) -> {rejected_path}")
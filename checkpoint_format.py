@@ -0,0 +1,137 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+import torch
+
+# รูปแบบไฟล์เดียวกับ safetensors: [ขนาด header 8 ไบต์][header JSON][ข้อมูล tensor ต่อกัน]
+# เปิดด้วย mmap ได้ทันทีโดยไม่ต้อง copy และเก็บ checksum ไว้ใน header ใช้เป็น cache key ได้เลย
+EXTENSIONS = ('.safetensors', '.st')
+DTYPES = {
+    torch.float32: 'F32',
+    torch.float16: 'F16',
+    torch.bfloat16: 'BF16',
+    torch.int64: 'I64',
+    torch.int32: 'I32',
+    torch.int16: 'I16',
+    torch.int8: 'I8',
+    torch.uint8: 'U8',
+    torch.bool: 'BOOL',
+}
+TORCH_DTYPES = {name: dtype for dtype, name in DTYPES.items()}
+STORAGE_DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+
+def is_mapped_format(path):
+    return str(path).lower().endswith(EXTENSIONS)
+
+
+def _tensor_bytes(tensor):
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+def save_weights(state_dict, path, dtype=None, metadata=None):
+    tensors = {}
+    for name, tensor in state_dict.items():
+        if dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        tensors[name] = tensor.detach().cpu().contiguous()
+
+    # เรียงจาก element ใหญ่ไปเล็ก ให้ทุก tensor อยู่บน offset ที่ align กับขนาดของมัน
+    names = sorted(tensors, key=lambda n: (-tensors[n].element_size(), n))
+    header = {}
+    checksum = hashlib.sha256()
+    offset = 0
+    for name in names:
+        tensor = tensors[name]
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {
+            'dtype': DTYPES[tensor.dtype],
+            'shape': list(tensor.shape),
+            'data_offsets': [offset, offset + size],
+        }
+        checksum.update(_tensor_bytes(tensor))
+        offset += size
+
+    header['__metadata__'] = dict(metadata or {}, format='pt', checksum=checksum.hexdigest())
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    header_bytes += b' ' * (-len(header_bytes) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name in names:
+            f.write(_tensor_bytes(tensors[name]).tobytes())
+    os.replace(tmp_path, path)
+    return header['__metadata__']['checksum']
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        (header_size,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def checksum(path):
+    header, _ = read_header(path)
+    return header.get('__metadata__', {}).get('checksum')
+
+
+def load_mapped_weights(path):
+    # tensor ที่ได้เป็น view บน mmap ของไฟล์ หน้า memory จะถูกอ่านจาก disk เมื่อใช้งานจริงเท่านั้น
+    header, data_start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start)
+    state_dict = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        begin, end = info['data_offsets']
+        tensor = torch.from_numpy(data[begin:end]).view(TORCH_DTYPES[info['dtype']])
+        state_dict[name] = tensor.reshape(info['shape'])
+    return state_dict
+
+
+def load_weights(path, map_location='cpu'):
+    if is_mapped_format(path):
+        return load_mapped_weights(path)
+    try:
+        return torch.load(path, map_location=map_location, mmap=True)
+    except (TypeError, RuntimeError):
+        # torch เก่าหรือไฟล์ pickle แบบเดิมที่ mmap ไม่ได้
+        return torch.load(path, map_location=map_location)
+
+
+def convert(src, dst, dtype=None):
+    state_dict = load_weights(src)
+    digest = save_weights(state_dict, dst, dtype=STORAGE_DTYPES.get(dtype), metadata={'source': os.path.basename(src)})
+    src_size, dst_size = os.path.getsize(src), os.path.getsize(dst)
+    print(f"✅ {src} ({src_size / 1e9:.2f} GB) -> {dst} ({dst_size / 1e9:.2f} GB), checksum {digest[:16]}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert LM checkpoints to a memory-mappable format")
+    sub = parser.add_subparsers(dest='command', required=True)
+    conv = sub.add_parser('convert', help="convert a .pt state dict to .safetensors")
+    conv.add_argument('src')
+    conv.add_argument('dst')
+    conv.add_argument('--dtype', choices=sorted(STORAGE_DTYPES), default=None,
+                      help="storage dtype for floating point tensors (default: keep)")
+    info = sub.add_parser('info', help="print the header metadata of a converted file")
+    info.add_argument('path')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'convert':
+        convert(args.src, args.dst, args.dtype)
+    else:
+        header, _ = read_header(args.path)
+        tensors = [v for k, v in header.items() if k != '__metadata__']
+        print(json.dumps(header.get('__metadata__', {}), indent=2))
+        print(f"{len(tensors)} tensors, dtypes: {sorted({t['dtype'] for t in tensors})}")
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+INDEX_FILE = "index.json"
+SHARD_FILE = "codes-{:05d}.npy"
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def module_digest(module):
+    h = hashlib.sha1()
+    for name, tensor in sorted(module.state_dict().items()):
+        h.update(name.encode())
+        h.update(tensor.detach().float().cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+def checkpoint_identity(model_name, filename="compression_state_dict.bin"):
+    # identity ราคาถูกของไฟล์ weights ของ compression model โดยไม่ต้องโหลดโมเดล ใช้ตรวจ cache แบบเร็ว
+    # ไฟล์ในเครื่องใช้ขนาด/mtime, โมเดลบน Hugging Face ใช้ etag (sha256 ของไฟล์) ซึ่งเปลี่ยนเมื่อมี weights ใหม่
+    # ชื่อเดิม; offline ใช้ชื่อ blob ของไฟล์ที่ดาวน์โหลดไว้ซึ่งก็คือ etag เดียวกัน คืน None ถ้าบอกไม่ได้
+    path = model_name if os.path.isfile(model_name) else os.path.join(model_name, filename)
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    try:
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url
+        return get_hf_file_metadata(hf_hub_url(model_name, filename)).etag
+    except Exception:
+        pass
+    try:
+        from huggingface_hub import try_to_load_from_cache
+        path = try_to_load_from_cache(model_name, filename)
+    except Exception:
+        return None
+    return os.path.basename(os.path.realpath(path)) if isinstance(path, str) else None
+
+
+def cache_settings(model_name, compression_model, dataset):
+    # ทุกค่าที่มีผลต่อ codes ต้องอยู่ในนี้ ถ้าค่าใดเปลี่ยน cache จะถูกสร้างใหม่
+    return {
+        'model': model_name,
+        'checkpoint': checkpoint_identity(model_name),
+        'weights': module_digest(compression_model),
+        'model_sample_rate': compression_model.sample_rate,
+        'frame_rate': compression_model.frame_rate,
+        'num_codebooks': compression_model.num_codebooks,
+        'sample_rate': dataset.sample_rate,
+        'segment_duration': dataset.segment_duration,
+        'manifest': file_digest(dataset.metadata_path),
+    }
+
+
+def settings_key(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def read_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+class CodeShardWriter:
+    def __init__(self, cache_dir, settings, total, num_codebooks, frames, shard_size=1024):
+        self.cache_dir = cache_dir
+        self.settings = settings
+        self.total = total
+        self.num_codebooks = num_codebooks
+        self.frames = frames
+        self.shard_size = shard_size
+        self.shards = []
+        self.written = 0
+        self._shard = None
+        self._row = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # ลบ index เก่าก่อน เพื่อไม่ให้ cache ที่เขียนไม่ครบถูกนำไปใช้
+        index_path = os.path.join(cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    def _open_shard(self):
+        rows = min(self.shard_size, self.total - self.written)
+        filename = SHARD_FILE.format(len(self.shards))
+        self._shard = np.lib.format.open_memmap(
+            os.path.join(self.cache_dir, filename), mode='w+', dtype=np.int16,
+            shape=(rows, self.num_codebooks, self.frames)
+        )
+        self._row = 0
+        self.shards.append({'file': filename, 'count': rows})
+
+    def write(self, codes):
+        codes = codes.detach().cpu().numpy().astype(np.int16)
+        for item in codes:
+            if self._shard is None or self._row == len(self._shard):
+                if self._shard is not None:
+                    self._shard.flush()
+                self._open_shard()
+            self._shard[self._row] = item
+            self._row += 1
+            self.written += 1
+
+    def close(self):
+        if self.written != self.total:
+            raise RuntimeError(f"code cache incomplete: wrote {self.written} of {self.total} items")
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+        index = {
+            'key': settings_key(self.settings),
+            'settings': self.settings,
+            'num_codebooks': self.num_codebooks,
+            'frames': self.frames,
+            'shard_size': self.shard_size,
+            'shards': self.shards,
+            'count': self.total,
+        }
+        with open(os.path.join(self.cache_dir, INDEX_FILE), 'w') as f:
+            json.dump(index, f, indent=2)
+
+
+class CodeCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index = read_index(cache_dir)
+        if self.index is None:
+            raise FileNotFoundError(f"no code cache index in {cache_dir}")
+        self.settings = self.index['settings']
+        self.shard_size = self.index['shard_size']
+        self._shards = {}
+
+    def __len__(self):
+        return self.index['count']
+
+    def _get_shard(self, shard_idx):
+        # เปิดแบบ mmap ตอนใช้งานครั้งแรก ให้แต่ละ DataLoader worker เปิดไฟล์ของตัวเอง
+        shard = self._shards.get(shard_idx)
+        if shard is None:
+            path = os.path.join(self.cache_dir, self.index['shards'][shard_idx]['file'])
+            shard = np.load(path, mmap_mode='r')
+            self._shards[shard_idx] = shard
+        return shard
+
+    def __getitem__(self, idx):
+        shard_idx, row = divmod(idx, self.shard_size)
+        return self._get_shard(shard_idx)[row]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+
+def _collate_waveforms(batch):
+    return torch.stack([waveform for waveform, _ in batch])
+
+
+def is_cache_valid(cache_dir, settings):
+    index = read_index(cache_dir)
+    return index is not None and index['key'] == settings_key(settings)
+
+
+def build_code_cache(compression_model, model_name, dataset, cache_dir,
+                     batch_size=8, num_workers=4, shard_size=1024, force=False):
+    settings = cache_settings(model_name, compression_model, dataset)
+    if not force and is_cache_valid(cache_dir, settings):
+        print(f"✅ code cache is up to date: {cache_dir}")
+        return read_index(cache_dir)
+
+    loader = DataLoader(dataset, batch_size=batch_size, collate_fn=_collate_waveforms,
+                        num_workers=num_workers, shuffle=False)
+    device = next(iter(compression_model.parameters())).device
+    writer = None
+    with torch.no_grad():
+        for waveforms in loader:
+            codes, _ = compression_model.encode(waveforms.to(device))
+            if writer is None:
+                writer = CodeShardWriter(cache_dir, settings, len(dataset), codes.shape[1],
+                                         codes.shape[2], shard_size=shard_size)
+            writer.write(codes)
+            print(f"encoded {writer.written}/{len(dataset)}", end='\r')
+    if writer is None:
+        raise ValueError("dataset is empty, nothing to encode")
+    writer.close()
+    print(f"\n✅ code cache written to: {cache_dir}")
+    return read_index(cache_dir)
@@ -0,0 +1,194 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+import torch.nn.functional as F
+
+ATTRIBUTE = 'description'
+
+
+class TrainingConditionCache:
+    # เก็บผลของ text encoder (ส่วนที่ frozen) ไว้ต่อ description เดียว
+    # ส่วนที่เทรนได้ (output_proj ของ T5Conditioner หรือ embedding ของ LUT) ยังรันทุก step จึงยังได้ gradient
+    # แต่ word dropout ของ T5Conditioner (สุ่มตัดคำทุก step ตอนเทรน) จะไม่เกิดขึ้นอีก เพราะแต่ละ description
+    # ถูก encode แค่ครั้งเดียว ถ้า conditioner เปิด word dropout ไว้ต้องยอมรับเองด้วย allow_word_dropout=True
+    def __init__(self, condition_provider, attribute=ATTRIBUTE, allow_word_dropout=False):
+        extra = set(condition_provider.conditioners.keys()) - {attribute}
+        if extra:
+            raise ValueError(f"condition cache only supports the '{attribute}' condition, model also has {extra}")
+        self.attribute = attribute
+        self.conditioner = condition_provider.conditioners[attribute]
+        word_dropout = getattr(self.conditioner, 'word_dropout', 0.0)
+        if word_dropout > 0 and not allow_word_dropout:
+            raise ValueError(f"the text conditioner uses word_dropout={word_dropout:g}, which the condition cache "
+                             "cannot reproduce; pass allow_word_dropout=True to train without it")
+        self.is_t5 = hasattr(self.conditioner, 't5_tokenizer')
+        self.entries = {}
+        self._device_entries = {}
+
+    @property
+    def key(self):
+        return f"{type(self.conditioner).__name__}:{getattr(self.conditioner, 'name', '')}"
+
+    @torch.no_grad()
+    def _encode_frozen(self, description):
+        inputs = self.conditioner.tokenize([description])
+        if self.is_t5:
+            if not hasattr(self.conditioner, 't5'):
+                raise RuntimeError("text encoder was released, cannot encode new description: "
+                                   f"{description!r}")
+            with self.conditioner.autocast:
+                hidden = self.conditioner.t5(**inputs).last_hidden_state
+            mask = inputs['attention_mask']
+            return hidden[0].float().cpu(), mask[0].cpu()
+        tokens, mask = inputs
+        return tokens[0].cpu(), mask[0].cpu()
+
+    def build(self, descriptions):
+        # None คือ null condition ที่ใช้ตอน classifier-free guidance dropout
+        missing = [d for d in set(descriptions) | {None} if d not in self.entries]
+        for description in missing:
+            self.entries[description] = self._encode_frozen(description)
+        self._device_entries.clear()
+        return len(missing)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        torch.save({'key': self.key, 'entries': self.entries}, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return False
+        state = torch.load(path, map_location='cpu')
+        if state.get('key') != self.key:
+            return False
+        self.entries.update(state['entries'])
+        self._device_entries.clear()
+        return True
+
+    def release_text_encoder(self):
+        # T5 ไม่ได้ถูกเทรน เมื่อ cache ครบแล้วก็ปล่อยออกจากหน่วยความจำได้
+        if self.is_t5 and 't5' in self.conditioner.__dict__:
+            del self.conditioner.__dict__['t5']
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def _entries_on(self, device):
+        entries = self._device_entries.get(device)
+        if entries is None:
+            entries = {d: (x.to(device), m.to(device)) for d, (x, m) in self.entries.items()}
+            self._device_entries[device] = entries
+        return entries
+
+    def condition_tensors(self, descriptions, device):
+        entries = self._entries_on(device)
+        try:
+            items = [entries[d] for d in descriptions]
+        except KeyError as e:
+            raise KeyError(f"description not in condition cache: {e.args[0]!r}") from None
+        length = max(x.shape[0] for x, _ in items)
+        payload = torch.stack([F.pad(x, (0, 0) * (x.dim() - 1) + (0, length - x.shape[0])) for x, _ in items])
+        mask = torch.stack([F.pad(m, (0, length - m.shape[0])) for _, m in items])
+
+        if self.is_t5:
+            proj = self.conditioner.output_proj
+            embeds = proj(payload.to(proj.weight))
+            embeds = embeds * mask.unsqueeze(-1)
+        else:
+            embeds, mask = self.conditioner((payload, mask))
+        return {self.attribute: (embeds, mask)}
+
+
+def _nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class InferenceConditionCache:
+    # LRU ของผล T5 ต่อ prompt สำหรับตอน generate (key = ชื่อ text encoder + prompt) จำกัดขนาดด้วย max_bytes
+    # เก็บผลก่อน output_proj ซึ่งรันทุกครั้ง จึงใช้ร่วมกับ weights ทุกชุด/adapter ของ ModelRegistry ได้โดยไม่ต้องล้าง
+    # และได้ tensor เหมือนไม่มี cache: pad ตามความยาวที่ยาวที่สุดใน batch แบบเดียวกับ tokenizer
+    def __init__(self, max_bytes=64 * 1024 ** 2, attribute=ATTRIBUTE):
+        self.max_bytes = max_bytes
+        self.attribute = attribute
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def install(self, condition_provider):
+        # ครอบ tokenize/forward ของ T5Conditioner ของ instance นี้: tokenize ส่ง text ต่อไปตรงๆ
+        # แล้ว forward encode เฉพาะ prompt ที่ไม่มีใน cache (conditioner แบบอื่นไม่ถูกแตะ)
+        conditioner = condition_provider.conditioners[self.attribute] \
+            if self.attribute in condition_provider.conditioners else None
+        if conditioner is None or not hasattr(conditioner, 't5_tokenizer') or 'forward' in conditioner.__dict__:
+            return False
+        conditioner.tokenize = list
+        conditioner.forward = lambda texts: self._condition(conditioner, texts)
+        return True
+
+    @torch.no_grad()
+    def _encode(self, conditioner, texts):
+        inputs = type(conditioner).tokenize(conditioner, texts)
+        with conditioner.autocast:
+            hidden = conditioner.t5(**inputs).last_hidden_state
+        # ความยาวจริงของแต่ละ prompt (null condition มี </s> 1 token แต่ mask เป็น 0)
+        lengths = (inputs['input_ids'] != conditioner.t5_tokenizer.pad_token_id).sum(dim=1).tolist()
+        mask = inputs['attention_mask']
+        return [(hidden[i, :length].clone(), mask[i, :length].clone()) for i, length in enumerate(lengths)]
+
+    def _put(self, key, entry):
+        if key in self.entries:
+            return
+        self.entries[key] = entry
+        self.bytes += _nbytes(entry)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= _nbytes(evicted)
+
+    def _condition(self, conditioner, texts):
+        keys = [(conditioner.name, text) for text in texts]
+        found = {}
+        with self._lock:
+            for key in set(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+            self.hits += sum(key in found for key in keys)
+            self.misses += sum(key not in found for key in keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            encoded = self._encode(conditioner, [text for _, text in missing])
+            with self._lock:
+                for key, entry in zip(missing, encoded):
+                    found[key] = entry
+                    self._put(key, entry)
+
+        items = [found[key] for key in keys]
+        length = max(hidden.shape[0] for hidden, _ in items)
+        hidden = torch.stack([F.pad(h, (0, 0, 0, length - h.shape[0])) for h, _ in items])
+        mask = torch.stack([F.pad(m, (0, length - m.shape[0])) for _, m in items])
+        proj = conditioner.output_proj
+        embeds = proj(hidden.to(proj.weight))
+        embeds = embeds * mask.unsqueeze(-1)
+        return embeds, mask
+
+    def warm(self, condition_provider, descriptions):
+        # encode prompt ที่ยังไม่มีใน cache ใน batch เดียว (รวม null condition ของ classifier-free guidance)
+        conditioner = condition_provider.conditioners[self.attribute]
+        if 'forward' not in conditioner.__dict__:
+            return 0
+        misses = self.misses
+        with torch.no_grad():
+            conditioner(list(dict.fromkeys(descriptions)) + [None])
+        return self.misses - misses
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self.entries), 'mb': self.bytes / 2 ** 20, 'hits': self.hits, 'misses': self.misses}
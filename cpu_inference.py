@@ -0,0 +1,217 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import time
+
+import torch
+from torch import nn
+from audiocraft.models import MusicGen
+from audiocraft.models.builders import get_debug_compression_model, get_debug_lm_model
+from audiocraft.models.loaders import load_compression_model, load_lm_model
+
+from checkpoint_format import load_weights
+from generation_cache import weights_id
+
+CACHE_DIR = "quantized_cache"
+# เปลี่ยนเลขนี้เมื่อวิธี quantize เปลี่ยน cache เก่าจะไม่ถูกใช้
+# 2: ไม่เก็บ T5 ในไฟล์ cache อีกต่อไป
+QUANT_VERSION = 2
+
+
+def pick_thread_counts():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    # generate เป็น step ต่อ step ความขนานอยู่ภายใน matmul แต่ละตัว จึงให้ intra-op ใช้เกือบทุก core
+    # (เหลือหนึ่ง core ให้ GUI และการเขียนไฟล์เมื่อมีมากกว่า 4) และไม่ต้องมี inter-op หลาย thread
+    intra = cores - 1 if cores > 4 else cores
+    return intra, 1
+
+
+def configure_threads(intra=None, inter=None):
+    auto_intra, auto_inter = pick_thread_counts()
+    torch.set_num_threads(intra or auto_intra)
+    try:
+        torch.set_num_interop_threads(inter or auto_inter)
+    except RuntimeError:
+        # ตั้งได้ครั้งเดียวก่อนเริ่มงานขนานใดๆ ถ้าเคยเริ่มไปแล้วก็ใช้ค่าเดิม
+        pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def quantize_lm(lm):
+    # int8 dynamic quantization เฉพาะ nn.Linear ใน transformer และหัว output ของแต่ละ codebook
+    # คือ out_proj และ feed-forward ของทุก layer; q/k/v ของ attention (in_proj_weight เป็น Parameter ของ
+    # StreamingMultiheadAttention ไม่ใช่ nn.Linear) จึงยังเป็น fp32 ดูสัดส่วนจริงได้จาก quantization_coverage()
+    # T5 และ output_proj ของ conditioner คงเป็น fp32 เพราะรันครั้งเดียวต่อ generate
+    torch.ao.quantization.quantize_dynamic(lm.transformer, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    torch.ao.quantization.quantize_dynamic(lm.linears, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return lm
+
+
+def quantization_coverage(lm):
+    # จำนวน parameter ของ LM ที่เป็น int8 จริงเทียบกับที่ยังเป็น fp32 (ไม่นับ T5 ซึ่งไม่ได้ register ใน LM)
+    quantized = sum(module.weight().numel() for module in lm.modules()
+                    if isinstance(module, torch.ao.nn.quantized.dynamic.Linear))
+    fp32 = {name: param.numel() for name, param in lm.named_parameters()}
+    total = quantized + sum(fp32.values())
+    return {
+        'int8_params': quantized,
+        'fp32_params': total - quantized,
+        'int8_fraction': round(quantized / total, 4),
+        'fp32_attention_in_proj_params': sum(n for name, n in fp32.items() if name.endswith('in_proj_weight')),
+    }
+
+
+def quantized_cache_path(name, weights=None, cache_dir=CACHE_DIR):
+    key = json.dumps([weights_id(weights, name), torch.__version__, QUANT_VERSION])
+    return os.path.join(cache_dir, f"lm-int8-{hashlib.sha256(key.encode()).hexdigest()[:16]}.pt")
+
+
+def load_fp32_lm(name, weights=None):
+    lm = get_debug_lm_model('cpu') if name == 'debug' else load_lm_model(name, device='cpu')
+    if weights:
+        lm.load_state_dict(load_weights(weights))
+    return lm.eval()
+
+
+def text_encoders(lm):
+    # T5 อยู่ใน __dict__ ของ conditioner (ไม่ได้ register ใน LM) แต่ torch.save(lm) ก็ยัง pickle ไปด้วย
+    return {name: conditioner for name, conditioner in lm.condition_provider.conditioners.items()
+            if 't5' in conditioner.__dict__}
+
+
+def attach_text_encoders(lm, source=None):
+    # ต่อ T5 ให้ LM ที่โหลดจาก cache: ใช้ตัวเดียวกับ LM source ถ้ามี ไม่เช่นนั้นโหลดจาก hub
+    # T5 ไม่ได้ถูก fine-tune ทุก checkpoint จึงใช้ร่วมกันได้ (output_proj ยังเป็นของแต่ละ checkpoint)
+    shared = text_encoders(source) if source is not None else {}
+    for name, conditioner in lm.condition_provider.conditioners.items():
+        if not hasattr(conditioner, 't5_tokenizer'):
+            continue
+        if name in shared:
+            conditioner.__dict__['t5'] = shared[name].__dict__['t5']
+        else:
+            from transformers import T5EncoderModel
+            conditioner.__dict__['t5'] = T5EncoderModel.from_pretrained(conditioner.name).eval()
+    return lm
+
+
+def load_quantized_lm(name, weights=None, cache_dir=CACHE_DIR, text_encoder_from=None):
+    # quantize ครั้งเดียวต่อ checkpoint แล้วเก็บทั้ง module (ยกเว้น T5) ไว้ ครั้งต่อไปโหลด int8 ได้เลยโดยไม่แตะ fp32
+    # text_encoder_from: LM ที่โหลดไว้แล้ว ให้ทุกชุด weights ใช้ T5 ตัวเดียวกันแทนที่จะมีสำเนาของตัวเอง
+    path = quantized_cache_path(name, weights, cache_dir)
+    if os.path.exists(path):
+        try:
+            lm = torch.load(path, map_location='cpu', weights_only=False).eval()
+        except Exception:
+            # cache เสียหรือสร้างจาก audiocraft คนละรุ่น: quantize ใหม่
+            pass
+        else:
+            return attach_text_encoders(lm, text_encoder_from)
+    lm = quantize_lm(load_fp32_lm(name, weights))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    detached = {name: conditioner.__dict__.pop('t5') for name, conditioner in text_encoders(lm).items()}
+    try:
+        torch.save(lm, tmp_path)
+    finally:
+        for conditioner_name, t5 in detached.items():
+            lm.condition_provider.conditioners[conditioner_name].__dict__['t5'] = t5
+    os.replace(tmp_path, path)
+    if text_encoder_from is not None:
+        # ทิ้ง T5 ที่เพิ่งโหลดมากับ fp32 แล้วใช้ตัวที่มีอยู่แล้วแทน
+        attach_text_encoders(lm, text_encoder_from)
+    return lm
+
+
+def load_cpu_model(name="facebook/musicgen-medium", weights=None, quantize=True, cache_dir=CACHE_DIR):
+    if name == 'debug':
+        compression_model = get_debug_compression_model('cpu')
+    else:
+        compression_model = load_compression_model(name, device='cpu')
+    lm = load_quantized_lm(name, weights, cache_dir) if quantize else load_fp32_lm(name, weights)
+    return MusicGen(name, compression_model, lm, max_duration=30 if name == 'debug' else None)
+
+
+def teacher_forced_log_probs(model, descriptions, tokens):
+    lm = model.lm
+    attributes, _ = model._prepare_tokens_and_attributes(descriptions, None)
+    with torch.no_grad():
+        condition_tensors = lm.condition_provider(lm.condition_provider.tokenize(attributes))
+        out = lm.compute_predictions(tokens, [], condition_tensors)
+    return out.logits.float().log_softmax(dim=-1), out.mask
+
+
+def report(name, weights, descriptions, duration, seed, cache_dir):
+    # วัด fp32 ก่อนแล้วปล่อยทิ้ง จึงไม่ต้องมีทั้งสองโมเดลในหน่วยความจำพร้อมกัน
+    # คุณภาพวัดแบบ teacher forcing บน token ที่ fp32 สร้าง: NLL, KL(fp32 || int8) และ top-1 ที่ตรงกัน
+    intra, inter = configure_threads()
+    results = {'model': name, 'weights': weights, 'duration': duration, 'batch': len(descriptions),
+               'threads': {'intra_op': intra, 'inter_op': inter}}
+    reference = None
+    for label, quantize in (('fp32', False), ('int8', True)):
+        cached = quantize and os.path.exists(quantized_cache_path(name, weights, cache_dir))
+        start = time.perf_counter()
+        model = load_cpu_model(name, weights, quantize=quantize, cache_dir=cache_dir)
+        load_seconds = time.perf_counter() - start
+
+        model.set_generation_params(duration=duration)
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        _, tokens = model.generate(descriptions, return_tokens=True)
+        generation_seconds = time.perf_counter() - start
+
+        if reference is None:
+            reference = tokens
+        log_probs, mask = teacher_forced_log_probs(model, descriptions, reference)
+        nll = -log_probs.gather(-1, reference.unsqueeze(-1)).squeeze(-1)[mask].mean().item()
+        entry = {
+            'load_seconds': round(load_seconds, 2),
+            'loaded_from_cache': cached,
+            'generation_seconds': round(generation_seconds, 2),
+            'audio_seconds_per_second': round(duration * len(descriptions) / generation_seconds, 3),
+            'nll': round(nll, 4),
+        }
+        if label == 'fp32':
+            reference_log_probs = log_probs
+        else:
+            kl = (reference_log_probs.exp() * (reference_log_probs - log_probs)).sum(-1)[mask].mean().item()
+            agreement = (reference_log_probs.argmax(-1) == log_probs.argmax(-1))[mask].float().mean().item()
+            entry['kl_vs_fp32'] = round(kl, 5)
+            entry['top1_agreement'] = round(agreement, 4)
+            entry['cache_file_mb'] = round(os.path.getsize(quantized_cache_path(name, weights, cache_dir)) / 1e6, 1)
+            entry['coverage'] = quantization_coverage(model.lm)
+        results[label] = entry
+        del model
+        gc.collect()
+
+    results['speedup'] = round(results['fp32']['generation_seconds'] / results['int8']['generation_seconds'], 2)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare int8 CPU inference against fp32")
+    parser.add_argument("--model", default="facebook/musicgen-medium",
+                        help="pretrained name, or 'debug' for a tiny offline stand-in model")
+    parser.add_argument("--weights", default=None, help="fine-tuned LM weights (.pt or .safetensors)")
+    parser.add_argument("--prompt", action="append", default=None)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default="cpu_inference_report.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    prompts = args.prompt or ["Thai song with saw u"]
+    results = report(args.model, args.weights, prompts, args.duration, args.seed, args.cache_dir)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    coverage = results['int8']['coverage']
+    print(f"✅ int8 is {results['speedup']}x fp32, top-1 agreement {results['int8']['top1_agreement']:.1%}, "
+          f"{coverage['int8_fraction']:.1%} of LM parameters int8 (attention q/k/v stay fp32)")
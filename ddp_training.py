@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+import lightning as L
+import torch
+from lightning.pytorch.strategies import DDPStrategy
+
+BUCKET_MB = 100
+
+
+def threads_per_process(processes):
+    # แบ่ง core ของเครื่องให้แต่ละ process เท่าๆ กัน ไม่ให้ thread ของ rank ต่างๆ แย่ง core กัน
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(1, cores // processes)
+
+
+def cpu_strategy(processes, num_nodes=1, bucket_mb=BUCKET_MB):
+    if processes * num_nodes == 1:
+        return "auto"
+    # gloo สำหรับ CPU (และข้ามเครื่องผ่าน MASTER_ADDR/MASTER_PORT/NODE_RANK)
+    # bucket ใหญ่ลดจำนวนรอบ all-reduce ซึ่งบน gloo เสียเวลาต่อรอบสูง และใช้ grad เป็น view ของ bucket ไม่ต้อง copy
+    # Lightning ใส่ DistributedSampler ให้ DataLoader เอง แต่ละ rank จึงได้คลิปคนละส่วนของ dataset
+    return DDPStrategy(process_group_backend="gloo", bucket_cap_mb=bucket_mb, gradient_as_bucket_view=True)
+
+
+class ThroughputLogger(L.Callback):
+    # samples/s ของทุก rank รวมกัน ไม่นับ warm-up step แรกๆ; rank 0 เขียนผลเป็น JSON
+    def __init__(self, path, warmup_steps=2):
+        self.path = path
+        self.warmup_steps = warmup_steps
+        self.start = None
+        self.batches = 0
+        self.samples = 0
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        if self.start is None and trainer.global_step >= self.warmup_steps:
+            self.start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if self.start is not None:
+            self.batches += 1
+            self.samples += len(batch[1]) * trainer.world_size
+
+    def on_train_end(self, trainer, pl_module):
+        if not trainer.is_global_zero or self.start is None:
+            return
+        seconds = time.perf_counter() - self.start
+        result = {
+            'world_size': trainer.world_size,
+            'num_nodes': trainer.num_nodes,
+            'threads_per_process': torch.get_num_threads(),
+            'precision': str(trainer.precision),
+            'batches': self.batches,
+            'samples': self.samples,
+            'seconds': round(seconds, 3),
+            'samples_per_second': self.samples / seconds,
+        }
+        with open(self.path, 'w') as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+import torchaudio
+
+from resampling import resample
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.mp3', '.ogg', '.opus')
+SAMPLE_RATE = 16000
+N_FFT = 1024
+HOP = 256
+N_MELS = 64
+# ชื่อไฟล์ใน Folderfor music เป็น "<prompt>_finetune.wav" / "<prompt>_normal.wav"
+SUFFIX_PATTERN = r"_(finetune|normal)$"
+
+
+def prompt_key(path, pattern=SUFFIX_PATTERN):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(pattern, '', stem).strip()
+
+
+def list_clips(directory, pattern=SUFFIX_PATTERN):
+    clips = defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(AUDIO_EXTENSIONS):
+            path = os.path.join(directory, name)
+            clips[prompt_key(path, pattern)].append(path)
+    return clips
+
+
+def _init_worker():
+    # แต่ละ process decode ไฟล์เดียวต่อครั้ง ไม่ต้องมีหลาย thread แย่ง core กับ process อื่น
+    torch.set_num_threads(1)
+
+
+def load_clip(path, sample_rate=SAMPLE_RATE, seconds=None):
+    waveform, sr = torchaudio.load(path)
+    waveform = resample(waveform.mean(dim=0), sr, sample_rate)
+    if seconds is not None:
+        waveform = waveform[:int(seconds * sample_rate)]
+    return waveform
+
+
+class FeatureExtractor:
+    # log-mel และ spectral feature ของทั้ง batch จาก STFT ครั้งเดียว
+    # เก็บเฉพาะ sufficient statistics ต่อคลิป (จำนวน frame, ผลรวม, ผลรวมของ outer product) ไม่เก็บเสียงไว้
+    def __init__(self, sample_rate=SAMPLE_RATE, n_fft=N_FFT, hop=HOP, n_mels=N_MELS):
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop = hop
+        self.window = torch.hann_window(n_fft)
+        self.fbanks = torchaudio.functional.melscale_fbanks(n_fft // 2 + 1, 0.0, sample_rate / 2, n_mels,
+                                                            sample_rate)
+        self.freqs = torch.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+
+    @torch.no_grad()
+    def __call__(self, waveforms):
+        lengths = torch.tensor([w.shape[0] for w in waveforms])
+        batch = torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+        if batch.shape[1] < self.n_fft:
+            batch = torch.nn.functional.pad(batch, (0, self.n_fft - batch.shape[1]))
+        power = torch.stft(batch, self.n_fft, self.hop, window=self.window, return_complex=True).abs().pow(2)
+        power = power.transpose(1, 2)  # (B, frames, freqs)
+        # frame ที่มาจากส่วนที่ pad ไม่ถูกนับ
+        frames = power.shape[1]
+        valid = torch.arange(frames)[None, :] <= (lengths[:, None] // self.hop)
+        weight = valid.to(power.dtype)
+        count = weight.sum(dim=1)
+
+        # log-mel และผลรวมของ outer product คำนวณใน float64: covariance ใน gaussian() ได้จาก outer - n * mean^2
+        # ซึ่งใน float32 ผลต่างของสองค่าที่ใหญ่ใกล้กันนี้ (คลิปยาวหลายพัน frame) เสียความแม่นยำไปเกือบหมด
+        weight64 = weight.double()
+        log_mel = torch.log(power.double() @ self.fbanks.double() + 1e-6) * weight64[..., None]
+        mel_sum = log_mel.sum(dim=1)
+        mel_outer = log_mel.transpose(1, 2) @ log_mel
+        mel_mean = mel_sum / count[:, None].double()
+        mel_std = ((log_mel - mel_mean[:, None]).pow(2) * weight64[..., None]).sum(dim=1) \
+            .div(count[:, None].double()).sqrt()
+
+        total = power.sum(dim=2) + 1e-10
+        centroid = (power * self.freqs).sum(dim=2) / total
+        flatness = torch.exp(torch.log(power + 1e-10).mean(dim=2)) / (total / power.shape[2])
+        rms_db = 10 * torch.log10(total / power.shape[2] + 1e-10)
+
+        def frame_mean(x):
+            return (x * weight).sum(dim=1) / count
+
+        return {
+            'count': count.double(),
+            'mel_sum': mel_sum.double(),
+            'mel_outer': mel_outer.double(),
+            # embedding ต่อคลิป: ค่าเฉลี่ยและส่วนเบี่ยงเบนของ log-mel ตลอดคลิป
+            'embedding': torch.cat([mel_mean, mel_std], dim=1).double(),
+            'centroid_hz': frame_mean(centroid),
+            'flatness': frame_mean(flatness),
+            'rms_db': frame_mean(rms_db),
+        }
+
+
+def extract(paths, extractor, seconds=None, workers=None, batch_size=32):
+    # decode ขนานกันหลาย process แล้วคำนวณ feature ทีละ batch ใน process หลัก
+    # ส่งงานไปทีละไม่กี่ batch ล่วงหน้า เสียงที่ค้างในหน่วยความจำจึงไม่โตตามจำนวนคลิป
+    parts = []
+    window = batch_size * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = None
+        for start in range(0, len(paths) + window, window):
+            chunk = paths[start:start + window]
+            loads = pool.map(load_clip, chunk, [extractor.sample_rate] * len(chunk), [seconds] * len(chunk),
+                             chunksize=4) if chunk else None
+            if pending is not None:
+                waveforms = list(pending)
+                for i in range(0, len(waveforms), batch_size):
+                    parts.append(extractor(waveforms[i:i + batch_size]))
+            pending = loads
+    return {key: torch.cat([part[key] for part in parts]) for key in parts[0]}
+
+
+def gaussian(count, total, outer):
+    # mean/covariance จาก sufficient statistics (รวมหลายคลิปได้ด้วยการบวก) รองรับ batch dimension ข้างหน้า
+    mean = total / count[..., None]
+    cov = (outer - count[..., None, None] * mean[..., :, None] * mean[..., None, :]) / (count[..., None, None] - 1)
+    return mean, cov
+
+
+def embedding_gaussian(embeddings):
+    mean = embeddings.mean(dim=0)
+    centered = embeddings - mean
+    cov = centered.T @ centered / max(1, embeddings.shape[0] - 1)
+    return mean, cov
+
+
+def frechet_distance(mu1, cov1, mu2, cov2):
+    # ||mu1 - mu2||^2 + Tr(cov1 + cov2 - 2 (cov1 cov2)^1/2) ทำเป็น batch ได้
+    # Tr((cov1 cov2)^1/2) = ผลรวม sqrt ของ eigenvalue ของ cov1^1/2 cov2 cov1^1/2 ซึ่งสมมาตร จึงใช้ eigh ได้
+    values, vectors = torch.linalg.eigh(cov1)
+    sqrt1 = vectors @ torch.diag_embed(values.clamp(min=0).sqrt()) @ vectors.transpose(-1, -2)
+    middle = sqrt1 @ cov2 @ sqrt1
+    middle = (middle + middle.transpose(-1, -2)) / 2
+    tr_covmean = torch.linalg.eigvalsh(middle).clamp(min=0).sqrt().sum(dim=-1)
+    diff = mu1 - mu2
+    trace = cov1.diagonal(dim1=-2, dim2=-1).sum(dim=-1) + cov2.diagonal(dim1=-2, dim2=-1).sum(dim=-1)
+    return (diff * diff).sum(dim=-1) + trace - 2 * tr_covmean
+
+
+def _per_prompt(features, index, prompts):
+    # รวม statistics ของคลิปใน prompt เดียวกันด้วย index_add (ทุก prompt พร้อมกัน)
+    size = len(prompts)
+    count = torch.zeros(size, dtype=torch.float64).index_add_(0, index, features['count'])
+    total = torch.zeros(size, N_MELS, dtype=torch.float64).index_add_(0, index, features['mel_sum'])
+    outer = torch.zeros(size, N_MELS, N_MELS, dtype=torch.float64).index_add_(0, index, features['mel_outer'])
+    clips = torch.zeros(size).index_add_(0, index, torch.ones(len(index)))
+    summary = {}
+    for name in ('centroid_hz', 'flatness', 'rms_db'):
+        summary[name] = torch.zeros(size).index_add_(0, index, features[name]) / clips
+    return count, total, outer, summary
+
+
+def evaluate(candidate_dir, reference_dir, pattern=SUFFIX_PATTERN, seconds=None, workers=None, batch_size=32):
+    candidate_clips = list_clips(candidate_dir, pattern)
+    reference_clips = list_clips(reference_dir, pattern)
+    prompts = sorted(candidate_clips.keys() & reference_clips.keys())
+    if not prompts:
+        raise ValueError(f"no prompts in common between {candidate_dir} and {reference_dir}")
+
+    extractor = FeatureExtractor()
+    sides = {}
+    for side, clips in (('candidate', candidate_clips), ('reference', reference_clips)):
+        paths = [path for prompt in prompts for path in clips[prompt]]
+        index = torch.tensor([i for i, prompt in enumerate(prompts) for _ in clips[prompt]])
+        features = extract(paths, extractor, seconds, workers, batch_size)
+        sides[side] = (features, _per_prompt(features, index, prompts))
+
+    (c_features, (c_count, c_total, c_outer, c_summary)) = sides['candidate']
+    (r_features, (r_count, r_total, r_outer, r_summary)) = sides['reference']
+    prompt_fd = frechet_distance(*gaussian(c_count, c_total, c_outer), *gaussian(r_count, r_total, r_outer))
+    frame_fd = frechet_distance(*gaussian(c_count.sum(), c_total.sum(dim=0), c_outer.sum(dim=0)),
+                                *gaussian(r_count.sum(), r_total.sum(dim=0), r_outer.sum(dim=0)))
+    clip_fd = frechet_distance(*embedding_gaussian(c_features['embedding']),
+                               *embedding_gaussian(r_features['embedding']))
+
+    def summary_of(values, i):
+        return {name: round(float(value[i]), 4) for name, value in values.items()}
+
+    return {
+        'candidate_dir': candidate_dir,
+        'reference_dir': reference_dir,
+        'clips': {'candidate': len(c_features['count']), 'reference': len(r_features['count'])},
+        # frame_fd: log-mel ของทุก frame รวมกัน, clip_fd: embedding ต่อคลิป (ต้องมีหลายร้อยคลิปขึ้นไปถึงจะนิ่ง)
+        'frame_fd': round(float(frame_fd), 4),
+        'clip_fd': round(float(clip_fd), 4),
+        'prompts': [{
+            'prompt': prompt,
+            'frame_fd': round(float(prompt_fd[i]), 4),
+            'candidate': summary_of(c_summary, i),
+            'reference': summary_of(r_summary, i),
+        } for i, prompt in enumerate(prompts)],
+        'unpaired': sorted(candidate_clips.keys() ^ reference_clips.keys()),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare fine-tuned renders against base-model renders of the "
+                                                 "same prompts with Fréchet distances of log-mel features")
+    parser.add_argument("--candidate", default=os.path.join("Folderfor music", "Finetune_file"),
+                        help="renders of the checkpoint being evaluated")
+    parser.add_argument("--reference", default=os.path.join("Folderfor music", "folder_normal"),
+                        help="renders of the same prompts from the base model")
+    parser.add_argument("--suffix-pattern", default=SUFFIX_PATTERN,
+                        help="regex removed from file names to pair clips by prompt")
+    parser.add_argument("--seconds", type=float, default=None, help="only use the first N seconds of each clip")
+    parser.add_argument("--workers", type=int, default=None, help="decode processes")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    parser.add_argument("--max-frame-fd", type=float, default=None,
+                        help="exit with status 1 when the aggregate frame Fréchet distance is above this")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = evaluate(args.candidate, args.reference, args.suffix_pattern, args.seconds, args.workers,
+                      args.batch_size)
+    for item in sorted(report['prompts'], key=lambda item: item['frame_fd'], reverse=True):
+        print(f"{item['frame_fd']:10.3f}  {item['prompt']}")
+    print(f"📊 {report['clips']['candidate']} vs {report['clips']['reference']} clips: "
+          f"frame FD {report['frame_fd']:.3f}, clip FD {report['clip_fd']:.3f}")
+    if report['unpaired']:
+        print(f"⚠️ {len(report['unpaired'])} prompts without a pair: {', '.join(report['unpaired'][:5])}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.max_frame_fd is not None and report['frame_fd'] > args.max_frame_fd:
+        print(f"❌ frame FD {report['frame_fd']:.3f} > {args.max_frame_fd}")
+        sys.exit(1)
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import torch
+
+SAMPLING_PARAMS = ('use_sampling', 'top_k', 'top_p', 'temperature', 'cfg_coef')
+
+
+def sampling_params(request):
+    return {name: request[name] for name in SAMPLING_PARAMS if request.get(name) is not None}
+
+
+def row_seed(seed, description):
+    digest = hashlib.sha256(f"{seed}\0{description}".encode()).digest()
+    return int.from_bytes(digest[:8], 'little') & ((1 << 63) - 1)
+
+
+@contextmanager
+def row_generators(seeds):
+    # ให้แต่ละแถวของ batch สุ่ม token จาก generator ของตัวเอง แทน RNG กลางที่ทั้ง batch ใช้ร่วมกัน
+    # top-k/top-p/multinomial ของ audiocraft ทั้งหมดเรียก utils.multinomial จึงแทนที่ฟังก์ชันนั้นระหว่าง generate
+    from audiocraft.utils import utils
+    multinomial = utils.multinomial
+    generators = []
+    thread = threading.get_ident()
+
+    def sample(input, num_samples, replacement=False, *, generator=None):
+        if threading.get_ident() != thread or input.dim() < 2 or input.shape[0] != len(seeds):
+            return multinomial(input, num_samples, replacement=replacement, generator=generator)
+        if not generators:
+            generators.extend(torch.Generator(device=input.device).manual_seed(s) for s in seeds)
+        rows = [torch.multinomial(row.reshape(-1, input.shape[-1]), num_samples, replacement, generator=g)
+                for row, g in zip(input, generators)]
+        return torch.stack(rows).reshape(*input.shape[:-1], num_samples)
+
+    utils.multinomial = sample
+    try:
+        yield
+    finally:
+        utils.multinomial = multinomial
+
+
+def condition_length(model, descriptions):
+    # จำนวน token ของ prompt ที่ยาวที่สุด: conditioning ทั้ง batch ถูก pad ถึงความยาวนี้
+    # และ cross-attention ไม่ mask ส่วนที่ pad ความยาวนี้จึงมีผลต่อเสียงด้วย
+    conditioners = model.lm.condition_provider.conditioners
+    tokenizer = getattr(conditioners['description'], 't5_tokenizer', None) if 'description' in conditioners else None
+    if tokenizer is None:
+        return None
+    return max(len(tokenizer(description or "")['input_ids']) for description in descriptions)
+
+
+def generate_batch(model, descriptions, duration, seed=None, return_tokens=False, **params):
+    # return_tokens=True คืน (waveforms, codes [B, K, T]) เพื่อเก็บ token ไว้ decode ใหม่ภายหลัง
+    model.set_generation_params(duration=duration, **params)
+    if seed is None:
+        return model.generate(list(descriptions), return_tokens=return_tokens)
+    # generate ทั้ง batch ในครั้งเดียว แต่ละ prompt สุ่มจาก generator ที่ได้จาก (seed, prompt)
+    # prompt เดิมจึงได้ token เดิมไม่ว่าจะอยู่ใน batch ไหนหรือลำดับใด ตราบที่ความยาว conditioning เท่ากัน
+    torch.manual_seed(seed)
+    with row_generators([row_seed(seed, description) for description in descriptions]):
+        return model.generate(list(descriptions), return_tokens=return_tokens)
+
+
+def generate_cached(model, descriptions, duration, seed=None, cache=None, weights=None, return_tokens=False,
+                    **params):
+    # ใช้ cache ได้เฉพาะตอนกำหนด seed เท่านั้น เพราะผลลัพธ์ที่สุ่มโดยไม่มี seed ไม่ควรซ้ำกัน
+    # cache เก็บแค่เสียง เมื่อต้องการ token จึง generate ใหม่เสมอ
+    if return_tokens:
+        waveforms, tokens = generate_batch(model, descriptions, duration, seed, return_tokens=True, **params)
+        return [waveform.cpu() for waveform in waveforms], [codes.cpu() for codes in tokens]
+    if cache is None or seed is None:
+        return [waveform.cpu() for waveform in generate_batch(model, descriptions, duration, seed, **params)]
+
+    from generation_cache import cache_key
+    length = condition_length(model, descriptions)
+    keys = [cache_key(weights, description, duration, params, seed, length) for description in descriptions]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, waveform in enumerate(results) if waveform is None]
+    if missing:
+        batch = [descriptions[i] for i in missing]
+        # ถ้า prompt ที่ยาวที่สุดไม่อยู่ในส่วนที่ต้อง generate ใหม่ ให้ generate มันด้วย (แล้วทิ้งผล)
+        # เพื่อให้ conditioning ถูก pad ยาวเท่ากับตอน generate ทั้ง batch
+        if condition_length(model, batch) != length:
+            batch.append(max(descriptions, key=lambda description: condition_length(model, [description])))
+        waveforms = generate_batch(model, batch, duration, seed, **params)
+        for i, waveform in zip(missing, waveforms):
+            results[i] = waveform.cpu()
+            cache.put(keys[i], results[i], model.sample_rate)
+    return results
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import torchaudio
+
+from checkpoint_format import checksum, is_mapped_format
+
+INDEX_FILE = "index.json"
+_weights_ids = {}
+
+
+def weights_id(path=None, model_name="facebook/musicgen-medium"):
+    # base model ใช้ชื่อโมเดล, fine-tuned ใช้ sha256 ของไฟล์ (จำไว้ตาม path/size/mtime จะได้ไม่ hash ซ้ำ)
+    if not path:
+        return model_name
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _weights_ids and is_mapped_format(path):
+        # ไฟล์ .safetensors มี checksum อยู่ใน header แล้ว อ่านแค่ไม่กี่ KB
+        _weights_ids[memo_key] = checksum(path)
+    if memo_key not in _weights_ids:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                h.update(block)
+        _weights_ids[memo_key] = h.hexdigest()
+    return _weights_ids[memo_key]
+
+
+def cache_key(weights, description, duration, params, seed, condition_length=None):
+    payload = {
+        'weights': weights,
+        'description': description,
+        'duration': float(duration),
+        'params': {k: params[k] for k in sorted(params)},
+        'seed': seed,
+        'condition_length': condition_length,
+        # เสียงที่ cache ไว้ก่อนใช้ generator ต่อแถวอาจขึ้นกับ prompt อื่นใน batch จึงไม่ใช้ซ้ำ
+        'rng': 'per-row',
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class GenerationCache:
+    # cache เสียงที่ generate แล้วบน disk แบบจำกัดขนาด ลบรายการที่ไม่ได้ใช้นานที่สุดก่อน (LRU)
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, INDEX_FILE)
+        self.entries = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                self.entries = json.load(f)
+            # ข้ามรายการที่ไฟล์หายไปแล้ว
+            self.entries = {k: v for k, v in self.entries.items()
+                            if os.path.exists(os.path.join(root, v['file']))}
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self._index_path)
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry['last_used'] = time.time()
+            self.hits += 1
+            path = os.path.join(self.root, entry['file'])
+        waveform, _ = torchaudio.load(path)
+        return waveform
+
+    def put(self, key, waveform, sample_rate):
+        filename = os.path.join(key[:2], f"{key}.wav")
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torchaudio.save(path, waveform.detach().cpu(), sample_rate=sample_rate)
+        with self._lock:
+            self.entries[key] = {'file': filename, 'size': os.path.getsize(path), 'last_used': time.time()}
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            entry = self.entries.pop(key)
+            total -= entry['size']
+            try:
+                os.remove(os.path.join(self.root, entry['file']))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        with self._lock:
+            self._save_index()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': sum(entry['size'] for entry in self.entries.values()),
+            }
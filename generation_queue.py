@@ -0,0 +1,147 @@
+import itertools
+import threading
+from contextlib import nullcontext
+
+from generation import generate_cached
+from instrumentation import DISABLED
+
+QUEUED = "queued"
+GENERATING = "generating"
+DONE = "done"
+FAILED = "failed"
+
+
+class GenerationJob:
+    _ids = itertools.count(1)
+
+    def __init__(self, description, duration, model_type="base", sample_rate=32000, seed=None, weights=None,
+                 weight_set=None, stream=False, audio_format="wav", keep_tokens=False, save_to_disk=True):
+        self.id = next(self._ids)
+        self.description = description
+        self.duration = duration
+        self.model_type = model_type
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.weights = weights
+        self.weight_set = weight_set
+        self.stream = stream
+        self.audio_format = audio_format
+        self.keep_tokens = keep_tokens
+        self.save_to_disk = save_to_disk
+        self.status = QUEUED
+        self.output = None
+        self.error = None
+
+    @property
+    def batch_key(self):
+        # งานที่ duration, seed และโมเดลเดียวกันรวมเป็น generate call เดียวได้ ส่วนงาน stream ทำทีละงาน
+        return (self.duration, self.model_type, self.seed, self.weights, self.weight_set,
+                self.id if self.stream else None)
+
+
+class GenerationQueue:
+    def __init__(self, get_model, save_job, on_update=None, on_idle=None, max_batch=4, cache=None,
+                 model_lock=None, stream_job=None, instrumentation=None):
+        # get_model(job) คืนโมเดลที่พร้อมสำหรับงานนั้น (เช่นสลับ weights ให้ตรงกับ job.weight_set)
+        self.get_model = get_model
+        # save_job(job, waveform, sample_rate, codes) คืน path; codes เป็น None ถ้าไม่มีงานไหนใน batch ขอ token
+        # stream_job(job, model) generate แบบ streaming/long-form เขียนไฟล์เองแล้วคืน path
+        self.stream_job = stream_job
+        self.instrumentation = instrumentation or DISABLED
+        self.cache = cache
+        self.model_lock = model_lock
+        self.save_job = save_job
+        self.on_update = on_update
+        self.on_idle = on_idle
+        self.max_batch = max_batch
+        self.jobs = []
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.busy = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, description, duration, **kwargs):
+        job = GenerationJob(description, duration, **kwargs)
+        with self._cond:
+            self.jobs.append(job)
+            self._pending.append(job)
+            self._cond.notify()
+        self._notify(job)
+        return job
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            self.on_update(job)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            key = self._pending[0].batch_key
+            batch = [job for job in self._pending if job.batch_key == key][:self.max_batch]
+            for job in batch:
+                self._pending.remove(job)
+            self.busy = True
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            for job in batch:
+                job.status = GENERATING
+                self._notify(job)
+            try:
+                first = batch[0]
+                with self.instrumentation.run("generate", jobs=len(batch), duration=first.duration,
+                                              model_type=first.model_type, stream=first.stream) as run:
+                    with self.model_lock or nullcontext():
+                        model = self.get_model(first)
+                        if model is None:
+                            raise RuntimeError("No model loaded")
+                        with run.attach(model):
+                            # งาน stream และงานที่ยาวกว่า window ของโมเดล เขียนไฟล์ทีละช่วงผ่าน stream_job ทีละงาน
+                            if self.stream_job is not None and (first.stream or first.duration > model.max_duration):
+                                for job in batch:
+                                    job.output = self.stream_job(job, model)
+                                    job.status = DONE
+                                    self._notify(job)
+                                waveforms, tokens = [], []
+                            else:
+                                keep_tokens = any(job.keep_tokens for job in batch)
+                                result = generate_cached(model, [job.description for job in batch],
+                                                         first.duration, first.seed, self.cache, first.weights,
+                                                         return_tokens=keep_tokens)
+                                waveforms, tokens = result if keep_tokens else (result, [None] * len(result))
+                    for job, waveform, codes in zip(batch, waveforms, tokens):
+                        with run.stage("save"):
+                            job.output = self.save_job(job, waveform, model.sample_rate,
+                                                       codes if job.keep_tokens else None)
+                        job.status = DONE
+                        self._notify(job)
+            except Exception as e:
+                for job in batch:
+                    if job.status != DONE:
+                        job.status = FAILED
+                        job.error = str(e)
+                        self._notify(job)
+            finally:
+                with self._cond:
+                    self.busy = False
+                    idle = not self._pending
+                if idle and self.on_idle is not None:
+                    self.on_idle()
@@ -0,0 +1,225 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_mb():
+    # GPU: peak ของ allocator ตั้งแต่ reset ล่าสุด, CPU: peak RSS ของทั้ง process (ไม่มีบน Windows)
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+    return None
+
+
+class Run:
+    # เวลาของแต่ละ stage ในการ generate หนึ่งครั้ง stage ซ้อนกันได้ seconds คือเวลาที่ไม่รวม stage ลูก
+    def __init__(self, label, info, profiling=False):
+        self.label = label
+        self.info = info
+        self.profiling = profiling
+        self.stages = {}
+        self._stack = []
+        self.start = time.perf_counter()
+        self.total_seconds = None
+
+    def _entry(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'wall_seconds': 0.0, 'calls': 0, 'peak_mb': None}
+        return self.stages[name]
+
+    def _fold_peak(self, names, peak):
+        if peak is None:
+            return
+        for name in names:
+            entry = self._entry(name)
+            entry['peak_mb'] = peak if entry['peak_mb'] is None else max(entry['peak_mb'], peak)
+
+    def begin(self, name):
+        if torch.cuda.is_available():
+            self._fold_peak([frame[0] for frame in self._stack], _peak_mb())
+            torch.cuda.reset_peak_memory_stats()
+        record = torch.profiler.record_function(name) if self.profiling else None
+        if record is not None:
+            record.__enter__()
+        self._stack.append([name, time.perf_counter(), 0.0, record])
+
+    def end(self, name):
+        # ปิด stage ที่ค้างอยู่ด้านในด้วย (เช่น forward hook ที่ไม่ได้ถูกเรียกเพราะเกิด exception)
+        while self._stack:
+            stage, start, child_seconds, record = self._stack.pop()
+            if record is not None:
+                record.__exit__(None, None, None)
+            wall = time.perf_counter() - start
+            entry = self._entry(stage)
+            entry['wall_seconds'] += wall
+            entry['seconds'] += wall - child_seconds
+            entry['calls'] += 1
+            self._fold_peak([stage] + [frame[0] for frame in self._stack], _peak_mb())
+            if self._stack:
+                self._stack[-1][2] += wall
+            if stage == name:
+                return
+
+    @contextmanager
+    def stage(self, name):
+        self.begin(name)
+        try:
+            yield self
+        finally:
+            self.end(name)
+
+    def add(self, name, **counters):
+        entry = self._entry(name)
+        for key, value in counters.items():
+            entry[key] = entry.get(key, 0) + value
+
+    @contextmanager
+    def attach(self, model):
+        # วัด stage ภายใน model.generate โดยไม่ต้องแก้ audiocraft:
+        # forward hook ที่ condition provider (text conditioning) และครอบ lm.generate กับ compression_model.decode
+        # ของ instance นี้ชั่วคราว (ถอดออกเมื่อจบ)
+        lm = model.lm
+        compression_model = model.compression_model
+        provider = lm.condition_provider
+        hooks = [
+            provider.register_forward_pre_hook(lambda module, args: self.begin('conditioning')),
+            provider.register_forward_hook(lambda module, args, output: self.end('conditioning')),
+        ]
+        lm_generate = lm.generate
+        decode = compression_model.decode
+
+        def timed_generate(*args, **kwargs):
+            with self.stage('lm_sampling'):
+                tokens = lm_generate(*args, **kwargs)
+            B, K, T = tokens.shape
+            self.add('lm_sampling', tokens=B * K * T, frames=B * T)
+            return tokens
+
+        def timed_decode(*args, **kwargs):
+            with self.stage('decode'):
+                return decode(*args, **kwargs)
+
+        lm.generate = timed_generate
+        compression_model.decode = timed_decode
+        try:
+            yield self
+        finally:
+            del lm.generate
+            del compression_model.decode
+            for hook in hooks:
+                hook.remove()
+
+    def record(self):
+        stages = {}
+        for name, entry in self.stages.items():
+            entry = dict(entry)
+            if 'tokens' in entry and entry['seconds'] > 0:
+                entry['tokens_per_second'] = entry['tokens'] / entry['seconds']
+                entry['frames_per_second'] = entry['frames'] / entry['seconds']
+            stages[name] = {k: round(v, 4) if isinstance(v, float) else v for k, v in entry.items()}
+        return {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'label': self.label,
+            **self.info,
+            'total_seconds': round(self.total_seconds or 0.0, 4),
+            'stages': stages,
+        }
+
+    def summary(self):
+        parts = []
+        for name, entry in self.stages.items():
+            part = f"{name} {entry['seconds']:.2f}s"
+            if entry.get('tokens') and entry['seconds'] > 0:
+                part += f" ({entry['tokens'] / entry['seconds']:.0f} tok/s)"
+            parts.append(part)
+        peaks = [entry['peak_mb'] for entry in self.stages.values() if entry['peak_mb'] is not None]
+        if peaks:
+            parts.append(f"peak {max(peaks):.0f} MB")
+        return f"{self.label} {self.total_seconds or 0:.2f}s: " + " | ".join(parts)
+
+
+class _NullRun:
+    # ใช้เมื่อปิด instrumentation: ไม่มี hook และไม่มีการจับเวลา
+    def stage(self, name):
+        return nullcontext(self)
+
+    def attach(self, model):
+        return nullcontext(self)
+
+    def begin(self, name):
+        pass
+
+    def end(self, name):
+        pass
+
+    def add(self, name, **counters):
+        pass
+
+
+NULL_RUN = _NullRun()
+
+
+class Instrumentation:
+    # sink: on_record(run) เช่น log ของ GUI, ไฟล์ JSONL ที่หมุนเมื่อเกิน max_bytes และ trace ของ torch profiler
+    def __init__(self, enabled=True, metrics_path=None, max_bytes=5 * 1024 ** 2, profile_dir=None, on_record=None):
+        self.enabled = enabled
+        self.metrics_path = metrics_path
+        self.max_bytes = max_bytes
+        self.profile_dir = profile_dir
+        self.on_record = on_record
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def run(self, label, **info):
+        if not self.enabled:
+            yield NULL_RUN
+            return
+        run = Run(label, info, profiling=self.profile_dir is not None)
+        profiler = self._profiler()
+        with profiler or nullcontext():
+            try:
+                yield run
+            finally:
+                run.total_seconds = time.perf_counter() - run.start
+        if profiler is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.export_chrome_trace(os.path.join(
+                self.profile_dir, f"{label}-{time.strftime('%Y%m%d_%H%M%S')}-{id(run) & 0xffff:04x}.json"))
+        self._emit(run)
+
+    def _profiler(self):
+        if self.profile_dir is None:
+            return None
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return torch.profiler.profile(activities=activities, profile_memory=True)
+
+    def _emit(self, run):
+        if self.metrics_path is not None:
+            line = json.dumps(run.record(), ensure_ascii=False) + "\n"
+            with self._lock:
+                directory = os.path.dirname(self.metrics_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.metrics_path) and os.path.getsize(self.metrics_path) > self.max_bytes:
+                    os.replace(self.metrics_path, self.metrics_path + ".1")
+                with open(self.metrics_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        if self.on_record is not None:
+            self.on_record(run)
+
+
+DISABLED = Instrumentation(enabled=False)
@@ -0,0 +1,85 @@
+import torch
+
+from audio_writer import StreamingAudioWriter
+from resampling import StreamResampler
+
+
+def _crossfade(tail, head):
+    # crossfade แบบ linear (equal-gain) ระหว่างเสียงท้าย window ก่อนกับเสียงช่วงเดียวกันที่ decode ใหม่
+    # ทั้งสองมาจาก token ช่วง overlap เดียวกันจึงแทบเป็นสัญญาณเดียวกัน equal-power จะดังขึ้น ~3 dB กลางรอยต่อ
+    n = tail.shape[-1]
+    t = torch.linspace(0, 1, n, device=tail.device)
+    return tail * (1 - t) + head * t
+
+
+def generate_long(model, descriptions, duration, on_audio, window_seconds=30.0, overlap_seconds=10.0,
+                  crossfade_seconds=1.0, context_seconds=1.0, seed=None, on_progress=None, on_tokens=None,
+                  **params):
+    # สร้างเพลงยาวทีละ window; window ถัดไปใช้ token ช่วงท้ายของ window ก่อนเป็น prompt (continuation)
+    # เก็บไว้เพียง token ช่วง overlap และเสียงช่วง crossfade หน่วยความจำและเวลาต่อ step จึงคงที่ไม่ว่าเพลงยาวเท่าไร
+    # on_audio([B, C, N]) ได้รับเสียงที่เสร็จแล้วตามลำดับเวลา, on_tokens([B, K, T]) ได้รับ token ใหม่ของแต่ละ window
+    window_seconds = min(window_seconds, model.max_duration)
+    if not crossfade_seconds + context_seconds <= overlap_seconds < window_seconds:
+        raise ValueError("need crossfade + context <= overlap < window")
+
+    frame_rate = model.frame_rate
+    hop = int(model.sample_rate // frame_rate)
+    total_frames = int(duration * frame_rate)
+    window_frames = int(window_seconds * frame_rate)
+    overlap_frames = int(overlap_seconds * frame_rate)
+    crossfade_frames = int(crossfade_seconds * frame_rate)
+    context_frames = int(context_seconds * frame_rate)
+
+    if seed is not None:
+        torch.manual_seed(seed)
+    attributes, _ = model._prepare_tokens_and_attributes(list(descriptions), None)
+
+    prompt = None
+    tail_audio = None
+    generated = 0
+    while generated < total_frames:
+        prompt_frames = 0 if prompt is None else prompt.shape[-1]
+        new_frames = min(window_frames - prompt_frames, total_frames - generated)
+        # +0.5 frame กันปัดเศษผิดตอน audiocraft แปลง duration กลับเป็นจำนวน frame แต่ต้องไม่เกิน max_duration
+        # ไม่เช่นนั้น audiocraft จะเข้าทาง extend แบบ sliding window ของมันเองแทนการเรียก lm.generate ครั้งเดียว
+        duration = min((prompt_frames + new_frames + 0.5) / frame_rate, model.max_duration)
+        model.set_generation_params(duration=duration, **params)
+        tokens = model._generate_tokens(attributes, prompt)
+        if on_tokens is not None:
+            on_tokens(tokens[..., prompt_frames:])
+        final = generated + new_frames >= total_frames
+
+        # decode ช่วงใหม่พร้อม context ทางซ้าย; ช่วง crossfade คือ frame สุดท้ายของ window ก่อนที่ยังไม่ได้เขียน
+        lead_frames = min(prompt_frames, crossfade_frames + context_frames)
+        with torch.no_grad():
+            audio = model.compression_model.decode(tokens[..., prompt_frames - lead_frames:], None)
+        audio = audio[..., (lead_frames - (crossfade_frames if tail_audio is not None else 0)) * hop:]
+        if tail_audio is not None:
+            n = tail_audio.shape[-1]
+            audio = torch.cat([_crossfade(tail_audio, audio[..., :n]), audio[..., n:]], dim=-1)
+
+        if final:
+            on_audio(audio)
+        else:
+            keep = crossfade_frames * hop
+            on_audio(audio[..., :audio.shape[-1] - keep])
+            tail_audio = audio[..., audio.shape[-1] - keep:]
+            prompt = tokens[..., -overlap_frames:]
+
+        generated += new_frames
+        if on_progress is not None:
+            on_progress(generated / total_frames)
+
+
+def render_long(model, description, duration, path, sample_rate=None, **kwargs):
+    # เขียนลงไฟล์ตามที่ generate ได้ ไม่ต้องเก็บเพลงทั้งเพลงไว้ในหน่วยความจำ (flac/opus encode ตอนจบ)
+    sample_rate = sample_rate or model.sample_rate
+    resampler = StreamResampler(model.sample_rate, sample_rate)
+    with StreamingAudioWriter(path, sample_rate, model.audio_channels) as writer:
+        def on_audio(audio):
+            writer.write(resampler(audio[0].cpu()))
+        generate_long(model, [description], duration, on_audio, **kwargs)
+        tail = resampler.flush()
+        if tail is not None:
+            writer.write(tail)
+    return path
@@ -0,0 +1,106 @@
+import math
+
+import torch
+from torch import nn
+from torch.nn.utils import parametrize
+
+from checkpoint_format import load_mapped_weights, read_header, save_weights
+
+# projection ของ attention (q/k/v รวมกันใน in_proj_weight และ out_proj) และ feed-forward ของทุก layer
+TARGETS = ('in_proj_weight', 'out_proj.weight', 'linear1.weight', 'linear2.weight')
+
+
+class LoRA(nn.Module):
+    # parametrization: weight ที่ใช้จริง = W + (B @ A) * alpha / rank โดย W ถูก freeze ไว้
+    def __init__(self, out_features, in_features, rank, alpha):
+        super().__init__()
+        self.rank = rank
+        self.alpha = alpha
+        self.scale = alpha / rank
+        self.lora_A = nn.Parameter(torch.empty(rank, in_features))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, rank))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+
+    def forward(self, weight):
+        return weight + (self.lora_B @ self.lora_A).to(weight.dtype) * self.scale
+
+
+def _target_params(lm, targets=TARGETS):
+    for module_name, module in lm.transformer.named_modules():
+        for param_name in list(module._parameters):
+            full_name = f"{module_name}.{param_name}"
+            if any(full_name.endswith(target) for target in targets):
+                yield f"transformer.{full_name}", module, param_name
+
+
+def inject_lora(lm, rank=8, alpha=16, targets=TARGETS):
+    # freeze ทุก parameter ของ LM แล้วเพิ่ม adapter ที่เทรนได้เฉพาะตัวมันเอง
+    for param in lm.parameters():
+        param.requires_grad_(False)
+    count = 0
+    for _, module, param_name in list(_target_params(lm, targets)):
+        weight = getattr(module, param_name)
+        lora = LoRA(weight.shape[0], weight.shape[1], rank, alpha).to(device=weight.device, dtype=torch.float32)
+        parametrize.register_parametrization(module, param_name, lora)
+        count += 1
+    if count == 0:
+        raise ValueError(f"no LoRA targets matched {targets}")
+    return count
+
+
+def lora_modules(lm):
+    for module_name, module in lm.named_modules():
+        if not parametrize.is_parametrized(module):
+            continue
+        for param_name, parametrizations in module.parametrizations.items():
+            for parametrization in parametrizations:
+                if isinstance(parametrization, LoRA):
+                    # ชื่อเดียวกับ key ใน state_dict ของ LM ที่ไม่มี adapter
+                    yield f"{module_name}.{param_name}", parametrization
+
+
+def adapter_state_dict(lm):
+    state = {}
+    for name, lora in lora_modules(lm):
+        state[f"{name}.lora_A"] = lora.lora_A.detach()
+        state[f"{name}.lora_B"] = lora.lora_B.detach()
+    return state
+
+
+def save_adapter(lm, path, base_model, dtype=torch.float16):
+    # เก็บเฉพาะ A/B ของ adapter ขนาดไม่กี่ MB พร้อม rank/alpha ไว้ใน header
+    rank, alpha = next((lora.rank, lora.alpha) for _, lora in lora_modules(lm))
+    metadata = {'kind': 'lora', 'rank': str(rank), 'alpha': str(alpha), 'base_model': base_model}
+    return save_weights(adapter_state_dict(lm), path, dtype=dtype, metadata=metadata)
+
+
+def load_adapter(path):
+    header, _ = read_header(path)
+    metadata = header.get('__metadata__', {})
+    if metadata.get('kind') != 'lora':
+        raise ValueError(f"{path} is not a LoRA adapter")
+    state = load_mapped_weights(path)
+    pairs = {}
+    for key, tensor in state.items():
+        name, _, part = key.rpartition('.')
+        pairs.setdefault(name, {})[part] = tensor
+    scale = float(metadata['alpha']) / float(metadata['rank'])
+    return {
+        'checksum': metadata.get('checksum'),
+        'base_model': metadata.get('base_model'),
+        'scale': scale,
+        'pairs': {name: (pair['lora_A'], pair['lora_B']) for name, pair in pairs.items()},
+    }
+
+
+@torch.no_grad()
+def merge_adapter(weights, adapter, sign=1):
+    # weights: dict ชื่อ -> tensor ของ LM (เช่น weight set ของ ModelRegistry) แก้แบบ in-place
+    # merge แล้วไม่มีค่าใช้จ่ายตอน generate; sign=-1 ถอดออก (คำนวณใน fp32 จึงคลาดเคลื่อนน้อยมากกับ weights fp16)
+    missing = [name for name in adapter['pairs'] if name not in weights]
+    if missing:
+        raise KeyError(f"adapter does not match the LM: {missing[:5]}")
+    for name, (lora_A, lora_B) in adapter['pairs'].items():
+        weight = weights[name]
+        delta = lora_B.to(weight.device, torch.float32) @ lora_A.to(weight.device, torch.float32)
+        weight.copy_((weight.float() + sign * adapter['scale'] * delta).to(weight.dtype))
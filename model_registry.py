@@ -0,0 +1,120 @@
+import threading
+import time
+
+from audiocraft.models import MusicGen
+
+from checkpoint_format import load_weights
+from condition_cache import InferenceConditionCache
+from lora import merge_adapter
+
+BASE = "base"
+
+
+class ModelRegistry:
+    # โหลด compression model, T5 และ LM ครั้งเดียว แล้วเก็บ weights ของ LM หลายชุดไว้สลับกัน
+    # การสลับคือเปลี่ยน pointer ของ parameter ไปยัง tensor ของอีกชุด ไม่มีการ copy หรือโหลดใหม่
+    def __init__(self, name="facebook/musicgen-medium", device=None, lock=None, cpu_int8=False,
+                 condition_cache_mb=64):
+        self.name = name
+        self.cpu_int8 = cpu_int8
+        if cpu_int8:
+            from cpu_inference import configure_threads, load_cpu_model
+            configure_threads()
+            self.model = load_cpu_model(name)
+        else:
+            self.model = MusicGen.get_pretrained(name, device=device)
+        self.model.lm.eval()
+        # ผล T5 ของ prompt ที่เคยใช้ ใช้ร่วมกันทุกชุด weights (output_proj ของแต่ละชุดยังรันตามปกติ)
+        self.condition_cache = InferenceConditionCache(int(condition_cache_mb * 1024 ** 2))
+        self.condition_cache.install(self.model.lm.condition_provider)
+        # ต้องถือ lock นี้ตลอดการ generate เพื่อไม่ให้ weights ถูกสลับกลางคัน
+        self.lock = lock or threading.RLock()
+        # ชุด base อ้างถึง tensor เดิมของโมเดล จึงไม่ใช้หน่วยความจำเพิ่ม
+        # โหมด int8 weights ถูก pack ไว้ในแต่ละ Linear สลับ pointer ไม่ได้ จึงเก็บเป็น LM ทั้งตัวต่อชุดแทน
+        self.weight_sets = {BASE: self.model.lm if cpu_int8 else dict(self.model.lm.state_dict())}
+        self.active = BASE
+        # adapter ที่ merge อยู่ในแต่ละชุด weights (key -> adapter จาก lora.load_adapter)
+        self.adapters = {}
+
+    def __contains__(self, key):
+        return key in self.weight_sets
+
+    def add_weights(self, key, state_dict):
+        if self.cpu_int8:
+            raise ValueError("int8 mode quantizes whole checkpoints; use load_weights_file")
+        reference = self.weight_sets[BASE]
+        missing = reference.keys() - state_dict.keys()
+        unexpected = state_dict.keys() - reference.keys()
+        if missing or unexpected:
+            raise KeyError(f"weights do not match the LM: missing {sorted(missing)[:5]}, "
+                           f"unexpected {sorted(unexpected)[:5]}")
+        weights = {}
+        for name, tensor in state_dict.items():
+            target = reference[name]
+            if tensor.shape != target.shape:
+                raise ValueError(f"shape mismatch for {name}: {tuple(tensor.shape)} vs {tuple(target.shape)}")
+            weights[name] = tensor.to(device=target.device, dtype=target.dtype)
+        with self.lock:
+            self.weight_sets[key] = weights
+
+    def load_weights_file(self, key, path):
+        if self.cpu_int8:
+            from cpu_inference import load_quantized_lm
+            lm = load_quantized_lm(self.name, path, text_encoder_from=self.weight_sets[BASE])
+            self.condition_cache.install(lm.condition_provider)
+            with self.lock:
+                self.weight_sets[key] = lm
+            return
+        state_dict = load_weights(path)
+        self.add_weights(key, state_dict)
+
+    def activate(self, key):
+        with self.lock:
+            if key == self.active:
+                return 0.0
+            weights = self.weight_sets[key]
+            start = time.perf_counter()
+            if self.cpu_int8:
+                self.model.lm = weights
+                self.active = key
+                return time.perf_counter() - start
+            lm = self.model.lm
+            for name, param in lm.named_parameters():
+                param.data = weights[name]
+            for name, buffer in lm.named_buffers():
+                if name in weights:
+                    module_name, _, buffer_name = name.rpartition('.')
+                    module = lm.get_submodule(module_name) if module_name else lm
+                    module._buffers[buffer_name] = weights[name]
+            self.active = key
+            return time.perf_counter() - start
+
+    def warm_conditions(self, descriptions):
+        with self.lock:
+            return self.condition_cache.warm(self.model.lm.condition_provider, descriptions)
+
+    def apply_adapter(self, key, adapter):
+        # merge LoRA adapter ลงใน tensor ของชุด weights นี้โดยตรง generate จึงเร็วเท่าเดิม
+        # ชุดอื่น (รวมถึง base เมื่อ adapter อยู่บนชุด fine-tuned) ไม่ถูกแตะ
+        if self.cpu_int8:
+            raise ValueError("adapters cannot be merged into int8 weights; switch off CPU int8 mode")
+        with self.lock:
+            self.remove_adapter(key)
+            merge_adapter(self.weight_sets[key], adapter)
+            self.adapters[key] = adapter
+
+    def remove_adapter(self, key):
+        with self.lock:
+            adapter = self.adapters.pop(key, None)
+            if adapter is not None:
+                merge_adapter(self.weight_sets[key], adapter, sign=-1)
+            return adapter is not None
+
+    def remove(self, key):
+        if key == BASE:
+            raise ValueError("cannot remove the base weights")
+        with self.lock:
+            if self.active == key:
+                self.activate(BASE)
+            self.weight_sets.pop(key, None)
+            self.adapters.pop(key, None)
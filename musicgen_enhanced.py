@@ -1,38 +1,163 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
 import os
 import sys
-import torch
-from audiocraft.models import MusicGen
-import torchaudio
-import pygame
+from collections import OrderedDict
+from contextlib import nullcontext
 from datetime import datetime
 import gc
 
+from startup_timing import StartupTimer
+
+# torch, torchaudio, pygame and audiocraft take seconds to import, so they are loaded
+# by import_heavy_modules() on the background loader thread after the window is up
+torch = None
+pygame = None
+GenerationQueue = GenerationCache = ModelRegistry = weights_id = None
+generate_streaming = generate_long = ChunkPlayer = StreamingAudioWriter = Instrumentation = None
+load_adapter = None
+AudioWriter = resample = StreamResampler = BufferPlayer = None
+MAX_DURATION = 600
+# Finished jobs whose audio stays in memory for instant replay; older jobs replay from their file
+MAX_AUDIO_BUFFERS = 8
+GENERATING, DONE, FAILED = "generating", "done", "failed"
+BASE = "base"
+
+STARTUP_REPORT = "startup_timing.json"
+METRICS_FILE = "generation_metrics.jsonl"
+_startup = StartupTimer(_PROCESS_START)
+_startup.mark("gui_imports")
+
+
+def import_heavy_modules():
+    global torch, pygame, GenerationQueue, GenerationCache, ModelRegistry, weights_id
+    global generate_streaming, generate_long, ChunkPlayer, StreamingAudioWriter, Instrumentation, load_adapter
+    global AudioWriter, resample, StreamResampler, BufferPlayer
+    if ModelRegistry is not None:
+        return
+    import torch as _torch
+    import pygame as _pygame
+    from generation_queue import GenerationQueue as _GenerationQueue
+    from generation_cache import GenerationCache as _GenerationCache, weights_id as _weights_id
+    from model_registry import ModelRegistry as _ModelRegistry
+    from streaming import generate_streaming as _generate_streaming
+    from longform import generate_long as _generate_long
+    from audio_output import BufferPlayer as _BufferPlayer, ChunkPlayer as _ChunkPlayer
+    from audio_writer import AudioWriter as _AudioWriter, StreamingAudioWriter as _StreamingAudioWriter
+    from resampling import StreamResampler as _StreamResampler, resample as _resample
+    from instrumentation import Instrumentation as _Instrumentation
+    from lora import load_adapter as _load_adapter
+    torch, pygame = _torch, _pygame
+    generate_streaming, ChunkPlayer, StreamingAudioWriter = _generate_streaming, _ChunkPlayer, _StreamingAudioWriter
+    generate_long, Instrumentation, load_adapter = _generate_long, _Instrumentation, _load_adapter
+    AudioWriter, resample, StreamResampler, BufferPlayer = _AudioWriter, _resample, _StreamResampler, _BufferPlayer
+    GenerationQueue, GenerationCache, weights_id = _GenerationQueue, _GenerationCache, _weights_id
+    ModelRegistry = _ModelRegistry
+
+PRESETS = [
+    "Thai song with kim",
+]
+
 class MusicGenGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("MusicGen - AI Music Generator")
-        self.root.geometry("900x700")
+        self.root.geometry("900x850")
         self.root.configure(bg='#2c3e50')
         
-        # Initialize pygame mixer for audio playback
-        pygame.mixer.init()
+        self.startup = _startup
+        self.runtime_lock = threading.Lock()
         
         # Variables
-        self.base_model = None
-        self.finetuned_model = None
+        # One registry holds the shared model; base and Thai LM weights are swapped in place
+        self.registry = None
+        self.model_lock = threading.RLock()
         self.current_model = None
+        self.current_weight_set = BASE
         self.is_generating = False
         self.is_loading = False
         self.current_audio_file = None
+        self.current_job_id = None
+        # job id -> (waveform at the job's sample rate, sample rate); guarded by buffer_lock
+        self.audio_buffers = OrderedDict()
+        self.buffer_lock = threading.Lock()
+        self.buffer_player = None
         self.model_type = "base"  # "base" or "finetuned"
+        self.current_weights_id = None
+        self.stream_player = None
+        
+        # Created by init_runtime() once the heavy modules are imported
+        self.generation_cache = None
+        self.job_queue = None
+        self.audio_writer = None
+        self.pending_writes = {}
+        self.instrumentation = None
         
         self.setup_ui()
+        self.root.after(0, self.on_window_ready)
+    
+    def on_window_ready(self):
+        # First event loop turn: the window is drawn, so the slow imports can start now
+        self.startup.mark("window_ready")
+        
         # Load base model on startup
         self.load_base_model_startup()
     
+    def init_runtime(self):
+        # Runs on a loader thread; only the first call does any work
+        with self.runtime_lock:
+            if self.job_queue is not None:
+                return
+            start = time.perf_counter()
+            import_heavy_modules()
+            self.startup.mark("heavy_imports")
+            self.log_message(f"📦 Libraries imported in {time.perf_counter() - start:.1f}s")
+            
+            # Initialize pygame mixer for audio playback
+            pygame.mixer.init()
+            
+            # int8 changes the model's output, so it stays opt-in even without a GPU
+            if not torch.cuda.is_available() and not self.cpu_int8_var.get():
+                self.log_message("💡 No GPU found: enable '⚡ CPU int8 mode' for faster CPU generation")
+            
+            # Seeded generations are cached on disk so repeated presets return instantly
+            self.generation_cache = GenerationCache("generation_cache")
+            
+            # Per-stage timings go to the log, a rolling JSONL file and, if MUSICGEN_PROFILE_DIR is set,
+            # a torch profiler trace per generation
+            self.instrumentation = Instrumentation(
+                enabled=self.metrics_var.get(),
+                metrics_path=METRICS_FILE,
+                profile_dir=os.environ.get("MUSICGEN_PROFILE_DIR") or None,
+                on_record=lambda run: self.root.after(0, self.log_message, f"📊 {run.summary()}")
+            )
+            
+            # FLAC/Opus encoding and token files are written off the queue worker
+            self.audio_writer = AudioWriter(max_workers=2)
+            
+            # Generation queue: one worker merges pending jobs with the same duration into one batch
+            self.job_queue = GenerationQueue(
+                get_model=self.model_for_job,
+                save_job=self.save_generated_job,
+                on_update=lambda job: self.root.after(0, self.update_job_row, job),
+                on_idle=lambda: self.root.after(0, self.on_queue_idle),
+                cache=self.generation_cache,
+                model_lock=self.model_lock,
+                stream_job=self.stream_generated_job,
+                instrumentation=self.instrumentation
+            )
+    
+    def report_startup(self):
+        self.log_message(f"⏱️ Startup: {self.startup.summary()}")
+        try:
+            self.startup.save(STARTUP_REPORT)
+        except OSError as e:
+            self.log_message(f"❌ Could not write {STARTUP_REPORT}: {str(e)}")
+    
     def setup_ui(self):
         # Title
         title_frame = tk.Frame(self.root, bg='#2c3e50')
@@ -162,6 +287,72 @@ class MusicGenGUI:
         )
         self.unload_model_btn.pack(side='left')
         
+        # CPU mode: int8 LM with tuned thread counts (turned on automatically when no GPU is found)
+        self.cpu_int8_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            model_control_frame,
+            text="⚡ CPU int8 mode",
+            variable=self.cpu_int8_var,
+            command=self.on_cpu_mode_change,
+            font=("Arial", 10, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e',
+            selectcolor='#2c3e50',
+            activebackground='#34495e',
+            activeforeground='#ecf0f1'
+        ).pack(side='left', padx=(20, 0))
+        
+        # LoRA adapter merged on top of the active LM weights
+        adapter_frame = tk.Frame(model_frame, bg='#34495e')
+        adapter_frame.pack(fill='x', pady=(0, 5))
+        
+        tk.Label(
+            adapter_frame,
+            text="LoRA Adapter:",
+            font=("Arial", 11, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e'
+        ).pack(side='left')
+        
+        self.adapter_path_var = tk.StringVar(value="")
+        tk.Entry(
+            adapter_frame,
+            textvariable=self.adapter_path_var,
+            font=("Arial", 10),
+            width=35,
+            state='readonly'
+        ).pack(side='left', fill='x', expand=True, padx=5)
+        
+        tk.Button(
+            adapter_frame,
+            text="📁 Browse",
+            command=self.browse_adapter_file,
+            bg='#3498db',
+            fg='white',
+            font=("Arial", 10, "bold"),
+            relief='flat'
+        ).pack(side='left', padx=(0, 5))
+        
+        tk.Button(
+            adapter_frame,
+            text="➕ Apply",
+            command=self.apply_adapter,
+            bg='#27ae60',
+            fg='white',
+            font=("Arial", 10, "bold"),
+            relief='flat'
+        ).pack(side='left', padx=(0, 5))
+        
+        tk.Button(
+            adapter_frame,
+            text="➖ Remove",
+            command=self.remove_adapter,
+            bg='#e74c3c',
+            fg='white',
+            font=("Arial", 10, "bold"),
+            relief='flat'
+        ).pack(side='left')
+        
         # Model status
         self.model_status_label = tk.Label(
             model_frame,
@@ -200,9 +391,7 @@ class MusicGenGUI:
         preset_combo = ttk.Combobox(
             preset_frame,
             textvariable=self.preset_var,
-            values=[
-                "Thai song with kim",
-            ],
+            values=PRESETS,
             width=30,
             state="readonly"
         )
@@ -248,7 +437,7 @@ class MusicGenGUI:
         duration_spinbox = tk.Spinbox(
             duration_frame,
             from_=5,
-            to=30,
+            to=MAX_DURATION,
             textvariable=self.duration_var,
             width=10,
             font=("Arial", 10)
@@ -274,13 +463,109 @@ class MusicGenGUI:
         )
         sample_rate_combo.pack(side='left', padx=(10, 0))
         
+        # Seed setting (empty = random, a fixed seed makes repeats come from the cache)
+        tk.Label(
+            duration_frame,
+            text="Seed:",
+            font=("Arial", 11, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e'
+        ).pack(side='left', padx=(30, 0))
+        
+        self.seed_var = tk.StringVar(value="")
+        seed_entry = tk.Entry(
+            duration_frame,
+            textvariable=self.seed_var,
+            width=10,
+            font=("Arial", 10)
+        )
+        seed_entry.pack(side='left', padx=(10, 0))
+        
+        # Streaming: play the first seconds while the rest is still being generated
+        self.stream_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            duration_frame,
+            text="Play while generating",
+            variable=self.stream_var,
+            font=("Arial", 10, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e',
+            selectcolor='#2c3e50',
+            activebackground='#34495e',
+            activeforeground='#ecf0f1'
+        ).pack(side='left', padx=(20, 0))
+        
+        # Stage timings (conditioning, LM sampling, decode, save, playback load)
+        self.metrics_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            duration_frame,
+            text="Stage timings",
+            variable=self.metrics_var,
+            command=self.on_metrics_toggle,
+            font=("Arial", 10, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e',
+            selectcolor='#2c3e50',
+            activebackground='#34495e',
+            activeforeground='#ecf0f1'
+        ).pack(side='left', padx=(10, 0))
+        
+        # Output format and token files
+        output_frame = tk.Frame(settings_frame, bg='#34495e')
+        output_frame.pack(fill='x', pady=(10, 0))
+        
+        tk.Label(
+            output_frame,
+            text="Output Format:",
+            font=("Arial", 11, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e'
+        ).pack(side='left')
+        
+        self.format_var = tk.StringVar(value="wav")
+        ttk.Combobox(
+            output_frame,
+            textvariable=self.format_var,
+            values=["wav", "flac", "opus"],
+            width=6,
+            state="readonly"
+        ).pack(side='left', padx=(10, 0))
+        
+        # EnCodec codes as a tiny .npz next to the audio, re-decodable with token_artifact.py
+        self.tokens_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            output_frame,
+            text="Keep tokens (.npz)",
+            variable=self.tokens_var,
+            font=("Arial", 10, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e',
+            selectcolor='#2c3e50',
+            activebackground='#34495e',
+            activeforeground='#ecf0f1'
+        ).pack(side='left', padx=(20, 0))
+        
+        # Audio is kept in memory for playback; the file is written in the background when enabled
+        self.save_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(
+            output_frame,
+            text="Save to disk",
+            variable=self.save_var,
+            font=("Arial", 10, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e',
+            selectcolor='#2c3e50',
+            activebackground='#34495e',
+            activeforeground='#ecf0f1'
+        ).pack(side='left', padx=(20, 0))
+        
         # Buttons frame
         buttons_frame = tk.Frame(main_frame, bg='#34495e')
         buttons_frame.pack(fill='x', padx=20, pady=10)
         
         self.generate_btn = tk.Button(
             buttons_frame,
-            text="🎵 Generate Music",
+            text="🎵 Add to Queue",
             command=self.generate_music,
             bg='#27ae60',
             fg='white',
@@ -329,6 +614,36 @@ class MusicGenGUI:
         )
         save_btn.pack(side='right')
         
+        # Generation queue
+        queue_frame = tk.Frame(main_frame, bg='#34495e')
+        queue_frame.pack(fill='x', padx=20, pady=(0, 5))
+        
+        tk.Label(
+            queue_frame,
+            text="Generation Queue:",
+            font=("Arial", 11, "bold"),
+            fg='#ecf0f1',
+            bg='#34495e'
+        ).pack(anchor='w')
+        
+        self.job_tree = ttk.Treeview(
+            queue_frame,
+            columns=("id", "description", "duration", "status", "output"),
+            show='headings',
+            height=5
+        )
+        for column, heading, width in (
+            ("id", "#", 40),
+            ("description", "Description", 280),
+            ("duration", "Duration", 70),
+            ("status", "Status", 90),
+            ("output", "Output File", 300),
+        ):
+            self.job_tree.heading(column, text=heading)
+            self.job_tree.column(column, width=width, anchor='w')
+        self.job_tree.pack(fill='x', pady=(5, 0))
+        self.job_tree.bind('<<TreeviewSelect>>', self.on_job_select)
+        
         # Progress bar
         self.progress = ttk.Progressbar(
             main_frame,
@@ -377,15 +692,26 @@ class MusicGenGUI:
     def load_base_model_startup(self):
         def load_in_thread():
             try:
+                self.init_runtime()
                 self.log_message("📥 Loading MusicGen medium model...")
-                self.base_model = MusicGen.get_pretrained("facebook/musicgen-medium")
-                self.current_model = self.base_model
+                self.registry = ModelRegistry("facebook/musicgen-medium", lock=self.model_lock,
+                                                  cpu_int8=self.cpu_int8_var.get())
+                self.current_model = self.registry.model
+                self.current_weight_set = BASE
                 self.model_type = "base"
+                self.current_weights_id = self.weights_key(None)
                 
                 self.log_message("✅ Base model loaded successfully!")
+                # Encode the preset prompts now so picking one skips the text encoder
+                start = time.perf_counter()
+                encoded = self.registry.warm_conditions(PRESETS)
+                self.log_message(f"🧠 Pre-encoded {encoded} preset conditions in {time.perf_counter() - start:.2f}s")
                 self.model_status_label.config(text="✅ Base Model Ready", fg='#27ae60')
                 self.generate_btn.config(state='normal')
                 self.unload_model_btn.config(state='normal')
+                if "model_ready" not in self.startup.phases:
+                    self.startup.mark("model_ready")
+                    self.root.after(0, self.report_startup)
                 
             except Exception as e:
                 self.log_message(f"❌ Error loading base model: {str(e)}")
@@ -393,10 +719,27 @@ class MusicGenGUI:
         
         threading.Thread(target=load_in_thread, daemon=True).start()
     
+    def weights_key(self, path):
+        # int8 output differs from fp32 for the same seed, so it gets its own cache entries
+        key = weights_id(path)
+        adapter = self.registry.adapters.get(path or BASE) if self.registry is not None else None
+        if adapter is not None:
+            key += f"+lora:{adapter['checksum']}"
+        return f"{key}:int8" if self.registry is not None and self.registry.cpu_int8 else key
+    
+    def on_metrics_toggle(self):
+        if self.instrumentation is not None:
+            self.instrumentation.enabled = self.metrics_var.get()
+    
+    def on_cpu_mode_change(self):
+        if self.registry is not None and self.registry.cpu_int8 != self.cpu_int8_var.get():
+            self.log_message("ℹ️ Unload and reload the model to switch CPU int8 mode")
+    
     def browse_model_file(self):
         filename = filedialog.askopenfilename(
             title="Select Your Thai Music Model",
-            filetypes=[("PyTorch Model files", "*.pt"), ("PyTorch files", "*.pth"), ("All files", "*.*")],
+            filetypes=[("PyTorch Model files", "*.pt"), ("PyTorch files", "*.pth"),
+                       ("Safetensors files", "*.safetensors"), ("All files", "*.*")],
             initialdir=os.getcwd()
         )
         if filename:
@@ -404,6 +747,54 @@ class MusicGenGUI:
             self.model_path_entry.config(fg='#2c3e50')
             self.log_message(f"📁 Thai model file selected: {os.path.basename(filename)}")
     
+    def browse_adapter_file(self):
+        filename = filedialog.askopenfilename(
+            title="Select a LoRA Adapter",
+            filetypes=[("Safetensors files", "*.safetensors"), ("All files", "*.*")],
+            initialdir=os.getcwd()
+        )
+        if filename:
+            self.adapter_path_var.set(filename)
+            self.log_message(f"📁 Adapter selected: {os.path.basename(filename)}")
+    
+    def current_weights_path(self):
+        return None if self.current_weight_set == BASE else self.current_weight_set
+    
+    def apply_adapter(self):
+        path = self.adapter_path_var.get()
+        if self.registry is None:
+            messagebox.showwarning("Warning", "Load a model before applying an adapter!")
+            return
+        if not path or not os.path.exists(path):
+            messagebox.showwarning("Warning", "Please select an adapter file first!")
+            return
+        
+        def apply_in_thread():
+            try:
+                adapter = load_adapter(path)
+                # Waits for the running batch; later batches on this weight set use the adapter
+                start = time.perf_counter()
+                self.registry.apply_adapter(self.current_weight_set, adapter)
+                self.current_weights_id = self.weights_key(self.current_weights_path())
+                self.log_message(f"🎚️ Adapter {os.path.basename(path)} merged in "
+                                 f"{(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                self.log_message(f"❌ Error applying adapter: {str(e)}")
+                messagebox.showerror("Adapter Error", f"Failed to apply adapter:\n{str(e)}")
+        
+        threading.Thread(target=apply_in_thread, daemon=True).start()
+    
+    def remove_adapter(self):
+        if self.registry is None:
+            return
+        
+        def remove_in_thread():
+            if self.registry.remove_adapter(self.current_weight_set):
+                self.current_weights_id = self.weights_key(self.current_weights_path())
+                self.log_message("🎚️ Adapter removed")
+        
+        threading.Thread(target=remove_in_thread, daemon=True).start()
+    
     def load_selected_model(self):
         if self.is_loading:
             return
@@ -411,9 +802,11 @@ class MusicGenGUI:
         model_type = self.model_type_var.get()
         
         if model_type == "base":
-            if self.base_model is not None:
-                self.current_model = self.base_model
+            if self.registry is not None:
+                # Jobs already queued keep their own weights; the worker swaps per batch
+                self.current_weight_set = BASE
                 self.model_type = "base"
+                self.current_weights_id = self.weights_key(None)
                 self.model_status_label.config(text="✅ Base Model Active", fg='#27ae60')
                 self.generate_btn.config(state='normal')
                 self.unload_model_btn.config(state='normal')
@@ -441,24 +834,27 @@ class MusicGenGUI:
         
         def load_in_thread():
             try:
-                if self.base_model is None:
+                self.init_runtime()
+                if self.registry is None:
                     self.log_message("📥 Loading base model first...")
-                    self.base_model = MusicGen.get_pretrained("facebook/musicgen-medium")
+                    self.registry = ModelRegistry("facebook/musicgen-medium", lock=self.model_lock,
+                                                      cpu_int8=self.cpu_int8_var.get())
+                    self.current_model = self.registry.model
                 
                 self.log_message("🇹🇭 Loading Thai music model...")
                 self.log_message(f"📂 File: {os.path.basename(model_path)}")
                 
-                # Create finetuned model from base
-                self.finetuned_model = MusicGen.get_pretrained("facebook/musicgen-medium")
+                # Load the finetuned LM weights once; the compression model and T5 are shared
+                if model_path not in self.registry:
+                    self.registry.load_weights_file(model_path, model_path)
                 
-                # Load the finetuned weights
-                checkpoint = torch.load(model_path, map_location='cpu')
-                self.finetuned_model.lm.load_state_dict(checkpoint)
-                self.finetuned_model.lm.eval()
+                swap_time = self.registry.activate(model_path)
+                self.log_message(f"🔁 LM weights swapped in {swap_time * 1000:.1f} ms")
                 
                 # Set as current model
-                self.current_model = self.finetuned_model
+                self.current_weight_set = model_path
                 self.model_type = "finetuned"
+                self.current_weights_id = self.weights_key(model_path)
                 
                 self.log_message("✅ Thai music model loaded successfully!")
                 self.model_status_label.config(text="✅ Thai Model Active", fg='#27ae60')
@@ -479,49 +875,42 @@ class MusicGenGUI:
         threading.Thread(target=load_in_thread, daemon=True).start()
     
     def unload_current_model(self):
-        try:
-            self.log_message("🗑️ Unloading current model...")
-            
-            # Stop any ongoing generation
-            self.is_generating = False
-            
-            # Clear current model
-            if self.current_model is not None:
-                del self.current_model
-                self.current_model = None
-            
-            # Clear finetuned model if exists
-            if self.finetuned_model is not None:
-                del self.finetuned_model
-                self.finetuned_model = None
-            
-            # Clear base model
-            if self.base_model is not None:
-                del self.base_model
-                self.base_model = None
-            
-            # Force garbage collection
-            gc.collect()
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-            
-            # Update UI
-            self.model_status_label.config(text="🚫 No Model Loaded", fg='#7f8c8d')
-            self.generate_btn.config(state='disabled')
-            self.unload_model_btn.config(state='disabled')
-            self.load_model_btn.config(state='normal', text='🔄 Load Selected Model', bg='#e67e22')
-            self.model_type = None
-            
-            self.log_message("✅ Model unloaded successfully!")
-            self.log_message("💾 Memory freed")
-            
-        except Exception as e:
-            self.log_message(f"❌ Error unloading model: {str(e)}")
+        # The queue worker holds model_lock for a whole generation, so the lock is taken on a helper
+        # thread: the window stays responsive and the model is unloaded once the current job finishes
+        self.log_message("🗑️ Unloading model after the current job...")
+        self.is_generating = False
+        self.generate_btn.config(state='disabled')
+        self.unload_model_btn.config(state='disabled')
+        
+        def unload_in_thread():
+            try:
+                # Clear the shared model and every LM weight set
+                with self.model_lock:
+                    self.current_model = None
+                    self.registry = None
+                    self.current_weight_set = BASE
+                
+                # Force garbage collection
+                gc.collect()
+                if torch is not None and torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                self.root.after(0, self.on_model_unloaded)
+            except Exception as e:
+                self.root.after(0, self.log_message, f"❌ Error unloading model: {str(e)}")
+        
+        threading.Thread(target=unload_in_thread, daemon=True).start()
     
-    def generate_music(self):
-        if self.is_generating:
-            return
+    def on_model_unloaded(self):
+        self.model_status_label.config(text="🚫 No Model Loaded", fg='#7f8c8d')
+        self.generate_btn.config(state='disabled')
+        self.unload_model_btn.config(state='disabled')
+        self.load_model_btn.config(state='normal', text='🔄 Load Selected Model', bg='#e67e22')
+        self.model_type = None
         
+        self.log_message("✅ Model unloaded successfully!")
+        self.log_message("💾 Memory freed")
+    
+    def generate_music(self):
         description = self.description_text.get('1.0', tk.END).strip()
         if not description:
             messagebox.showwarning("Warning", "Please enter a music description!")
@@ -531,53 +920,242 @@ class MusicGenGUI:
             messagebox.showerror("Error", "No model loaded! Please load a model first.")
             return
         
-        self.is_generating = True
-        self.generate_btn.config(state='disabled')
-        self.progress.start()
+        try:
+            duration = int(self.duration_var.get())
+            sample_rate = int(self.sample_rate_var.get())
+            seed = int(self.seed_var.get()) if self.seed_var.get().strip() else None
+        except ValueError:
+            messagebox.showwarning("Warning", "Duration, sample rate and seed must be numbers!")
+            return
+        if not 1 <= duration <= MAX_DURATION:
+            messagebox.showwarning("Warning", f"Duration must be between 1 and {MAX_DURATION} seconds!")
+            return
         
-        def generate_in_thread():
-            try:
-                duration = int(self.duration_var.get())
-                sample_rate = int(self.sample_rate_var.get())
-                
-                model_name = "Thai Music Model" if self.model_type == "finetuned" else "Base Model"
-                self.log_message(f"🎵 Generating with {model_name}: '{description}'")
-                self.log_message(f"Duration: {duration}s, Sample Rate: {sample_rate}Hz")
-                
-                # Set generation parameters
-                self.current_model.set_generation_params(duration=duration)
-                
-                # Generate music
-                descriptions = [description]
-                waveforms = self.current_model.generate(descriptions)
-                
-                # Save generated audio
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                model_suffix = "_thai" if self.model_type == "finetuned" else "_base"
-                filename = f"generated_music{model_suffix}_{timestamp}.wav"
-                torchaudio.save(filename, waveforms[0].cpu(), sample_rate=sample_rate)
-                
-                self.current_audio_file = filename
-                self.log_message(f"✅ Music generated and saved as: {filename}")
-                
-                # Enable play button
-                self.play_btn.config(state='normal')
-                
-            except Exception as e:
-                self.log_message(f"❌ Error generating music: {str(e)}")
-                messagebox.showerror("Generation Error", str(e))
-            
-            finally:
-                self.is_generating = False
-                self.generate_btn.config(state='normal')
-                self.progress.stop()
+        job = self.job_queue.submit(
+            description,
+            duration,
+            model_type=self.model_type,
+            sample_rate=sample_rate,
+            seed=seed,
+            weights=self.current_weights_id,
+            weight_set=self.current_weight_set,
+            stream=self.stream_var.get(),
+            audio_format=self.format_var.get(),
+            keep_tokens=self.tokens_var.get(),
+            save_to_disk=self.save_var.get()
+        )
+        
+        model_name = "Thai Music Model" if self.model_type == "finetuned" else "Base Model"
+        self.log_message(f"📝 Job #{job.id} queued ({model_name}): '{description}'")
+        self.log_message(f"Duration: {duration}s, Sample Rate: {sample_rate}Hz")
+        
+        if not self.is_generating:
+            self.is_generating = True
+            self.progress.config(mode='indeterminate', value=0)
+            self.progress.start()
+    
+    def model_for_job(self, job):
+        # Called on the queue worker with model_lock held
+        if self.registry is None:
+            return None
+        self.registry.activate(job.weight_set)
+        return self.registry.model
+    
+    def output_filename(self, job, extension=None):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        model_suffix = "_thai" if job.model_type == "finetuned" else "_base"
+        return f"generated_music{model_suffix}_{timestamp}_{job.id}.{extension or job.audio_format}"
+    
+    def keep_audio_buffer(self, job, waveform, sample_rate):
+        with self.buffer_lock:
+            self.audio_buffers[job.id] = (waveform, sample_rate)
+            while len(self.audio_buffers) > MAX_AUDIO_BUFFERS:
+                self.audio_buffers.popitem(last=False)
+    
+    def audio_buffer(self, job_id):
+        with self.buffer_lock:
+            return self.audio_buffers.get(job_id)
+    
+    def save_generated_job(self, job, waveform, model_sample_rate, codes=None):
+        # Runs on the queue worker thread. The audio is resampled to the chosen rate (cached kernels) and kept
+        # in memory for playback; encoding and disk I/O happen on the audio writer
+        audio = resample(waveform, model_sample_rate, job.sample_rate)
+        self.keep_audio_buffer(job, audio, job.sample_rate)
+        filename = self.output_filename(job)
+        if job.save_to_disk:
+            self.pending_writes[filename] = self.audio_writer.submit(filename, audio, job.sample_rate)
+        if codes is not None:
+            self.save_job_tokens(job, filename, codes)
+        return filename if job.save_to_disk else None
+    
+    def save_job_tokens(self, job, filename, codes):
+        self.audio_writer.submit_tokens(f"{os.path.splitext(filename)[0]}.npz", codes,
+                                        model_name=self.registry.name, sample_rate=self.registry.model.sample_rate,
+                                        frame_rate=self.registry.model.frame_rate,
+                                        description=job.description, seed=job.seed)
+    
+    def wait_for_write(self, filename):
+        future = self.pending_writes.pop(filename, None)
+        if future is not None:
+            future.result()
+    
+    def stream_generated_job(self, job, model):
+        # Runs on the queue worker thread with model_lock held; chunks are played as they arrive.
+        # Jobs within the model window are kept in memory and saved like batched jobs once complete.
+        # Longer jobs are rendered window by window with generate_long and written to disk as they arrive
+        # (encoded to the chosen format at the end)
+        long_form = job.duration > model.max_duration
+        filename = self.output_filename(job) if long_form else None
+        player = ChunkPlayer(model.sample_rate) if job.stream else None
+        start = time.perf_counter()
+        last_percent = [-1]
+        chunks = [0]
+        parts = []
+        windows = []
+        resampler = StreamResampler(model.sample_rate, job.sample_rate)
+        
+        def on_chunk(chunk):
+            audio = chunk[0]
+            chunks[0] += 1
+            if chunks[0] == 1:
+                latency = time.perf_counter() - start
+                self.root.after(0, self.log_message, f"🔊 Job #{job.id}: first audio after {latency:.1f}s")
+            if player is not None:
+                player.feed(audio)
+            if writer is not None:
+                writer.write(resampler(audio.cpu()))
+            else:
+                parts.append(audio.cpu())
+        
+        def on_progress(fraction):
+            percent = int(fraction * 100)
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                self.root.after(0, self.set_progress, percent)
+        
+        if player is not None:
+            self.root.after(0, self.start_stream_playback, job, player)
+        file_writer = StreamingAudioWriter(filename, job.sample_rate, model.audio_channels) if long_form else None
+        with file_writer or nullcontext() as writer:
+            if long_form:
+                generate_long(model, [job.description], job.duration, on_chunk, seed=job.seed,
+                              on_progress=on_progress, on_tokens=windows.append if job.keep_tokens else None)
+                codes = torch.cat(windows, dim=-1) if job.keep_tokens else None
+                tail = resampler.flush()
+                if tail is not None:
+                    writer.write(tail)
+            else:
+                _, codes = generate_streaming(model, [job.description], job.duration, on_chunk,
+                                              seed=job.seed, on_progress=on_progress, return_tokens=True)
+        if player is not None:
+            player.finish()
+        codes = codes[0] if job.keep_tokens else None
+        if not long_form:
+            return self.save_generated_job(job, torch.cat(parts, dim=-1), model.sample_rate, codes)
+        if codes is not None:
+            self.save_job_tokens(job, filename, codes)
+        return filename
+    
+    def set_progress(self, percent):
+        if str(self.progress.cget('mode')) != 'determinate':
+            self.progress.stop()
+            self.progress.config(mode='determinate', maximum=100)
+        self.progress.config(value=percent)
+    
+    def start_stream_playback(self, job, player):
+        if self.stream_player is not None:
+            self.stream_player.stop()
+        pygame.mixer.music.stop()
+        self.stream_player = player
+        self.stop_btn.config(state='normal')
+        self.pump_stream(job, player)
+    
+    def pump_stream(self, job, player):
+        if player is not self.stream_player:
+            return
+        playing = player.pump()
+        if playing or job.status not in (DONE, FAILED):
+            self.root.after(100, self.pump_stream, job, player)
+    
+    def update_job_row(self, job):
+        output = job.output or ("(in memory)" if job.status == DONE else "")
+        values = (job.id, job.description, f"{job.duration}s", job.status, output)
+        item_id = str(job.id)
+        if self.job_tree.exists(item_id):
+            self.job_tree.item(item_id, values=values)
+        else:
+            self.job_tree.insert('', 'end', iid=item_id, values=values)
+            self.job_tree.see(item_id)
         
-        threading.Thread(target=generate_in_thread, daemon=True).start()
+        if job.status == GENERATING:
+            self.log_message(f"🎵 Generating job #{job.id}...")
+        elif job.status == DONE:
+            self.current_audio_file = job.output
+            self.current_job_id = job.id
+            if job.output:
+                self.log_message(f"✅ Job #{job.id} generated and saved as: {job.output}")
+            else:
+                self.log_message(f"✅ Job #{job.id} generated (in memory, use Save to write a file)")
+            if "first_generation" not in self.startup.phases:
+                self.startup.mark("first_generation")
+                self.report_startup()
+            if job.seed is not None:
+                stats = self.generation_cache.stats()
+                self.log_message(f"♻️ Cache: {stats['hits']} hits / {stats['misses']} misses")
+            self.play_btn.config(state='normal')
+        elif job.status == FAILED:
+            self.log_message(f"❌ Error generating job #{job.id}: {job.error}")
+    
+    def on_job_select(self, event=None):
+        selection = self.job_tree.selection()
+        if not selection:
+            return
+        job = next((j for j in self.job_queue.jobs if str(j.id) == selection[0]), None)
+        if job is not None and job.status == DONE:
+            self.current_audio_file = job.output
+            self.current_job_id = job.id
+            self.play_btn.config(state='normal')
+    
+    def on_queue_idle(self):
+        if self.job_queue.pending_count() == 0 and not self.job_queue.busy:
+            self.is_generating = False
+            self.progress.stop()
+            self.progress.config(mode='indeterminate', value=0)
     
     def play_audio(self):
+        buffer = self.audio_buffer(self.current_job_id)
+        if buffer is not None:
+            # Straight from memory: no file write and read back
+            try:
+                if self.stream_player is not None:
+                    self.stream_player.stop()
+                    self.stream_player = None
+                pygame.mixer.music.stop()
+                if self.buffer_player is None:
+                    self.buffer_player = BufferPlayer()
+                with self.instrumentation.run("playback", job=self.current_job_id) as run:
+                    with run.stage("buffer_to_sound"):
+                        self.buffer_player.play(*buffer)
+                self.log_message(f"▶️ Playing job #{self.current_job_id} from memory")
+                self.stop_btn.config(state='normal')
+            except Exception as e:
+                self.log_message(f"❌ Error playing audio: {str(e)}")
+            return
+        if self.current_audio_file:
+            try:
+                self.wait_for_write(self.current_audio_file)
+            except Exception as e:
+                self.log_message(f"❌ Error writing {self.current_audio_file}: {str(e)}")
         if self.current_audio_file and os.path.exists(self.current_audio_file):
             try:
-                pygame.mixer.music.load(self.current_audio_file)
+                if self.stream_player is not None:
+                    self.stream_player.stop()
+                    self.stream_player = None
+                if self.buffer_player is not None:
+                    self.buffer_player.stop()
+                with self.instrumentation.run("playback", file=self.current_audio_file) as run:
+                    with run.stage("pygame_load"):
+                        pygame.mixer.music.load(self.current_audio_file)
                 pygame.mixer.music.play()
                 self.log_message(f"▶️ Playing: {self.current_audio_file}")
                 self.stop_btn.config(state='normal')
@@ -587,15 +1165,28 @@ class MusicGenGUI:
             messagebox.showwarning("Warning", "No audio file to play!")
     
     def stop_audio(self):
+        if pygame is None:
+            return
+        if self.stream_player is not None:
+            self.stream_player.stop()
+            self.stream_player = None
+        if self.buffer_player is not None:
+            self.buffer_player.stop()
         pygame.mixer.music.stop()
         self.log_message("⏹️ Audio stopped")
         self.stop_btn.config(state='disabled')
     
     def save_audio(self):
+        if self.current_audio_file:
+            try:
+                self.wait_for_write(self.current_audio_file)
+            except Exception as e:
+                self.log_message(f"❌ Error writing {self.current_audio_file}: {str(e)}")
         if self.current_audio_file and os.path.exists(self.current_audio_file):
+            extension = os.path.splitext(self.current_audio_file)[1]
             filename = filedialog.asksaveasfilename(
-                defaultextension=".wav",
-                filetypes=[("WAV files", "*.wav"), ("All files", "*.*")],
+                defaultextension=extension,
+                filetypes=[(f"{extension[1:].upper()} files", f"*{extension}"), ("All files", "*.*")],
                 title="Save Generated Music"
             )
             if filename:
@@ -607,8 +1198,27 @@ class MusicGenGUI:
                 except Exception as e:
                     self.log_message(f"❌ Error saving file: {str(e)}")
                     messagebox.showerror("Save Error", str(e))
+        elif self.audio_buffer(self.current_job_id) is not None:
+            # Only in memory: encode in the format of the chosen extension on the audio writer
+            waveform, sample_rate = self.audio_buffer(self.current_job_id)
+            filename = filedialog.asksaveasfilename(
+                defaultextension=".wav",
+                filetypes=[("WAV files", "*.wav"), ("FLAC files", "*.flac"), ("Opus files", "*.opus"),
+                           ("All files", "*.*")],
+                title="Save Generated Music"
+            )
+            if filename:
+                future = self.audio_writer.submit(filename, waveform, sample_rate)
+                future.add_done_callback(lambda f: self.root.after(0, self.on_audio_saved, filename, f))
         else:
             messagebox.showwarning("Warning", "No audio file to save!")
+    
+    def on_audio_saved(self, filename, future):
+        if future.exception() is not None:
+            self.log_message(f"❌ Error saving file: {str(future.exception())}")
+            messagebox.showerror("Save Error", str(future.exception()))
+        else:
+            self.log_message(f"💾 Audio saved as: {filename}")
 
 def main():
     root = tk.Tk()
@@ -617,16 +1227,17 @@ def main():
     # Handle window closing
     def on_closing():
         try:
-            pygame.mixer.quit()
+            if app.job_queue is not None:
+                app.job_queue.stop()
+                app.generation_cache.flush()
+                app.audio_writer.close()
+            if pygame is not None:
+                pygame.mixer.quit()
             # Clean up models
-            if app.current_model is not None:
-                del app.current_model
-            if app.base_model is not None:
-                del app.base_model
-            if app.finetuned_model is not None:
-                del app.finetuned_model
+            app.current_model = None
+            app.registry = None
             gc.collect()
-            if torch.cuda.is_available():
+            if torch is not None and torch.cuda.is_available():
                 torch.cuda.empty_cache()
         except:
             pass
@@ -0,0 +1,72 @@
+import functools
+import math
+
+import torch
+import torch.nn.functional as F
+import torchaudio
+
+
+@functools.lru_cache(maxsize=32)
+def _resampler(orig_freq, new_freq, device):
+    # kernel ของ sinc interpolation คำนวณครั้งเดียวต่อคู่ rate (และ device) แล้วใช้ซ้ำทุก chunk/ทุกงาน
+    return torchaudio.transforms.Resample(orig_freq, new_freq).to(device)
+
+
+def resample(waveform, orig_freq, new_freq):
+    if orig_freq == new_freq:
+        return waveform
+    return _resampler(int(orig_freq), int(new_freq), str(waveform.device))(waveform)
+
+
+class StreamResampler:
+    # resample เสียงที่มาทีละ chunk ให้ได้ผลเหมือน resample ทั้งเพลงครั้งเดียว: เก็บ input ท้าย chunk ไว้เป็น context
+    # ของ kernel รอบถัดไป แทนที่จะ pad ศูนย์ที่ขอบทุก chunk (ซึ่งทำให้เสียงเบาลง/มี click ตรงรอยต่อ และความยาวเพี้ยน)
+    # output จึงช้ากว่า input ราวครึ่ง kernel (ไม่กี่ ms) และต้องเรียก flush() ตอนจบเพื่อเอาส่วนท้ายออกมา
+    def __init__(self, orig_freq, new_freq):
+        self.orig_freq = int(orig_freq)
+        self.new_freq = int(new_freq)
+        self.buffer = None
+        self.consumed = 0
+        self.emitted = 0
+
+    def _setup(self, waveform):
+        transform = _resampler(self.orig_freq, self.new_freq, str(waveform.device))
+        self.kernel = transform.kernel.to(waveform.dtype)
+        self.width = transform.width
+        self.stride = self.orig_freq // transform.gcd
+        # padding ทางซ้ายแบบเดียวกับ torchaudio.functional.resample
+        self.buffer = waveform.new_zeros(waveform.shape[:-1] + (self.width,))
+
+    def _run(self):
+        size = self.kernel.shape[-1]
+        available = self.buffer.shape[-1]
+        if available < size:
+            return self.buffer[..., :0]
+        blocks = (available - size) // self.stride + 1
+        used = (blocks - 1) * self.stride + size
+        shape = self.buffer.shape[:-1]
+        out = F.conv1d(self.buffer[..., :used].reshape(-1, 1, used), self.kernel, stride=self.stride)
+        self.buffer = self.buffer[..., blocks * self.stride:]
+        return out.transpose(1, 2).reshape(*shape, -1)
+
+    def __call__(self, waveform):
+        if self.orig_freq == self.new_freq:
+            return waveform
+        if self.buffer is None:
+            self._setup(waveform)
+        self.consumed += waveform.shape[-1]
+        self.buffer = torch.cat([self.buffer, waveform.to(self.buffer.dtype)], dim=-1)
+        out = self._run()
+        self.emitted += out.shape[-1]
+        return out
+
+    def flush(self):
+        if self.buffer is None:
+            return None
+        self.buffer = F.pad(self.buffer, (0, self.width + self.stride))
+        out = self._run()
+        target = math.ceil(self.new_freq * self.consumed / self.orig_freq)
+        out = out[..., :max(0, target - self.emitted)]
+        self.buffer = None
+        self.consumed = self.emitted = 0
+        return out
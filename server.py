@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import torch
+
+from audio_writer import wav_bytes
+from checkpoint_format import load_weights
+from condition_cache import InferenceConditionCache
+from generation import generate_batch, sampling_params
+from longform import generate_long
+
+# request ที่ยาวกว่า window ของโมเดล (model.max_duration) สร้างต่อกันทีละ window ด้วย generate_long
+MAX_DURATION = 600
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+
+def load_model(name, weights=None, device=None):
+    from audiocraft.models import MusicGen
+    # name="debug" ให้โมเดลจิ๋วของ audiocraft ที่ไม่ต้องโหลดอะไรจาก network ใช้ทดสอบ server บนเครื่อง
+    model = MusicGen.get_pretrained(name, device=device or ('cpu' if name == 'debug' else None))
+    if weights:
+        model.lm.load_state_dict(load_weights(weights))
+    model.lm.eval()
+    # prompt ที่ client ส่งซ้ำไม่ต้องผ่าน T5 ใหม่
+    InferenceConditionCache().install(model.lm.condition_provider)
+    return model
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, description, duration, seed=None, params=None):
+        self.id = str(next(self._ids))
+        self.description = description
+        self.duration = duration
+        self.seed = seed
+        self.params = params or {}
+        self.status = "queued"
+        self.error = None
+        self.audio = None
+        self.created = time.time()
+        self.done = asyncio.get_running_loop().create_future()
+
+    @property
+    def batch_key(self):
+        return (self.duration, self.seed, tuple(sorted(self.params.items())))
+
+    def to_dict(self):
+        return {"id": self.id, "status": self.status, "description": self.description,
+                "duration": self.duration, "seed": self.seed, "error": self.error}
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = 0
+        self.batches = 0
+        self.batched_jobs = 0
+        self.failed_jobs = 0
+        self.audio_seconds = 0.0
+        self.generation_seconds = 0.0
+
+    def render(self, queue_depth):
+        lines = [
+            ("musicgen_requests_total", self.requests),
+            ("musicgen_batches_total", self.batches),
+            ("musicgen_batched_jobs_total", self.batched_jobs),
+            ("musicgen_failed_jobs_total", self.failed_jobs),
+            ("musicgen_audio_seconds_total", self.audio_seconds),
+            ("musicgen_generation_seconds_total", self.generation_seconds),
+            ("musicgen_queue_depth", queue_depth),
+        ]
+        return "".join(f"{name} {value}\n" for name, value in lines)
+
+
+class GenerationService:
+    # รวม request ที่เข้ามาในช่วง window สั้นๆ เป็น generate call เดียว ต่อ duration/seed/params เดียวกัน
+    def __init__(self, model, window=0.05, max_batch=8, max_jobs=1000, max_duration=MAX_DURATION):
+        self.model = model
+        self.max_duration = max_duration
+        self.window = window
+        self.max_batch = max_batch
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.metrics = Metrics()
+        self._queue = asyncio.Queue()
+        # โมเดลไม่ thread-safe จึงใช้ executor thread เดียว
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="musicgen")
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    def submit(self, description, duration, seed=None, params=None):
+        job = Job(description, duration, seed, params)
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.max_jobs:
+            oldest = next(iter(self.jobs))
+            if not self.jobs[oldest].done.done():
+                break
+            del self.jobs[oldest]
+        self.metrics.requests += 1
+        self._queue.put_nowait(job)
+        return job
+
+    async def _collect(self):
+        first = await self._queue.get()
+        pending = [first]
+        deadline = asyncio.get_running_loop().time() + self.window
+        while True:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        groups = {}
+        for job in pending:
+            groups.setdefault(job.batch_key, []).append(job)
+        return [group[i:i + self.max_batch] for group in groups.values()
+                for i in range(0, len(group), self.max_batch)]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for batch in await self._collect():
+                # ข้อผิดพลาดใดๆ (รวมถึงตอนแปลงเป็น wav) ทำให้ batch นั้น failed แต่ consumer ยังทำงานต่อ
+                # และ future ของทุกงานต้องได้ผลเสมอ ไม่เช่นนั้น request ที่รอ (wait=true) จะค้าง
+                try:
+                    await self._process(loop, batch)
+                except Exception as e:
+                    self.metrics.failed_jobs += sum(not job.done.done() for job in batch)
+                    for job in batch:
+                        if not job.done.done():
+                            job.audio = None
+                            job.status = "failed"
+                            job.error = str(e) or type(e).__name__
+                            job.done.set_result(None)
+
+    async def _process(self, loop, batch):
+        for job in batch:
+            job.status = "generating"
+        first = batch[0]
+        start = time.perf_counter()
+        waveforms = await loop.run_in_executor(self._executor, self._generate, batch)
+        results = [wav_bytes(waveform, self.model.sample_rate) for waveform in waveforms]
+        if len(results) != len(batch):
+            raise RuntimeError(f"generated {len(results)} waveforms for {len(batch)} jobs")
+        self.metrics.batches += 1
+        self.metrics.batched_jobs += len(batch)
+        self.metrics.generation_seconds += time.perf_counter() - start
+        self.metrics.audio_seconds += first.duration * len(batch)
+        for job, audio in zip(batch, results):
+            job.audio = audio
+            job.status = "done"
+            job.done.set_result(audio)
+
+    def _generate(self, batch):
+        first = batch[0]
+        if first.duration <= self.model.max_duration:
+            return generate_batch(self.model, [job.description for job in batch], first.duration,
+                                  first.seed, **first.params).cpu()
+        # เพลงยาวสร้างทีละงาน ทีละ window
+        waveforms = []
+        for job in batch:
+            parts = []
+            generate_long(self.model, [job.description], job.duration, parts.append, seed=job.seed, **job.params)
+            waveforms.append(torch.cat(parts, dim=-1)[0].cpu())
+        return waveforms
+
+
+PARAM_TYPES = {'use_sampling': bool, 'top_k': int, 'top_p': float, 'temperature': float, 'cfg_coef': float}
+
+
+def parse_generate_request(body, max_duration=MAX_DURATION):
+    # ทุกข้อผิดพลาดของ input ต้องออกมาเป็น ValueError เพื่อให้ตอบ 400 ไม่ใช่ทำ connection หลุด
+    try:
+        request = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid JSON: {e}") from None
+    if not isinstance(request, dict):
+        raise ValueError("request body must be a JSON object")
+    description = request.get("description") or request.get("prompt")
+    if not description or not isinstance(description, str):
+        raise ValueError("'description' is required and must be a string")
+    try:
+        duration = float(request.get("duration", 10))
+    except (TypeError, ValueError):
+        raise ValueError("'duration' must be a number") from None
+    if not 0 < duration <= max_duration:
+        raise ValueError(f"'duration' must be in (0, {max_duration:g}]")
+    seed = request.get("seed")
+    try:
+        seed = int(seed) if seed is not None else None
+        params = {name: PARAM_TYPES[name](value) for name, value in sampling_params(request).items()}
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("'seed' and sampling parameters must be numbers") from None
+    return {
+        "description": description,
+        "duration": duration,
+        "seed": seed,
+        "params": params,
+        "wait": request.get("wait", True),
+    }
+
+
+class HttpServer:
+    def __init__(self, service):
+        self.service = service
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            status, content_type, payload = await self.route(method, urlsplit(target).path, body)
+        except Exception as e:
+            status, content_type, payload = 500, "application/json", json.dumps({"error": str(e)}).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1') + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def _json(self, status, data):
+        return status, "application/json", json.dumps(data).encode()
+
+    async def route(self, method, path, body):
+        service = self.service
+        if path == "/health":
+            return self._json(200, {"status": "ok", "model": service.model.name,
+                                    "sample_rate": service.model.sample_rate,
+                                    "max_duration": service.max_duration,
+                                    "window_duration": service.model.max_duration})
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4", service.metrics.render(service._queue.qsize()).encode()
+        if path == "/generate":
+            if method != "POST":
+                return self._json(405, {"error": "use POST"})
+            try:
+                request = parse_generate_request(body, service.max_duration)
+            except ValueError as e:
+                return self._json(400, {"error": str(e)})
+            job = service.submit(request["description"], request["duration"], request["seed"], request["params"])
+            if not request["wait"]:
+                return self._json(202, {"job_id": job.id, "status": job.status})
+            await job.done
+            if job.status != "done":
+                return self._json(500, job.to_dict())
+            return 200, "audio/wav", job.audio
+        if path in ("/jobs", "/jobs/"):
+            return self._json(200, {"jobs": [job.to_dict() for job in service.jobs.values()]})
+        if path.startswith("/jobs/"):
+            job_id, _, suffix = path[len("/jobs/"):].partition("/")
+            job = service.jobs.get(job_id)
+            if job is None:
+                return self._json(404, {"error": f"unknown job {job_id}"})
+            if suffix == "audio":
+                if job.status != "done":
+                    return self._json(409, job.to_dict())
+                return 200, "audio/wav", job.audio
+            return self._json(200, job.to_dict())
+        return self._json(404, {"error": f"no route for {path}"})
+
+
+async def serve(model, host, port, window, max_batch, max_duration=MAX_DURATION):
+    service = GenerationService(model, window=window, max_batch=max_batch, max_duration=max_duration)
+    service.start()
+    http = HttpServer(service)
+    server = await asyncio.start_server(http.handle, host, port)
+    print(f"✅ MusicGen server on http://{host}:{port} (model: {model.name})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless MusicGen inference server")
+    parser.add_argument("--model", default="facebook/musicgen-medium",
+                        help="pretrained name, or 'debug' for a tiny offline stand-in model")
+    parser.add_argument("--weights", default=None, help="fine-tuned LM weights (.pt or .safetensors)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--window", type=float, default=0.05,
+                        help="seconds to wait for more requests before starting a batch")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-duration", type=float, default=MAX_DURATION,
+                        help="longest request accepted; beyond the model window it is generated window by window")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model = load_model(args.model, args.weights)
+    asyncio.run(serve(model, args.host, args.port, args.window, args.max_batch, args.max_duration))
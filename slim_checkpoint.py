@@ -0,0 +1,82 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from lightning.pytorch.plugins import CheckpointIO
+
+
+def snapshot(obj, dtype=None):
+    # copy tensor ทั้งหมดมาไว้บน CPU ทันที ให้ training แก้ค่าใน GPU ต่อได้ระหว่างที่เขียนไฟล์
+    # dtype (เช่น fp16) ใช้กับ tensor fp32 ที่ไม่ใช่ scalar เท่านั้น
+    if isinstance(obj, torch.Tensor):
+        tensor = obj.detach()
+        if dtype is not None and tensor.dtype == torch.float32 and tensor.dim() > 0:
+            return tensor.to('cpu', dtype, copy=True)
+        return tensor.to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot(value, dtype) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value, dtype) for value in obj)
+    return obj
+
+
+class SlimCheckpointIO(CheckpointIO):
+    # เขียน checkpoint ใน thread เดียวเบื้องหลังตามลำดับ (save/remove ไม่สลับกัน) training จึงรอแค่การ copy ลง CPU
+    # ไฟล์เขียนเป็น .tmp แล้ว rename จึงไม่มี checkpoint ครึ่งไฟล์ถ้า process ตายกลางทาง
+    def __init__(self, dtype=None):
+        super().__init__()
+        self.dtype = dtype
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def save_checkpoint(self, checkpoint, path, storage_options=None):
+        self._raise_failed()
+        # ลดความละเอียดเฉพาะ weights ของโมเดล; state ของ optimizer คง fp32 เพราะ exp_avg_sq ของ Adam
+        # ที่เล็กกว่า ~6e-8 จะกลายเป็น 0 ใน fp16 แล้วหลัง resume ตัวหารเหลือแค่ eps ทำให้ step ใหญ่ผิดปกติ
+        state = {key: snapshot(value, self.dtype if key == 'state_dict' else None)
+                 for key, value in checkpoint.items()}
+        self._submit(self._write, state, str(path))
+
+    def load_checkpoint(self, path, map_location=None):
+        self.wait()
+        return torch.load(path, map_location=map_location or 'cpu', weights_only=False)
+
+    def remove_checkpoint(self, path):
+        self._submit(self._remove, str(path))
+
+    def teardown(self):
+        self.wait()
+
+    def wait(self):
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            self._futures.append(self._executor.submit(fn, *args))
+
+    def _raise_failed(self):
+        # แจ้ง error ของการเขียนครั้งก่อนๆ (เช่น disk เต็ม) ที่ save ครั้งถัดไป แทนที่จะเงียบไป
+        with self._lock:
+            done = [future for future in self._futures if future.done()]
+            self._futures = [future for future in self._futures if not future.done()]
+        for future in done:
+            future.result()
+
+    @staticmethod
+    def _write(state, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
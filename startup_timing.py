@@ -0,0 +1,35 @@
+import json
+import os
+import platform
+import sys
+import time
+
+
+class StartupTimer:
+    # บันทึกเวลาของแต่ละช่วงตอนเปิดโปรแกรม นับจาก start (วินาที) แต่ละช่วงบันทึกได้ครั้งเดียว
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.phases = {}
+
+    def mark(self, name):
+        if name not in self.phases:
+            self.phases[name] = time.perf_counter() - self.start
+        return self.phases[name]
+
+    def summary(self):
+        return " | ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+
+    def report(self):
+        return {
+            'recorded_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'frozen': getattr(sys, 'frozen', False),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+        }
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp_path, path)
@@ -0,0 +1,120 @@
+import queue
+import threading
+
+import torch
+
+# ตัด chunk ห่างจากปลายที่ generate ถึงไว้เล็กน้อย เพราะ decoder ของ EnCodec มองเห็น frame ถัดไปด้วย
+LOOKAHEAD_FRAMES = 5
+
+
+class TokenStream:
+    # LM ของ MusicGen สร้าง token ตาม codebook pattern (delay) ไม่ใช่ทีละ frame
+    # คลาสนี้นำ token ของแต่ละ step ไปวางกลับตำแหน่งเวลา [B, K, T] และบอกว่ามีกี่ frame ที่ครบทุก codebook แล้ว
+    def __init__(self, lm, batch_size, num_frames, device):
+        self.pattern = lm.pattern_provider.get_pattern(num_frames)
+        self.step = self.pattern.get_first_step_with_timesteps(0)
+        self.num_frames = num_frames
+        self.codes = torch.zeros(batch_size, lm.num_codebooks, num_frames, dtype=torch.long, device=device)
+        self.filled = [0] * lm.num_codebooks
+
+    def push(self, next_token):
+        for coord in self.pattern.layout[self.step]:
+            if coord.t < self.num_frames:
+                self.codes[:, coord.q, coord.t] = next_token[:, coord.q, 0]
+                self.filled[coord.q] = coord.t + 1
+        self.step += 1
+
+    @property
+    def complete(self):
+        return min(self.filled)
+
+
+class IncrementalDecoder:
+    # decode เฉพาะ frame ใหม่ พร้อม frame ก่อนหน้าเป็น context แล้วตัดเสียงของ context ทิ้ง
+    def __init__(self, compression_model, context_frames, lookahead_frames=LOOKAHEAD_FRAMES):
+        self.compression_model = compression_model
+        self.context_frames = context_frames
+        self.lookahead_frames = lookahead_frames
+        self.hop = int(compression_model.sample_rate // compression_model.frame_rate)
+        self.emitted = 0
+
+    def decode(self, codes, available, final=False):
+        end = available if final else available - self.lookahead_frames
+        if end <= self.emitted:
+            return None
+        start = max(0, self.emitted - self.context_frames)
+        with torch.no_grad():
+            audio = self.compression_model.decode(codes[..., start:available], None)
+        chunk = audio[..., (self.emitted - start) * self.hop:(end - start) * self.hop]
+        self.emitted = end
+        return chunk
+
+
+def generate_streaming(model, descriptions, duration, on_chunk, chunk_seconds=2.0, context_seconds=1.0,
+                       seed=None, on_progress=None, return_tokens=False, **params):
+    # on_chunk([B, C, N]) ถูกเรียกทันทีที่เสียงช่วงใหม่ decode เสร็จ, on_progress(0..1) ทุก step ของ LM
+    # return_tokens=True คืน (เสียง, codes [B, K, T]) เหมือน generate_batch
+    if duration > model.max_duration:
+        raise ValueError(f"streaming supports up to {model.max_duration}s per generation")
+    model.set_generation_params(duration=duration, **params)
+    if seed is not None:
+        torch.manual_seed(seed)
+
+    lm = model.lm
+    frame_rate = model.frame_rate
+    num_frames = int(duration * frame_rate)
+    stream = TokenStream(lm, len(descriptions), num_frames, model.device)
+    decoder = IncrementalDecoder(model.compression_model, int(context_seconds * frame_rate))
+    chunk_frames = max(1, int(chunk_seconds * frame_rate))
+    chunks = []
+
+    def emit(final=False):
+        chunk = decoder.decode(stream.codes, stream.complete, final)
+        if chunk is not None:
+            chunks.append(chunk.cpu())
+            on_chunk(chunks[-1])
+
+    sample_next_token = lm._sample_next_token
+
+    def sample_and_emit(*args, **kwargs):
+        next_token = sample_next_token(*args, **kwargs)
+        stream.push(next_token)
+        if stream.complete - decoder.emitted >= chunk_frames + decoder.lookahead_frames:
+            emit()
+        if on_progress is not None:
+            on_progress(stream.complete / num_frames)
+        return next_token
+
+    # ครอบ _sample_next_token ของ instance นี้ชั่วคราว ผู้เรียกต้องถือ lock ของโมเดลไว้
+    lm._sample_next_token = sample_and_emit
+    try:
+        attributes, _ = model._prepare_tokens_and_attributes(list(descriptions), None)
+        model._generate_tokens(attributes, None)
+        emit(final=True)
+    finally:
+        del lm._sample_next_token
+    audio = torch.cat(chunks, dim=-1)
+    return (audio, stream.codes) if return_tokens else audio
+
+
+def iter_streaming(model, descriptions, duration, **kwargs):
+    # แบบ generator: generate ใน thread แยก แล้ว yield chunk ออกมาตามลำดับ
+    chunks = queue.Queue()
+    finished = object()
+
+    def run():
+        try:
+            generate_streaming(model, descriptions, duration, chunks.put, **kwargs)
+        except BaseException as e:
+            chunks.put(e)
+        else:
+            chunks.put(finished)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        item = chunks.get()
+        if item is finished:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# โมดูลของ repo เป็นไฟล์เดี่ยวที่ root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+
+from checkpoint_format import TORCH_DTYPES, checksum, load_weights, read_header, save_weights
+
+
+def _state_dict():
+    generator = torch.Generator().manual_seed(0)
+    return {
+        'emb.weight': torch.randn(5, 3, generator=generator),
+        'linear.bias': torch.randn(7, generator=generator).to(torch.bfloat16),
+        'half': torch.randn(2, 2, generator=generator).half(),
+        'steps': torch.arange(4, dtype=torch.int64),
+        'flags': torch.tensor([True, False, True]),
+        'scalar': torch.tensor(1.5),
+        'transposed': torch.randn(3, 4, generator=generator).t(),
+    }
+
+
+def test_round_trip_keeps_values_and_dtypes(tmp_path):
+    state_dict = _state_dict()
+    path = tmp_path / "lm.safetensors"
+    save_weights(state_dict, path)
+    loaded = load_weights(str(path))
+    assert loaded.keys() == state_dict.keys()
+    for name, tensor in state_dict.items():
+        assert loaded[name].dtype == tensor.dtype, name
+        assert loaded[name].shape == tensor.shape, name
+        assert torch.equal(loaded[name], tensor), name
+
+
+def test_storage_dtype_casts_only_floating_point(tmp_path):
+    state_dict = _state_dict()
+    path = tmp_path / "lm.safetensors"
+    save_weights(state_dict, path, dtype=torch.float16)
+    loaded = load_weights(str(path))
+    assert loaded['emb.weight'].dtype == torch.float16
+    assert torch.equal(loaded['emb.weight'], state_dict['emb.weight'].half())
+    assert torch.equal(loaded['steps'], state_dict['steps'])
+    assert torch.equal(loaded['flags'], state_dict['flags'])
+
+
+def test_offsets_are_aligned_and_checksum_is_stable(tmp_path):
+    first, second = tmp_path / "a.safetensors", tmp_path / "b.safetensors"
+    digest = save_weights(_state_dict(), first, metadata={'source': 'a'})
+    save_weights(_state_dict(), second, metadata={'source': 'b'})
+    header, data_start = read_header(str(first))
+    assert data_start % 8 == 0
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        begin, _ = info['data_offsets']
+        assert begin % torch.empty(0, dtype=TORCH_DTYPES[info['dtype']]).element_size() == 0
+    assert checksum(str(first)) == digest == checksum(str(second))
+
+
+def test_pickled_state_dict_still_loads(tmp_path):
+    state_dict = _state_dict()
+    path = tmp_path / "lm.pt"
+    torch.save(state_dict, path)
+    loaded = load_weights(str(path))
+    assert all(torch.equal(loaded[name], tensor) for name, tensor in state_dict.items())
@@ -0,0 +1,148 @@
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from torch import nn
+
+from condition_cache import InferenceConditionCache, TrainingConditionCache
+
+VOCAB = ["<pad>", "</s>", "thai", "song", "with", "saw", "u", "slow", "piano", "drums"]
+
+
+class Tokenizer:
+    pad_token_id = 0
+
+    def __call__(self, texts, return_tensors='pt', padding=True):
+        ids = [[VOCAB.index(word) for word in text.split()] + [1] for text in texts]
+        length = max(len(row) for row in ids)
+        return {
+            'input_ids': torch.tensor([row + [0] * (length - len(row)) for row in ids]),
+            'attention_mask': torch.tensor([[1] * len(row) + [0] * (length - len(row)) for row in ids]),
+        }
+
+
+class Encoder(nn.Module):
+    # เหมือน T5 ตรงที่ผลของ token จริงไม่ขึ้นกับ padding ของ batch
+    def __init__(self, dim):
+        super().__init__()
+        self.embedding = nn.Embedding(len(VOCAB), dim)
+
+    def forward(self, input_ids, attention_mask):
+        hidden = (self.embedding(input_ids) * attention_mask.unsqueeze(-1)).cumsum(dim=1).tanh()
+        return SimpleNamespace(last_hidden_state=hidden)
+
+
+class FakeT5Conditioner(nn.Module):
+    # ทำตาม tokenize/forward ของ audiocraft T5Conditioner โดยไม่ต้องโหลด T5 จริง
+    def __init__(self, dim=6, output_dim=4, word_dropout=0.0):
+        super().__init__()
+        self.name = "fake-t5"
+        self.word_dropout = word_dropout
+        self.autocast = contextlib.nullcontext()
+        self.t5_tokenizer = Tokenizer()
+        self.__dict__['t5'] = Encoder(dim).eval()
+        self.output_proj = nn.Linear(dim, output_dim)
+
+    def tokenize(self, texts):
+        entries = [text if text is not None else "" for text in texts]
+        inputs = self.t5_tokenizer(entries)
+        empty = torch.tensor([i for i, text in enumerate(entries) if text == ""], dtype=torch.long)
+        inputs['attention_mask'][empty, :] = 0
+        return inputs
+
+    def forward(self, inputs):
+        mask = inputs['attention_mask']
+        with torch.no_grad(), self.autocast:
+            embeds = self.t5(**inputs).last_hidden_state
+        embeds = self.output_proj(embeds.to(self.output_proj.weight))
+        return embeds * mask.unsqueeze(-1), mask
+
+
+def _provider(**kwargs):
+    torch.manual_seed(0)
+    return SimpleNamespace(conditioners=nn.ModuleDict({'description': FakeT5Conditioner(**kwargs)}))
+
+
+def _reference(conditioner, texts):
+    return conditioner(conditioner.tokenize(texts))
+
+
+def test_training_cache_matches_conditioner(tmp_path):
+    provider = _provider()
+    conditioner = provider.conditioners['description']
+    texts = ["thai song with saw u", "slow piano", None, "slow piano"]
+    expected, expected_mask = _reference(conditioner, texts)
+
+    cache = TrainingConditionCache(provider)
+    assert cache.build(texts) == 3
+    cache.release_text_encoder()
+    assert 't5' not in conditioner.__dict__
+    embeds, mask = cache.condition_tensors(texts, 'cpu')['description']
+    assert torch.equal(mask, expected_mask)
+    assert torch.allclose(embeds, expected, atol=1e-6)
+
+    path = str(tmp_path / "conditions.pt")
+    cache.save(path)
+    restored = TrainingConditionCache(_provider())
+    assert restored.load(path)
+    assert restored.build(texts) == 0
+
+
+def test_training_cache_keeps_output_proj_trainable():
+    provider = _provider()
+    cache = TrainingConditionCache(provider)
+    cache.build(["slow piano"])
+    embeds, _ = cache.condition_tensors(["slow piano", None], 'cpu')['description']
+    embeds.sum().backward()
+    assert provider.conditioners['description'].output_proj.weight.grad is not None
+
+
+def test_training_cache_refuses_word_dropout():
+    with pytest.raises(ValueError, match="word_dropout"):
+        TrainingConditionCache(_provider(word_dropout=0.3))
+    TrainingConditionCache(_provider(word_dropout=0.3), allow_word_dropout=True)
+
+
+def test_inference_cache_matches_conditioner_across_batches():
+    provider = _provider()
+    conditioner = provider.conditioners['description']
+    texts = ["thai song with saw u", "slow piano", None]
+    expected, expected_mask = _reference(conditioner, texts)
+
+    cache = InferenceConditionCache()
+    assert cache.install(provider)
+    assert not cache.install(provider)
+    embeds, mask = conditioner(conditioner.tokenize(texts))
+    assert torch.equal(mask, expected_mask)
+    assert torch.allclose(embeds, expected, atol=1e-6)
+
+    alone, _ = conditioner(conditioner.tokenize(["slow piano"]))
+    assert torch.allclose(alone[0], expected[1, :alone.shape[1]], atol=1e-6)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 3
+
+
+def test_inference_cache_evicts_least_recently_used():
+    provider = _provider()
+    conditioner = provider.conditioners['description']
+    expected, _ = _reference(conditioner, ["slow piano"])
+    cache = InferenceConditionCache(max_bytes=1)
+    cache.install(provider)
+    conditioner(conditioner.tokenize(["slow piano"]))
+    conditioner(conditioner.tokenize(["drums"]))
+    assert cache.stats()['entries'] == 1
+    embeds, _ = conditioner(conditioner.tokenize(["slow piano"]))
+    assert cache.stats()['misses'] == 3
+    assert torch.allclose(embeds, expected, atol=1e-6)
+
+
+def test_inference_cache_warm_encodes_each_prompt_once():
+    provider = _provider()
+    cache = InferenceConditionCache()
+    assert cache.warm(provider, ["slow piano"]) == 0
+    cache.install(provider)
+    assert cache.warm(provider, ["slow piano", "drums", "slow piano"]) == 3
+    assert cache.warm(provider, ["slow piano", "drums"]) == 0
@@ -0,0 +1,63 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+scipy_linalg = pytest.importorskip("scipy.linalg")
+pytest.importorskip("torchaudio")
+
+from evaluate import FeatureExtractor, embedding_gaussian, frechet_distance, gaussian
+
+
+def _reference_frechet(mu1, cov1, mu2, cov2):
+    # สูตรเดียวกับ FID: scipy sqrtm ของ cov1 @ cov2
+    covmean = scipy_linalg.sqrtm(cov1 @ cov2).real
+    diff = mu1 - mu2
+    return diff @ diff + np.trace(cov1) + np.trace(cov2) - 2 * np.trace(covmean)
+
+
+def _random_gaussian(rng, dim, samples):
+    data = rng.standard_normal((samples, dim)) @ rng.standard_normal((dim, dim))
+    return data.mean(axis=0), np.cov(data, rowvar=False)
+
+
+def test_frechet_distance_matches_reference():
+    rng = np.random.default_rng(0)
+    samples = [(*_random_gaussian(rng, 8, 200), *_random_gaussian(rng, 8, 200)) for _ in range(3)]
+    expected = [_reference_frechet(*sample) for sample in samples]
+    distances = frechet_distance(*[torch.from_numpy(np.stack(values)) for values in zip(*samples)])
+    assert np.allclose(distances.numpy(), expected, rtol=1e-6, atol=1e-8)
+
+
+def test_frechet_distance_of_identical_gaussians_is_zero():
+    mu, cov = _random_gaussian(np.random.default_rng(1), 6, 100)
+    mu, cov = torch.from_numpy(mu), torch.from_numpy(cov)
+    assert abs(frechet_distance(mu, cov, mu, cov).item()) < 1e-8
+
+
+def test_gaussian_from_sufficient_statistics_matches_numpy():
+    # ค่าเฉลี่ยใหญ่เทียบกับความแปรปรวน เหมือน log-mel ของคลิปเบาๆ
+    rng = np.random.default_rng(2)
+    data = -12 + 0.01 * rng.standard_normal((5000, 4))
+    x = torch.from_numpy(data)
+    mean, cov = gaussian(torch.tensor(float(len(data)), dtype=torch.float64), x.sum(dim=0), x.T @ x)
+    assert np.allclose(mean.numpy(), data.mean(axis=0))
+    assert np.allclose(cov.numpy(), np.cov(data, rowvar=False), rtol=1e-5, atol=1e-12)
+
+    _, cov = embedding_gaussian(x)
+    assert np.allclose(cov.numpy(), np.cov(data, rowvar=False))
+
+
+def test_extractor_statistics_give_nonnegative_variance():
+    generator = torch.Generator().manual_seed(3)
+    waveforms = [1e-3 * torch.randn(16000 * 20, generator=generator),
+                 0.3 * torch.randn(16000 * 3, generator=generator)]
+    features = FeatureExtractor()(waveforms)
+    assert features['mel_outer'].dtype == torch.float64
+    mean, cov = gaussian(features['count'], features['mel_sum'], features['mel_outer'])
+    variance = cov.diagonal(dim1=-2, dim2=-1)
+    assert torch.all(variance >= 0)
+    # std แบบ centered ของ extractor ต้องตรงกับ covariance ที่ได้จาก sufficient statistics
+    n_mels = mean.shape[-1]
+    count = features['count'][:, None]
+    centered = features['embedding'][:, n_mels:].pow(2) * count / (count - 1)
+    assert torch.allclose(variance, centered, rtol=1e-6, atol=1e-9)
@@ -0,0 +1,28 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("audiocraft")
+
+from cpu_inference import load_cpu_model
+from generation import generate_batch
+
+
+@pytest.fixture(scope="module")
+def model():
+    return load_cpu_model("debug", quantize=False)
+
+
+def test_seeded_prompt_does_not_depend_on_batch_order(model):
+    # prompt จำนวน token เท่ากัน conditioning จึงถูก pad ยาวเท่ากันทั้งสองแบบ
+    prompts = ["rock song", "calm piano"]
+    _, tokens = generate_batch(model, prompts, 1, seed=3, return_tokens=True)
+    _, swapped = generate_batch(model, prompts[::-1], 1, seed=3, return_tokens=True)
+    assert torch.equal(tokens, swapped.flip(0))
+
+
+def test_seed_changes_the_sample(model):
+    _, first = generate_batch(model, ["rock song"], 1, seed=3, return_tokens=True)
+    _, again = generate_batch(model, ["rock song"], 1, seed=3, return_tokens=True)
+    _, other = generate_batch(model, ["rock song"], 1, seed=4, return_tokens=True)
+    assert torch.equal(first, again)
+    assert not torch.equal(first, other)
@@ -0,0 +1,21 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+
+from longform import _crossfade
+
+
+def test_crossfade_of_identical_signals_is_unchanged():
+    torch.manual_seed(0)
+    signal = torch.randn(2, 1000)
+    assert torch.allclose(_crossfade(signal, signal.clone()), signal, atol=1e-6)
+
+
+def test_crossfade_starts_on_tail_and_ends_on_head():
+    tail = torch.ones(1, 100)
+    head = torch.zeros(1, 100)
+    faded = _crossfade(tail, head)
+    assert faded[0, 0] == 1
+    assert faded[0, -1] == 0
+    assert torch.all(faded[0, 1:] <= faded[0, :-1])
@@ -0,0 +1,34 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+
+from resampling import StreamResampler, resample
+
+
+@pytest.mark.parametrize("orig_freq, new_freq", [(32000, 44100), (32000, 48000), (48000, 22050)])
+@pytest.mark.parametrize("chunk", [1, 317, 4096])
+def test_stream_matches_whole_resample(orig_freq, new_freq, chunk):
+    waveform = torch.randn(2, orig_freq // 10, generator=torch.Generator().manual_seed(0))
+    stream = StreamResampler(orig_freq, new_freq)
+    parts = [stream(waveform[..., i:i + chunk]) for i in range(0, waveform.shape[-1], chunk)]
+    parts.append(stream.flush())
+    streamed = torch.cat(parts, dim=-1)
+    expected = resample(waveform, orig_freq, new_freq)
+    assert streamed.shape == expected.shape
+    assert torch.allclose(streamed, expected, atol=1e-5)
+
+
+def test_stream_is_reusable_after_flush():
+    waveform = torch.randn(1, 8000, generator=torch.Generator().manual_seed(1))
+    stream = StreamResampler(32000, 44100)
+    first = torch.cat([stream(waveform), stream.flush()], dim=-1)
+    second = torch.cat([stream(waveform), stream.flush()], dim=-1)
+    assert torch.equal(first, second)
+
+
+def test_same_rate_passes_through():
+    waveform = torch.randn(1, 100)
+    stream = StreamResampler(32000, 32000)
+    assert stream(waveform) is waveform
+    assert stream.flush() is None
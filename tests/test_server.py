@@ -0,0 +1,153 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip("audiocraft")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.status, response.read()
+
+
+def _post(url, data):
+    request = urllib.request.Request(url, data=json.dumps(data).encode(), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status, json.loads(response.read())
+
+
+def _post_status(url, body):
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+@pytest.fixture(scope="module")
+def server():
+    port = _free_port()
+    process = subprocess.Popen([sys.executable, "server.py", "--model", "debug", "--port", str(port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while True:
+        if process.poll() is not None:
+            pytest.fail(f"server exited: {process.stderr.read().decode(errors='replace')}")
+        try:
+            _get(f"{base}/health")
+            break
+        except OSError:
+            if time.time() > deadline:
+                process.kill()
+                pytest.fail("server did not start")
+            time.sleep(0.5)
+    yield base
+    process.terminate()
+    process.wait(timeout=30)
+
+
+def test_health(server):
+    status, body = _get(f"{server}/health")
+    health = json.loads(body)
+    assert status == 200
+    assert health["status"] == "ok"
+    assert health["model"] == "debug"
+
+
+def test_jobs_and_metrics(server):
+    status, accepted = _post(f"{server}/generate", {"description": "test", "duration": 1, "seed": 0,
+                                                    "wait": False})
+    assert status == 202
+    job_id = accepted["job_id"]
+
+    _, body = _get(f"{server}/jobs")
+    assert job_id in [job["id"] for job in json.loads(body)["jobs"]]
+
+    deadline = time.time() + 120
+    while True:
+        _, body = _get(f"{server}/jobs/{job_id}")
+        job = json.loads(body)
+        if job["status"] in ("done", "failed") or time.time() > deadline:
+            break
+        time.sleep(0.2)
+    assert job["status"] == "done", job
+
+    status, audio = _get(f"{server}/jobs/{job_id}/audio")
+    assert status == 200
+    assert audio[:4] == b"RIFF"
+
+    status, body = _get(f"{server}/metrics")
+    metrics = dict(line.split(" ") for line in body.decode().splitlines())
+    assert status == 200
+    assert float(metrics["musicgen_requests_total"]) >= 1
+    assert float(metrics["musicgen_batched_jobs_total"]) >= 1
+
+
+@pytest.mark.parametrize("body", [
+    b"[]",
+    b'"x"',
+    b"not json",
+    b'{"duration": 1}',
+    b'{"description": 5}',
+    b'{"description": "test", "duration": null}',
+    b'{"description": "test", "duration": "long"}',
+    b'{"description": "test", "duration": 100000}',
+    b'{"description": "test", "seed": "abc"}',
+    b'{"description": "test", "seed": [1]}',
+    b'{"description": "test", "top_k": "many"}',
+])
+def test_generate_rejects_bad_input(server, body):
+    assert _post_status(f"{server}/generate", body) == 400
+    status, body = _get(f"{server}/health")
+    assert status == 200
+
+
+def test_failed_batch_keeps_consumer_running():
+    import asyncio
+
+    import torch
+
+    from server import GenerationService
+
+    class Model:
+        sample_rate = 32000
+        max_duration = 30
+
+    class Service(GenerationService):
+        def _generate(self, batch):
+            # None ทำให้การแปลงเป็น wav ล้มเหลวหลัง generate เสร็จ
+            return [None if job.description == "broken" else torch.zeros(1, 320) for job in batch]
+
+    async def run():
+        service = Service(Model(), window=0.01)
+        service.start()
+        broken = service.submit("broken", 1, seed=1)
+        await asyncio.wait_for(broken.done, 10)
+        ok = service.submit("ok", 1, seed=2)
+        await asyncio.wait_for(ok.done, 10)
+        await service.stop()
+        return broken, ok, service.metrics
+
+    broken, ok, metrics = asyncio.run(run())
+    assert broken.status == "failed"
+    assert ok.status == "done"
+    assert ok.audio[:4] == b"RIFF"
+    assert metrics.failed_jobs == 1
@@ -0,0 +1,40 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("lightning")
+
+from slim_checkpoint import SlimCheckpointIO, snapshot
+
+
+def test_snapshot_casts_only_non_scalar_fp32():
+    state = {'weight': torch.ones(3), 'step': torch.tensor(7.0), 'ids': torch.arange(3), 'name': 'x'}
+    copied = snapshot(state, torch.float16)
+    assert copied['weight'].dtype == torch.float16
+    assert copied['step'].dtype == torch.float32
+    assert copied['ids'].dtype == torch.int64
+    assert copied['name'] == 'x'
+
+
+def test_snapshot_copies_cpu_tensors():
+    weight = torch.zeros(4)
+    copied = snapshot({'weight': weight})
+    weight.add_(1)
+    assert torch.equal(copied['weight'], torch.zeros(4))
+
+
+def test_checkpoint_keeps_optimizer_state_fp32(tmp_path):
+    tiny = torch.full((4,), 1e-9)
+    checkpoint = {
+        'state_dict': {'lm.weight': torch.ones(4)},
+        'optimizer_states': [{'state': {0: {'exp_avg': tiny.clone(), 'exp_avg_sq': tiny.clone(),
+                                            'step': torch.tensor(3.0)}}}],
+    }
+    io = SlimCheckpointIO(dtype=torch.float16)
+    path = tmp_path / "last.ckpt"
+    io.save_checkpoint(checkpoint, path)
+    loaded = io.load_checkpoint(path)
+    io.teardown()
+    assert loaded['state_dict']['lm.weight'].dtype == torch.float16
+    moments = loaded['optimizer_states'][0]['state'][0]
+    assert moments['exp_avg_sq'].dtype == torch.float32
+    assert torch.equal(moments['exp_avg_sq'], tiny)
@@ -1,5 +1,7 @@
 import os
 import json
+import math
+import argparse
 import torch
 import torch.nn.functional as F
 from torch.utils.data import Dataset, DataLoader
@@ -7,25 +9,80 @@ import torchaudio
 import lightning as L
 from lightning.pytorch.callbacks import ModelCheckpoint
 from audiocraft.models import MusicGen
-from audiocraft.modules.conditioners import ClassifierFreeGuidanceDropout
+from audiocraft.models.loaders import load_compression_model, load_lm_model
+from audiocraft.modules.conditioners import ClassifierFreeGuidanceDropout, ConditioningAttributes
+
+import code_cache
+from checkpoint_format import STORAGE_DTYPES, save_weights
+import waveform_store
+from condition_cache import TrainingConditionCache
+from lora import inject_lora, save_adapter
+from slim_checkpoint import SlimCheckpointIO
+from ddp_training import ThroughputLogger, cpu_strategy, threads_per_process
+
+MODEL_NAME = "facebook/musicgen-medium"
 
 
 class DescriptiveAudioDataset(Dataset):
-    def __init__(self, metadata_path, audio_dir, segment_duration=30, sample_rate=22050):
+    def __init__(self, metadata_path, audio_dir, segment_duration=30, sample_rate=22050, code_cache_dir=None,
+                 waveform_store_dir=None, random_offset=True):
         self.segment_duration = segment_duration
         self.sample_rate = sample_rate
         self.audio_dir = audio_dir
+        self.metadata_path = metadata_path
 
         with open(metadata_path, 'r') as f:
             self.metadata = json.load(f)
+        # ความยาวของแต่ละคลิป (วินาที) จาก manifest ของ build_manifest.py สำหรับ sampler โดยไม่ต้องเปิดไฟล์
+        self.durations = [item.get('duration') for item in self.metadata]
+
+        # โหมด code cache: อ่าน EnCodec codes ที่ encode ไว้แล้วแทนการโหลดเสียง
+        self.codes = None
+        if code_cache_dir is not None:
+            self.codes = code_cache.CodeCache(code_cache_dir)
+            self._check_code_cache()
+
+        # โหมด waveform store: ตัดหน้าต่างจากไฟล์ mmap ที่ resample ไว้แล้ว สุ่มตำแหน่งได้ทั้งเพลง
+        self.waveforms = None
+        self.random_offset = random_offset
+        if waveform_store_dir is not None:
+            if not waveform_store.is_store_valid(waveform_store_dir, metadata_path, sample_rate):
+                raise ValueError(f"waveform store {waveform_store_dir} is missing or stale, "
+                                 "rebuild it with --rebuild-waveform-store")
+            self.waveforms = waveform_store.WaveformStore(waveform_store_dir)
+
+    def _check_code_cache(self):
+        settings = self.codes.settings
+        expected = {
+            'sample_rate': self.sample_rate,
+            'segment_duration': self.segment_duration,
+            'manifest': code_cache.file_digest(self.metadata_path),
+        }
+        stale = [k for k, v in expected.items() if settings.get(k) != v]
+        if stale or len(self.codes) != len(self.metadata):
+            raise ValueError(
+                f"code cache {self.codes.cache_dir} is stale ({', '.join(stale) or 'item count'} changed), "
+                "rebuild it with --rebuild-code-cache"
+            )
 
     def __len__(self):
         return len(self.metadata)
 
     def __getitem__(self, idx):
         item = self.metadata[idx]
+        if self.codes is not None:
+            codes = torch.from_numpy(self.codes[idx].astype('int64'))
+            return codes, item['description']
+        if self.waveforms is not None:
+            target_len = self.sample_rate * self.segment_duration
+            return self.waveforms.window(idx, target_len, self.random_offset), item['description']
         audio_path = os.path.join(self.audio_dir, item['audio'])
-        waveform, sr = torchaudio.load(audio_path)
+        if item.get('frames'):
+            # manifest จาก build_manifest.py บอก sample rate ไว้แล้ว: decode เฉพาะช่วงที่ใช้
+            num_frames = min(item['frames'], math.ceil(self.segment_duration * item['sample_rate']))
+            waveform, sr = torchaudio.load(audio_path, num_frames=num_frames)
+        else:
+            waveform, sr = torchaudio.load(audio_path)
         if sr != self.sample_rate:
             waveform = torchaudio.transforms.Resample(sr, self.sample_rate)(waveform)
         waveform = waveform.mean(dim=0, keepdim=True)  # Convert to mono
@@ -42,37 +99,112 @@ def custom_collate(batch):
     return torch.stack(waveforms), list(descriptions)
 
 
+class LMOnlyMusicGen:
+    # ใช้ตอนเทรนจาก code cache: มีแค่ LM ไม่ต้องโหลด compression model
+    def __init__(self, name, lm):
+        self.name = name
+        self.lm = lm
+        self.compression_model = None
+
+
+def load_musicgen_for_training(name=MODEL_NAME, with_compression_model=True, device=None):
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    if with_compression_model:
+        return MusicGen.get_pretrained(name, device=device)
+    return LMOnlyMusicGen(name, load_lm_model(name, device=device))
+
+
 class MusicGenFinetuning(L.LightningModule):
-    def __init__(self):
+    def __init__(self, model=None, use_code_cache=False, cfg_dropout=0.0, lora_rank=0, lora_alpha=16, lr=1e-5,
+                 model_name=MODEL_NAME, device=None):
         super().__init__()
-        self.model = MusicGen.get_pretrained("facebook/musicgen-medium")
+        if model is None:
+            model = load_musicgen_for_training(model_name, with_compression_model=not use_code_cache, device=device)
+        self.model = model
+        self.use_code_cache = use_code_cache
+        self.cfg_dropout = ClassifierFreeGuidanceDropout(p=cfg_dropout)
+        self.condition_cache = None
         self.model.lm.train()
         self.model.lm = self.model.lm.float()
+        self.lr = lr
+        self.lora_rank = lora_rank
+        if lora_rank:
+            # เทรนเฉพาะ adapter ขนาดเล็ก LM เดิมถูก freeze ทั้งหมด
+            inject_lora(self.model.lm, rank=lora_rank, alpha=lora_alpha)
+        # MusicGen ไม่ใช่ nn.Module: ลงทะเบียน LM เป็น submodule ให้ Lightning/DDP เห็น parameter
+        # (compression model และ T5 ยังอยู่นอก module จึงไม่ถูก sync หรือเก็บใน checkpoint)
+        self.lm = self.model.lm
+
+    def attach_condition_cache(self, descriptions, cache_path=None, allow_word_dropout=False):
+        # คำนวณ text condition ครั้งเดียวต่อ description แล้วปล่อย T5 ออกจากหน่วยความจำ
+        cache = TrainingConditionCache(self.model.lm.condition_provider, allow_word_dropout=allow_word_dropout)
+        if cache_path is not None:
+            cache.load(cache_path)
+        if cache.build(descriptions) and cache_path is not None:
+            cache.save(cache_path)
+        cache.release_text_encoder()
+        self.condition_cache = cache
+        return cache
 
     def training_step(self, batch):
-        waveforms, descriptions = batch
+        inputs, descriptions = batch
 
-        with torch.no_grad():
-            codes, _ = self.model.compression_model.encode(waveforms)
+        if self.use_code_cache:
+            codes = inputs
+        else:
+            with torch.no_grad():
+                codes, _ = self.model.compression_model.encode(inputs)
 
-        attributes, _ = self.model._prepare_tokens_and_attributes(descriptions, None)
-        condition_tensors = get_condition_tensor(self.model, attributes)
+        attributes = [ConditioningAttributes(text={'description': d}) for d in descriptions]
+        attributes = self.cfg_dropout(attributes)
+        if self.condition_cache is not None:
+            descriptions = [attr.text['description'] for attr in attributes]
+            condition_tensors = self.condition_cache.condition_tensors(descriptions, self.device)
+        else:
+            condition_tensors = get_condition_tensor(self.model, attributes)
 
         lm_output = self.model.lm.compute_predictions(
             codes=codes, conditions=[], condition_tensors=condition_tensors
         )
 
-        logits, mask = lm_output.logits[0], lm_output.mask[0].view(-1)
-        codes = F.one_hot(codes[0], 2048).float()
-        masked_logits = logits.view(-1, 2048)[mask]
-        masked_codes = codes.view(-1, 2048)[mask]
-        loss = F.cross_entropy(masked_logits, masked_codes)
+        loss, codebook_losses = multi_codebook_loss(lm_output.logits, codes, lm_output.mask)
 
-        self.log("train_loss", loss)
+        batch_size = codes.shape[0]
+        self.log("train_loss", loss, prog_bar=True, batch_size=batch_size)
+        for k, codebook_loss in enumerate(codebook_losses):
+            self.log(f"train_ce_q{k + 1}", codebook_loss, batch_size=batch_size)
         return loss
 
+    def on_save_checkpoint(self, checkpoint):
+        # เก็บเฉพาะ parameter ที่เทรน (ทั้ง LM หรือแค่ adapter) ไม่รวม weights ที่ freeze
+        trainable = {f"lm.{name}" for name, p in self.lm.named_parameters() if p.requires_grad}
+        checkpoint['state_dict'] = {k: v for k, v in checkpoint['state_dict'].items() if k in trainable}
+        checkpoint['lora_rank'] = self.lora_rank
+
+    def on_load_checkpoint(self, checkpoint):
+        if checkpoint.get('lora_rank', 0) != self.lora_rank:
+            raise ValueError(f"checkpoint was trained with --lora-rank {checkpoint.get('lora_rank', 0)}")
+        # เติม weights ที่ freeze จากโมเดลปัจจุบัน ให้ load_state_dict แบบ strict ของ Lightning ผ่าน
+        state_dict = self.state_dict()
+        state_dict.update(checkpoint['state_dict'])
+        checkpoint['state_dict'] = state_dict
+
     def configure_optimizers(self):
-        return torch.optim.AdamW(self.model.lm.parameters(), lr=1e-5, betas=(0.9, 0.95), weight_decay=0.1)
+        params = [p for p in self.model.lm.parameters() if p.requires_grad]
+        return torch.optim.AdamW(params, lr=self.lr, betas=(0.9, 0.95), weight_decay=0.1)
+
+
+def multi_codebook_loss(logits, codes, mask):
+    # logits [B, K, T, card], codes/mask [B, K, T]
+    # ใช้ index targets แทน one-hot และเลือกเฉพาะตำแหน่งที่ mask ถูกต้อง (ตำแหน่งอื่นเป็น nan)
+    B, K, T, card = logits.shape
+    codebook_ids = torch.arange(K, device=codes.device).view(1, K, 1).expand(B, K, T)[mask]
+    ce = F.cross_entropy(logits[mask].float(), codes[mask], reduction='none')
+    totals = torch.zeros(K, device=ce.device, dtype=ce.dtype).index_add_(0, codebook_ids, ce)
+    counts = torch.bincount(codebook_ids, minlength=K).clamp(min=1)
+    codebook_losses = totals / counts
+    # ค่าเฉลี่ยของแต่ละ codebook เหมือน loss ของ audiocraft
+    return codebook_losses.mean(), codebook_losses
 
 
 def get_condition_tensor(model, attributes):
@@ -80,33 +212,165 @@ def get_condition_tensor(model, attributes):
     return model.lm.condition_provider(tokenized)
 
 
+def prepare_code_cache(metadata_file, audio_dir, cache_dir, segment_duration, sample_rate, rebuild=False,
+                       model_name=MODEL_NAME):
+    # encode ทุกคลิปครั้งเดียว แล้วเก็บเป็น int16 shards สำหรับทุก epoch
+    dataset = DescriptiveAudioDataset(metadata_file, audio_dir, segment_duration, sample_rate)
+    index = code_cache.read_index(cache_dir)
+    if index is not None and not rebuild:
+        settings = index['settings']
+        checkpoint = code_cache.checkpoint_identity(model_name)
+        if (settings.get('model') == model_name
+                and checkpoint is not None and settings.get('checkpoint') == checkpoint
+                and settings.get('sample_rate') == dataset.sample_rate
+                and settings.get('segment_duration') == dataset.segment_duration
+                and settings.get('manifest') == code_cache.file_digest(metadata_file)):
+            return
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    compression_model = load_compression_model(model_name, device=device)
+    code_cache.build_code_cache(compression_model, model_name, dataset, cache_dir, force=rebuild)
+    del compression_model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune MusicGen on descriptive Thai music clips")
+    parser.add_argument("--model", default=MODEL_NAME,
+                        help="pretrained MusicGen to fine-tune ('debug' for a tiny offline model)")
+    parser.add_argument("--metadata", default="/teamspace/studios/this_studio/segments3-new/segments3/data.json")
+    parser.add_argument("--audio-dir", default="/teamspace/studios/this_studio/segments3-new/segments3")
+    parser.add_argument("--segment-duration", type=int, default=30)
+    parser.add_argument("--sample-rate", type=int, default=22050)
+    parser.add_argument("--code-cache", default=None,
+                        help="directory of precomputed EnCodec codes; built on first use")
+    parser.add_argument("--rebuild-code-cache", action="store_true",
+                        help="re-encode every clip even if the cache looks up to date")
+    parser.add_argument("--precompute-only", action="store_true",
+                        help="only build the code cache, do not train")
+    parser.add_argument("--waveform-store", default=None,
+                        help="directory of the memory-mapped resampled corpus; built on first use")
+    parser.add_argument("--rebuild-waveform-store", action="store_true")
+    parser.add_argument("--cache-conditions", action="store_true",
+                        help="encode each unique description once and drop T5 during training")
+    parser.add_argument("--condition-cache", default=None,
+                        help="file to persist the cached text conditions (implies --cache-conditions)")
+    parser.add_argument("--no-word-dropout", action="store_true",
+                        help="allow the condition cache on models whose T5 conditioner uses word dropout; "
+                             "training then runs without it")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--accumulate-grad-batches", type=int, default=1,
+                        help="number of batches to accumulate before each optimizer step")
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--max-epochs", type=int, default=10)
+    parser.add_argument("--max-steps", type=int, default=-1)
+    parser.add_argument("--cpu-processes", type=int, default=0,
+                        help="data-parallel training on CPU with this many processes per node over gloo")
+    parser.add_argument("--num-nodes", type=int, default=1,
+                        help="nodes for --cpu-processes (set MASTER_ADDR, MASTER_PORT and NODE_RANK on each)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per process with --cpu-processes (default: cores / processes)")
+    parser.add_argument("--precision", default=None,
+                        help="Lightning precision (default 16-mixed on GPU, 32-true with --cpu-processes; "
+                             "bf16-mixed helps on CPUs with native bf16)")
+    parser.add_argument("--throughput-file", default=None, help="write samples/s of the run to this JSON file")
+    parser.add_argument("--checkpoint-every", type=int, default=500,
+                        help="save a checkpoint every N optimizer steps (0 = once per epoch)")
+    parser.add_argument("--keep-checkpoints", type=int, default=2, help="number of most recent checkpoints kept")
+    parser.add_argument("--checkpoint-dtype", choices=sorted(STORAGE_DTYPES), default=None,
+                        help="store checkpoint weights in this dtype; optimizer state stays fp32 (default fp32)")
+    parser.add_argument("--resume", default=None, help="checkpoint in checkpoints/ to continue training from")
+    parser.add_argument("--export-dtype", choices=sorted(STORAGE_DTYPES), default=None,
+                        help="also write the LM as memory-mappable .safetensors in this dtype")
+    parser.add_argument("--cfg-dropout", type=float, default=0.0,
+                        help="probability of training a batch on the null condition")
+    parser.add_argument("--lora-rank", type=int, default=0,
+                        help="train rank-r LoRA adapters instead of the full LM (0 = full fine-tune)")
+    parser.add_argument("--lora-alpha", type=float, default=16)
+    parser.add_argument("--lr", type=float, default=None,
+                        help="learning rate (default 1e-5, or 1e-4 with --lora-rank)")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
     L.seed_everything(42)
+    if args.cpu_processes:
+        # ทุก rank (Lightning รัน script นี้ซ้ำสำหรับ rank อื่น) ตั้งจำนวน thread ของตัวเอง
+        torch.set_num_threads(args.threads or threads_per_process(args.cpu_processes))
+
+    metadata_file = args.metadata
+    audio_dir = args.audio_dir
 
-    metadata_file = "/teamspace/studios/this_studio/segments3-new/segments3/data.json"
-    audio_dir = "/teamspace/studios/this_studio/segments3-new/segments3"
+    if args.code_cache and args.waveform_store:
+        raise SystemExit("--code-cache and --waveform-store are exclusive")
 
-    dataset_train = DescriptiveAudioDataset(metadata_file, audio_dir)
-    train_dataloader = DataLoader(dataset_train, batch_size=1, collate_fn=custom_collate, num_workers=4)
+    if args.waveform_store:
+        waveform_store.build_waveform_store(metadata_file, audio_dir, args.waveform_store, args.sample_rate,
+                                            force=args.rebuild_waveform_store)
 
-    model = MusicGenFinetuning()
+    if args.code_cache:
+        prepare_code_cache(metadata_file, audio_dir, args.code_cache, args.segment_duration, args.sample_rate,
+                           rebuild=args.rebuild_code_cache, model_name=args.model)
+        if args.precompute_only:
+            raise SystemExit(0)
 
-    # ตั้งค่า Checkpoint สำหรับบันทึกโมเดลอัตโนมัติ
+    dataset_train = DescriptiveAudioDataset(metadata_file, audio_dir, args.segment_duration, args.sample_rate,
+                                            code_cache_dir=args.code_cache,
+                                            waveform_store_dir=args.waveform_store)
+    train_dataloader = DataLoader(dataset_train, batch_size=args.batch_size, collate_fn=custom_collate,
+                                  num_workers=args.num_workers)
+
+    lr = args.lr or (1e-4 if args.lora_rank else 1e-5)
+    model = MusicGenFinetuning(use_code_cache=args.code_cache is not None, cfg_dropout=args.cfg_dropout,
+                               lora_rank=args.lora_rank, lora_alpha=args.lora_alpha, lr=lr, model_name=args.model,
+                               device='cpu' if args.cpu_processes else None)
+    if args.cache_conditions or args.condition_cache:
+        model.attach_condition_cache([item['description'] for item in dataset_train.metadata],
+                                     cache_path=args.condition_cache, allow_word_dropout=args.no_word_dropout)
+
+    # ตั้งค่า Checkpoint สำหรับบันทึกโมเดลอัตโนมัติ: เก็บ N อันล่าสุด (ตาม step) สำหรับ --resume
     checkpoint_callback = ModelCheckpoint(
         dirpath="checkpoints",
-        filename="musicgen-{epoch:02d}-{train_loss:.2f}",
-        save_top_k=1,
-        monitor="train_loss",
-        mode="min"
+        filename="musicgen-{epoch:02d}-{step:07d}",
+        every_n_train_steps=args.checkpoint_every or None,
+        save_top_k=args.keep_checkpoints,
+        monitor="step",
+        mode="max"
     )
 
+    callbacks = [checkpoint_callback]
+    if args.throughput_file:
+        callbacks.append(ThroughputLogger(args.throughput_file))
+    if args.cpu_processes:
+        # fp16 autocast ใช้บน CPU ไม่ได้ ค่าเริ่มต้นจึงเป็น fp32
+        device_args = dict(accelerator="cpu", devices=args.cpu_processes, num_nodes=args.num_nodes,
+                           strategy=cpu_strategy(args.cpu_processes, args.num_nodes),
+                           precision=args.precision or "32-true")
+    else:
+        device_args = dict(precision=args.precision or "16-mixed")
+
     trainer = L.Trainer(
-        precision="16-mixed",
-        max_epochs=10,
-        callbacks=[checkpoint_callback]
+        max_epochs=args.max_epochs,
+        max_steps=args.max_steps,
+        accumulate_grad_batches=args.accumulate_grad_batches,
+        callbacks=callbacks,
+        plugins=[SlimCheckpointIO(STORAGE_DTYPES.get(args.checkpoint_dtype))],
+        **device_args
     )
-    trainer.fit(model, train_dataloader)
+    trainer.fit(model, train_dataloader, ckpt_path=args.resume)
+    if not trainer.is_global_zero:
+        raise SystemExit(0)
 
     os.makedirs("saved_models", exist_ok=True)
+    if args.lora_rank:
+        save_adapter(model.model.lm, "saved_models/finetuned_musicgen_lora.safetensors", args.model)
+        size_mb = os.path.getsize("saved_models/finetuned_musicgen_lora.safetensors") / 1e6
+        print(f"✅ adapter ({size_mb:.1f} MB) ถูกบันทึกไว้ที่: saved_models/finetuned_musicgen_lora.safetensors")
+        raise SystemExit(0)
     torch.save(model.model.lm.state_dict(), "saved_models/finetuned_musicgen_lm3.pt")
     print("✅ โมเดลถูกบันทึกไว้ที่: saved_models/finetuned_musicgen_lm3.pt")
+    if args.export_dtype:
+        save_weights(model.model.lm.state_dict(), "saved_models/finetuned_musicgen_lm3.safetensors",
+                     dtype=STORAGE_DTYPES[args.export_dtype])
+        print("✅ แปลงเป็น saved_models/finetuned_musicgen_lm3.safetensors สำหรับโหลดแบบ mmap")
@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+import torch
+
+from code_cache import file_digest
+from SplitSong import stream_mono
+
+INDEX_FILE = "index.json"
+DATA_FILE = "waveforms.f32"
+
+
+def read_index(store_dir):
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def is_store_valid(store_dir, metadata_path, sample_rate):
+    index = read_index(store_dir)
+    return (index is not None
+            and index['sample_rate'] == sample_rate
+            and index['manifest'] == file_digest(metadata_path))
+
+
+def build_waveform_store(metadata_path, audio_dir, store_dir, sample_rate, force=False):
+    # แปลงทั้ง corpus เป็น mono float32 ที่ sample rate ของการเทรนครั้งเดียว ต่อกันเป็นไฟล์เดียว
+    if not force and is_store_valid(store_dir, metadata_path, sample_rate):
+        print(f"✅ waveform store is up to date: {store_dir}")
+        return read_index(store_dir)
+
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    os.makedirs(store_dir, exist_ok=True)
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    offsets, lengths = [], []
+    total = 0
+    with open(os.path.join(store_dir, DATA_FILE), 'wb') as out:
+        for i, item in enumerate(metadata):
+            length = 0
+            for chunk in stream_mono(os.path.join(audio_dir, item['audio']), sample_rate):
+                data = chunk.numpy().astype(np.float32, copy=False)
+                out.write(data.tobytes())
+                length += data.shape[1]
+            offsets.append(total)
+            lengths.append(length)
+            total += length
+            print(f"stored {i + 1}/{len(metadata)}", end='\r')
+
+    index = {
+        'sample_rate': sample_rate,
+        'manifest': file_digest(metadata_path),
+        'count': len(metadata),
+        'total_samples': total,
+        'offsets': offsets,
+        'lengths': lengths,
+    }
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    print(f"\n✅ waveform store written to: {store_dir} ({total / sample_rate / 3600:.2f} h)")
+    return index
+
+
+class WaveformStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = read_index(store_dir)
+        if self.index is None:
+            raise FileNotFoundError(f"no waveform store index in {store_dir}")
+        self.sample_rate = self.index['sample_rate']
+        self.offsets = self.index['offsets']
+        self.lengths = self.index['lengths']
+        self._data = None
+
+    def __len__(self):
+        return self.index['count']
+
+    @property
+    def data(self):
+        # mode 'c' (copy-on-write) ทำให้ torch.from_numpy ใช้หน่วยความจำเดียวกับไฟล์ได้โดยไม่ต้อง copy
+        if self._data is None:
+            self._data = np.memmap(os.path.join(self.store_dir, DATA_FILE), dtype=np.float32, mode='c',
+                                   shape=(self.index['total_samples'],))
+        return self._data
+
+    def window(self, idx, num_samples, random_offset=True):
+        offset, length = self.offsets[idx], self.lengths[idx]
+        start = 0
+        if random_offset and length > num_samples:
+            start = int(torch.randint(0, length - num_samples + 1, (1,)))
+        end = min(start + num_samples, length)
+        waveform = torch.from_numpy(self.data[offset + start:offset + end]).view(1, -1)
+        if waveform.shape[1] < num_samples:
+            waveform = torch.nn.functional.pad(waveform, (0, num_samples - waveform.shape[1]))
+        return waveform
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state